@@ -1,3 +1,8 @@
-from .app import create_app
+def __getattr__(name):
+    """the app, created on first use, so the command line tools import the package without the web server"""
+    if name == "api":
+        from .app import create_app
 
-api = create_app()
+        globals()["api"] = create_app()
+        return globals()["api"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
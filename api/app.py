@@ -1,6 +1,7 @@
 """api"""
 
 import logging
+import os
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -8,6 +9,8 @@ from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
 from .assets import STATIC_DIR
+from .data import DEFAULT_DATABASE_PATH, calculator_data
+from .executor import calculation_pool
 from .logger import log_manager
 from .ratelimiter import limiter
 from .route import router
@@ -37,8 +40,15 @@ async def api_startup():
     # logging set up
     log_manager.setup_application_logging()
     logging.info("API starting up...")
+    # load the calculator data in the background; /readyz reports when it is in
+    calculator_data.start()
+    # reload the release whenever the donor database file is replaced
+    if interval := float(os.getenv("MATCHBOX_RELOAD_INTERVAL", 0)):
+        calculator_data.watch(calculator_data.settings.get("db_path") or DEFAULT_DATABASE_PATH, interval)
 
 
 async def api_shutdown():
     """API shut down"""
     logging.info("API shutting down...")
+    calculator_data.stop_watching()
+    calculation_pool.shutdown()
@@ -0,0 +1,323 @@
+"""batch calculation over whole waiting lists, a (donor_set, blood group) group at a time"""
+
+from collections import defaultdict
+from datetime import UTC, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from .bitset import BLOOD_GROUPS, DonorEngine
+from .calculator import (
+    GRADE_ORDER,
+    GRADE_TABLE,
+    MISMATCH_LOCI,
+    Results,
+    grade_counts,
+    grade_histogram,
+    mismatch_weights,
+    tally_results,
+    widened_recipient,
+)
+from .input_validation import AntigenValidationError, validate_recipient_hla, validate_specificities
+from .recipient import canonicalise_recipient_hla
+
+# recipients per matrix product, at most
+BLOCK_SIZE = 256
+# recipients x donor rows per matrix product, at most; each cell takes a few tens of bytes of intermediates
+BLOCK_CELLS = 1 << 21
+DONOR_SETS = (0, 1)
+CALCULATION_CONTEXTS = {
+    0: {
+        "donor_cohort": "all_donors",
+        "calculation_mode": "all_donors_reference",
+    },
+    1: {
+        "donor_cohort": "dp_typed_only",
+        "calculation_mode": "dp_typed_subset",
+    },
+}
+
+
+class BatchRecord(BaseModel):
+    """one recipient of a batch, loosely typed in the forms the /calc/ query takes and checked by ``prepare_record``"""
+
+    id: Union[str, int]
+    bg: str
+    specs: Optional[str] = None
+    recip_hla: Optional[str] = None
+    donor_set: int = 0
+
+
+class BatchRecordError(ValueError):
+    """A batch record field is outside what the calculator accepts."""
+
+    def __init__(self, field: str, invalid: Sequence[object], message: str):
+        self.field = field
+        self.invalid = list(invalid)
+        super().__init__(message)
+
+    def detail(self) -> Dict[str, object]:
+        """JSON-safe error detail, shaped like an AntigenValidationError's."""
+        return {"field": self.field, "invalid": self.invalid, "message": str(self)}
+
+
+class PreparedRecord(BaseModel):
+    """a validated record, with its inputs in calculator form"""
+
+    model_config = ConfigDict(frozen=True)
+
+    bg: str
+    donor_set: int
+    specs: List[str]
+    recip_hla: Optional[str]
+    recip_hla_used: List[str]
+    recip_hla_conversions: Dict[str, str]
+    recipient_bdr: Dict[str, Set[str]]
+
+
+def group_recipient_hla(recip_hla: Iterable[str]) -> Dict[str, Set[str]]:
+    """group canonical recipient HLA by matchability locus"""
+    grouped = defaultdict(set)
+    for hla in recip_hla:
+        grouped["B" if hla.startswith("B") else "DR"].add(hla)
+    return grouped
+
+
+def prepare_record(
+    bg: str,
+    specs: Optional[str],
+    recip_hla: Optional[str],
+    donor_set: int,
+    data,
+) -> PreparedRecord:
+    """validate one calculation's inputs the way /calc/ does
+
+    Raises AntigenValidationError or BatchRecordError, both of which carry a
+    ``detail()`` for the response.
+    """
+    if bg not in BLOOD_GROUPS:
+        raise BatchRecordError("bg", [bg], f"unsupported bg value: {bg!r}")
+    if donor_set not in DONOR_SETS:
+        raise BatchRecordError("donor_set", [donor_set], f"unsupported donor_set value: {donor_set!r}")
+
+    recip_hla_list, recip_hla_conversions = canonicalise_recipient_hla(
+        recip_hla.split(",") if recip_hla else [],
+        data.mantigens,
+        data.broad_split.get("split_to_broad", {}),
+    )
+    spec_list = [] if not specs else specs.split(",")
+    validate_specificities(spec_list, data.antigens)
+    validate_recipient_hla(recip_hla_list, data.mantigens)
+    return PreparedRecord(
+        bg=bg,
+        donor_set=donor_set,
+        specs=spec_list,
+        recip_hla=recip_hla,
+        recip_hla_used=recip_hla_list,
+        recip_hla_conversions=recip_hla_conversions,
+        recipient_bdr=group_recipient_hla(recip_hla_list),
+    )
+
+
+def group_tallies(
+    donors: DonorEngine,
+    specs: Sequence[List[str]],
+    recipients: Sequence[Dict[str, Set[str]]],
+    hla_bdr: Dict[str, List[str]],
+    ag_defaults: Dict[str, str],
+    block_size: int = BLOCK_SIZE,
+) -> List[Union[Tuple[int, Optional[np.ndarray]], ValueError]]:
+    """each recipient's (available donors, grade histogram) against one partition
+
+    The histogram counts compatible donors per grade in GRADE_ORDER, and is
+    None for a recipient without B/DR antigens; a recipient that cannot be
+    graded gets the ValueError grading raised for it instead. These are plain
+    sums over donors, so tallies of disjoint blocks of a cohort add up to the
+    tally of the whole.
+
+    Incompatibility and B/DR counts are recipients x donors matrix products over
+    the partition's 0/1 indicators; float32 holds the small integer counts
+    exactly and lets BLAS do the work. Recipients go through them in blocks of
+    at most ``block_size``, fewer against a partition large enough that the
+    block would exceed BLOCK_CELLS.
+    """
+    spec_columns = list(dict.fromkeys(ag for recipient_specs in specs for ag in recipient_specs))
+    donor_specs = donors.indicators(spec_columns).astype(np.float32)
+    spec_position = {ag: n for n, ag in enumerate(spec_columns)}
+    recipient_specs = np.zeros((len(specs), len(spec_columns)), dtype=np.float32)
+    for row, recipient_spec in enumerate(specs):
+        recipient_specs[row, [spec_position[ag] for ag in recipient_spec]] = 1
+
+    # every recipient starts from the empty recipient's weights, then has the
+    # antigens it holds (widened by the defaults) struck off at their locus
+    bdr_columns, base_weights = mismatch_weights(donors.columns, {}, hla_bdr, ag_defaults)
+    donor_bdr = donors.indicators(bdr_columns).astype(np.float32)
+    bdr_position = {column: n for n, column in enumerate(bdr_columns)}
+    weights = np.repeat(base_weights[np.newaxis].astype(np.float32), len(recipients), axis=0)
+    for row, recipient in enumerate(recipients):
+        for n, locus in enumerate(MISMATCH_LOCI):
+            for antigen in widened_recipient(recipient, locus, ag_defaults):
+                if antigen in bdr_position:
+                    weights[row, bdr_position[antigen], n] = 0
+
+    donor_weights = donors.row_weights  # donors behind each row of a compacted partition
+    tallies: List[Union[Tuple[int, Optional[np.ndarray]], ValueError]] = []
+    n_grades = len(GRADE_ORDER)
+    block_size = max(1, min(block_size, BLOCK_CELLS // max(donors.n_rows, 1)))
+    for start in range(0, len(specs), block_size):
+        block = slice(start, start + block_size)
+        compatible = (recipient_specs[block] @ donor_specs.T) == 0
+        b_mm = np.rint(weights[block, :, 0] @ donor_bdr.T).astype(np.int64)
+        dr_mm = np.rint(weights[block, :, 1] @ donor_bdr.T).astype(np.int64)
+        n_rows = compatible.shape[0]
+        invalid = (compatible & ((b_mm > 2) | (dr_mm > 2))).any(axis=1)
+        grades = GRADE_TABLE[np.minimum(b_mm, 2), np.minimum(dr_mm, 2)]
+        keys = (np.arange(n_rows)[:, np.newaxis] * n_grades + grades)[compatible]
+        if donor_weights is None:
+            available = compatible.sum(axis=1)
+            key_weights = None
+        else:
+            available = compatible @ donor_weights
+            key_weights = np.broadcast_to(donor_weights, compatible.shape)[compatible]
+        histograms = np.bincount(keys, weights=key_weights, minlength=n_rows * n_grades).reshape(n_rows, n_grades)
+        for row in range(n_rows):
+            if recipients[start + row] and invalid[row]:
+                try:  # raises the same error a Calculator would for this recipient
+                    row_weights = None if donor_weights is None else donor_weights[compatible[row]]
+                    grade_counts(b_mm[row, compatible[row]], dr_mm[row, compatible[row]], weights=row_weights)
+                except ValueError as exc:
+                    tallies.append(exc)
+                    continue
+            histogram = histograms[row].astype(np.int64) if recipients[start + row] else None
+            tallies.append((int(available[row]), histogram))
+    return tallies
+
+
+def calculate_group(
+    donors: DonorEngine,
+    abo: str,
+    specs: Sequence[List[str]],
+    recipients: Sequence[Dict[str, Set[str]]],
+    hla_bdr: Dict[str, List[str]],
+    ag_defaults: Dict[str, str],
+    matchability_bands: Dict[str, Dict[int, int]],
+    block_size: int = BLOCK_SIZE,
+) -> List[Union[Results, ValueError]]:
+    """Results for many recipients of one blood group against one partition
+
+    Each entry is the Results a Calculator would return for that recipient, or
+    the ValueError grading raised for it, derived from ``group_tallies``.
+    """
+    total = len(donors)
+    if not total:
+        return [ValueError(f"no donors of blood group {abo} in this donor set") for _ in specs]
+    outcomes: List[Union[Results, ValueError]] = []
+    for tally in group_tallies(donors, specs, recipients, hla_bdr, ag_defaults, block_size):
+        if isinstance(tally, ValueError):
+            outcomes.append(tally)
+            continue
+        available, histogram = tally
+        match_counts = None if histogram is None else grade_histogram(histogram)
+        outcomes.append(tally_results(total, total - available, match_counts, matchability_bands, abo))
+    return outcomes
+
+
+def group_records(
+    records: Sequence[BatchRecord], data
+) -> Tuple[List[Tuple[int, None, Exception]], Dict[Tuple[int, str], List[Tuple[int, PreparedRecord]]]]:
+    """validate every record, and group the valid ones by (donor_set, blood group)
+
+    Returns (position, None, error) for each invalid record, and each group's
+    (position, prepared record) members in input order.
+    """
+    invalid: List[Tuple[int, None, Exception]] = []
+    groups: Dict[Tuple[int, str], List[Tuple[int, PreparedRecord]]] = defaultdict(list)
+    for position, record in enumerate(records):
+        try:
+            prepared = prepare_record(record.bg, record.specs, record.recip_hla, record.donor_set, data)
+        except (AntigenValidationError, BatchRecordError) as exc:
+            invalid.append((position, None, exc))
+            continue
+        groups[(prepared.donor_set, prepared.bg)].append((position, prepared))
+    return invalid, groups
+
+
+def calculate_members(
+    members: Sequence[Tuple[int, PreparedRecord]], data
+) -> List[Tuple[int, PreparedRecord, Union[Results, ValueError]]]:
+    """(position, prepared record, Results or error) for members of one (donor_set, blood group) group"""
+    if not members:
+        return []
+    donor_set, bg = members[0][1].donor_set, members[0][1].bg
+    outcomes = calculate_group(
+        data.partitions[(donor_set, bg)],
+        bg,
+        [prepared.specs for _, prepared in members],
+        [prepared.recipient_bdr for _, prepared in members],
+        data.mantigens,
+        data.antigen_defaults,
+        data.mbands,
+    )
+    return [(position, prepared, outcome) for (position, prepared), outcome in zip(members, outcomes)]
+
+
+def run_batch(
+    records: Sequence[BatchRecord], data
+) -> Iterator[Tuple[int, Optional[PreparedRecord], Union[Results, Exception]]]:
+    """calculate every record, one (donor_set, blood group) group at a time
+
+    Yields (position, prepared record, Results) for each record, or (position,
+    None, error) for one that failed validation. Invalid records come first,
+    then each group as soon as it is computed; callers that need input order
+    sort on position.
+    """
+    invalid, groups = group_records(records, data)
+    yield from invalid
+    for members in groups.values():
+        yield from calculate_members(members, data)
+
+
+def batch_items(data, records: Sequence[BatchRecord]) -> Iterator[Tuple[int, dict]]:
+    """(position, /calc/batch item) for every record, in the order ``run_batch`` calculates them"""
+    for position, prepared, outcome in run_batch(records, data):
+        record_id = records[position].id
+        if isinstance(outcome, Results):
+            yield position, {"id": record_id, "result": calculation_response(prepared, outcome, data)}
+        else:
+            yield position, {"id": record_id, "error": error_detail(outcome)}
+
+
+def calculate_batch(data, records: Sequence[BatchRecord]) -> List[dict]:
+    """the /calc/batch items, in input order, for loaded data"""
+    items = [None] * len(records)
+    for position, item in batch_items(data, records):
+        items[position] = item
+    return items
+
+
+def calculation_response(prepared: PreparedRecord, results: Results, data, total: Optional[int] = None) -> dict:
+    """the /calc/ response body for one calculation
+
+    ``total`` is the donor set's size, for data that holds no donors.
+    """
+    return {
+        "bg": prepared.bg,
+        "specs": prepared.specs,
+        "results": results,
+        "total": len(data.donors[prepared.donor_set]) if total is None else total,
+        "donor_set": prepared.donor_set,
+        **CALCULATION_CONTEXTS[prepared.donor_set],
+        "calculated_at": datetime.now(UTC),
+        "provenance": data.provenance,
+        "recip_hla": prepared.recip_hla,
+        "recip_hla_used": prepared.recip_hla_used or None,
+        "recip_hla_conversions": prepared.recip_hla_conversions,
+    }
+
+
+def error_detail(error: Exception) -> dict:
+    """JSON-safe detail for a record that could not be calculated"""
+    if isinstance(error, (AntigenValidationError, BatchRecordError)):
+        return error.detail()
+    return {"field": None, "invalid": [], "message": str(error)}
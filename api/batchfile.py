@@ -0,0 +1,249 @@
+"""batch files: waiting lists read from CSV or TSV, results written as TSV or JSON lines of profile export rows"""
+
+import csv
+import json
+import math
+import re
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from pydantic import ValidationError
+
+from .batch import BatchRecord, BatchRecordError
+from .parser import parse_donor_type
+
+DP_TYPED_DONOR_SET = 1
+PROFILE_EXPORT_SCHEMA_VERSION = 2
+PROFILE_HEADERS = (
+    "CRF (%)",
+    "Matchability",
+    "Favourable",
+    "Available",
+    "Recipient HLA",
+    "Unacceptable Specs",
+    "Removed",
+    "Added",
+    "Calculated At (UTC)",
+    "Blood Group",
+    "Donor Set",
+    "Donor Cohort",
+    "Calculation Mode",
+    "Calculation Cohort Size",
+    "Matchability Status",
+    "Recipient HLA Used",
+    "Recipient HLA Conversions",
+    "Upstream Source File",
+    "Upstream Source Size Signature",
+    "Donor Database",
+    "Donor Database SHA-256",
+    "Donor Table",
+    "Matchability Band Version",
+    "Data Release",
+    "Export Schema Version",
+)
+BATCH_HEADERS = (*PROFILE_HEADERS, "Recipient ID", "Error")
+RECORD_FIELDS = ("id", "bg", "specs", "recip_hla", "donor_set")
+# escapeTsvCell's /^[\s\u0000-\u001f]*[=+\-@]/, spelling out JavaScript's \s, which is not Python's
+FORMULA_PREFIX = re.compile("[ \u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff\x00-\x1f]*[=+\\-@]")
+
+# a recipient's id as given, and its record or why it could not be read
+InputRow = Tuple[str, Union[BatchRecord, BatchRecordError]]
+
+
+def normalise_tokens(text: Optional[str], vocabulary: Iterable[str]) -> Optional[str]:
+    """pasted antigen tokens as a comma-separated list of the vocabulary's forms
+
+    Tokens that cannot be resolved are kept as given, so that validation
+    rejects them by name.
+    """
+    if not text or not text.strip():
+        return None
+    found, problems = parse_donor_type(text, list(vocabulary))
+    return ",".join([*found, *(problem.token for problem in problems)])
+
+
+def read_records(
+    source: TextIO,
+    spec_vocabulary: Iterable[str],
+    recipient_vocabulary: Iterable[str],
+    delimiter: Optional[str] = None,
+) -> Iterator[InputRow]:
+    """the recipients of a CSV or TSV waiting list, with their specs and HLA normalised
+
+    The delimiter is sniffed from the header line unless given. Columns other
+    than id, bg, specs, recip_hla and donor_set are ignored.
+    """
+    spec_vocabulary, recipient_vocabulary = list(spec_vocabulary), list(recipient_vocabulary)
+    header = source.readline()
+    delimiter = delimiter or ("\t" if "\t" in header else ",")
+    fields = [field.strip().lower() for field in next(csv.reader([header], delimiter=delimiter), [])]
+    missing = [field for field in ("id", "bg") if field not in fields]
+    if missing:
+        raise ValueError(f"batch file has no {', '.join(missing)} column")
+    for row, values in enumerate(csv.DictReader(source, fieldnames=fields, delimiter=delimiter), start=1):
+        values = {field: (values.get(field) or "").strip() for field in RECORD_FIELDS}
+        if not any(values.values()):
+            continue
+        try:
+            record = BatchRecord(
+                id=values["id"],
+                bg=values["bg"].upper(),
+                specs=normalise_tokens(values["specs"], spec_vocabulary),
+                recip_hla=normalise_tokens(values["recip_hla"], recipient_vocabulary),
+                donor_set=values["donor_set"] or 0,
+            )
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            field = str(error["loc"][0]) if error["loc"] else None
+            yield values["id"], BatchRecordError(field, [values.get(field, "")], f"row {row}: {error['msg']}")
+            continue
+        yield values["id"], record
+
+
+def profile_record(response: Dict[str, Any]) -> Dict[str, Any]:
+    """the browser's profile record (buildProfileRecord) for one /calc/-shaped JSON response"""
+    results = response["results"]
+    dp_typed_subset = response["donor_set"] == DP_TYPED_DONOR_SET
+    has_matchability = results.get("matchability") is not None and results.get("favourable") is not None
+    if dp_typed_subset:
+        matchability_status = "not_applicable_dp_typed_subset"
+    else:
+        matchability_status = "calculated" if has_matchability else "not_calculated"
+    return {
+        "crf": None if results.get("crf") is None else results["crf"] * 100,
+        "matchability": None if dp_typed_subset else results.get("matchability"),
+        "favourable": None if dp_typed_subset else results.get("favourable"),
+        "available": results.get("available"),
+        "recip_hla": response.get("recip_hla") or "",
+        "specs": list(response.get("specs") or []),
+        "removed": [],
+        "added": [],
+        "calculated_at": response.get("calculated_at"),
+        "bg": response.get("bg"),
+        "donor_set": response["donor_set"],
+        "donor_cohort": response.get("donor_cohort"),
+        "calculation_mode": response.get("calculation_mode"),
+        "cohort_size": response.get("total"),
+        "matchability_status": matchability_status,
+        "recip_hla_used": list(response.get("recip_hla_used") or []),
+        "recip_hla_conversions": dict(response.get("recip_hla_conversions") or {}),
+        "provenance": dict(response.get("provenance") or {}),
+        "export_schema_version": PROFILE_EXPORT_SCHEMA_VERSION,
+    }
+
+
+def _list(value: List[str]) -> str:
+    """a list cell (listForTsv)"""
+    return ",".join(value) if value else ""
+
+
+def _mapping(value: Dict[str, Any]) -> str:
+    """a mapping cell, as compact JSON (mappingForTsv)"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False) if value else ""
+
+
+def profile_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """a profile record's TSV cells by header (profileToTsvRow)"""
+    provenance = record["provenance"]
+    return {
+        "CRF (%)": record["crf"],
+        "Matchability": record["matchability"],
+        "Favourable": record["favourable"],
+        "Available": record["available"],
+        "Recipient HLA": record["recip_hla"],
+        "Unacceptable Specs": _list(record["specs"]),
+        "Removed": _list(record["removed"]),
+        "Added": _list(record["added"]),
+        "Calculated At (UTC)": record["calculated_at"],
+        "Blood Group": record["bg"],
+        "Donor Set": record["donor_set"],
+        "Donor Cohort": record["donor_cohort"],
+        "Calculation Mode": record["calculation_mode"],
+        "Calculation Cohort Size": record["cohort_size"],
+        "Matchability Status": record["matchability_status"],
+        "Recipient HLA Used": _list(record["recip_hla_used"]),
+        "Recipient HLA Conversions": _mapping(record["recip_hla_conversions"]),
+        "Upstream Source File": provenance.get("upstream_source_file"),
+        "Upstream Source Size Signature": provenance.get("upstream_source_file_size_signature"),
+        "Donor Database": provenance.get("donor_database"),
+        "Donor Database SHA-256": provenance.get("donor_database_sha256"),
+        "Donor Table": provenance.get("donor_table"),
+        "Matchability Band Version": provenance.get("matchability_band_version"),
+        "Data Release": provenance.get("data_release"),
+        "Export Schema Version": record["export_schema_version"],
+    }
+
+
+def js_number(value: Union[int, float]) -> str:
+    """a number as JavaScript's String() prints it
+
+    The shortest digits that round-trip, as Python's repr gives them, laid out
+    by the ECMAScript Number::toString rules: plain between 1e-7 and 1e21,
+    otherwise an exponent with no padding (1e-7, 1.5e+21).
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "0"
+    sign, digits, exponent = Decimal(repr(value)).normalize().as_tuple()
+    digits = "".join(map(str, digits))
+    k, n = len(digits), len(digits) + exponent  # value = 0.digits * 10**n
+    if k <= n <= 21:
+        text = digits + "0" * (n - k)
+    elif 0 < n <= 21:
+        text = f"{digits[:n]}.{digits[n:]}"
+    elif -6 < n <= 0:
+        text = f"0.{'0' * -n}{digits}"
+    else:
+        mantissa = digits if k == 1 else f"{digits[0]}.{digits[1:]}"
+        text = f"{mantissa}e{'+' if n > 0 else '-'}{abs(n - 1)}"
+    return f"-{text}" if sign else text
+
+
+def escape_tsv_cell(value: Any) -> str:
+    """one TSV cell as the browser writes it (escapeTsvCell)
+
+    Numbers print as JavaScript prints them; text that a spreadsheet would read
+    as a formula, after any leading whitespace or control characters, is
+    prefixed with a quote; a cell holding a tab, newline or double quote is
+    quoted.
+    """
+    if value is None:
+        return ""
+    text = js_number(value) if isinstance(value, (int, float)) else str(value)
+    if isinstance(value, str) and FORMULA_PREFIX.match(text):
+        text = f"'{text}"
+    if any(char in text for char in '\t\r\n"'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def write_tsv(rows: Iterable[Tuple[Union[str, int], Dict[str, Any]]], sink: TextIO) -> int:
+    """write (id, /calc/batch item) rows as TSV, header first; returns the rows written"""
+    sink.write("\t".join(map(escape_tsv_cell, BATCH_HEADERS)) + "\n")
+    written = 0
+    for record_id, item in rows:
+        cells = profile_row(profile_record(item["result"])) if item.get("result") else {}
+        cells = {**cells, "Recipient ID": record_id, "Error": _mapping(item.get("error"))}
+        sink.write("\t".join(escape_tsv_cell(cells.get(header)) for header in BATCH_HEADERS) + "\n")
+        written += 1
+    return written
+
+
+def write_jsonl(rows: Iterable[Tuple[Union[str, int], Dict[str, Any]]], sink: TextIO) -> int:
+    """write (id, /calc/batch item) rows as JSON lines of profile records; returns the rows written"""
+    written = 0
+    for record_id, item in rows:
+        if item.get("result"):
+            line = {"id": record_id, **profile_record(item["result"])}
+        else:
+            line = {"id": record_id, "error": item.get("error")}
+        sink.write(json.dumps(line, ensure_ascii=False) + "\n")
+        written += 1
+    return written
@@ -0,0 +1,388 @@
+"""packed donor bitsets"""
+
+from abc import ABC, abstractmethod
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from pandas import Categorical, DataFrame, Index, Series
+
+WORD_BITS = 64
+# donor table columns that are not antigen indicators
+NON_ANTIGEN_COLUMNS = ("id", "bg")
+BLOOD_GROUPS = ("A", "B", "O", "AB")
+
+
+def pack_indicators(indicators: np.ndarray) -> np.ndarray:
+    """pack an (n_donors, n_columns) boolean matrix into (n_donors, n_words) uint64
+
+    Column n lands in bit n % 64 of word n // 64. There is always at least one
+    word, so an empty antigen list still gives a well-formed (all-zero) matrix.
+    """
+    n_rows, n_columns = indicators.shape
+    n_words = max(1, -(-n_columns // WORD_BITS))
+    padded = np.zeros((n_rows, n_words * WORD_BITS), dtype=bool)
+    padded[:, :n_columns] = indicators
+    packed = np.packbits(padded, axis=1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8").astype(np.uint64, copy=False)
+
+
+def owned_buffers(*values: Any) -> Dict[int, int]:
+    """{id: bytes} of the memory held by arrays, frames and donor structures, each buffer once
+
+    A view counts as its base array. Pages of a mapped file, such as a donor
+    store or snapshot, are left out.
+    """
+    buffers: Dict[int, int] = {}
+    for value in values:
+        if isinstance(value, np.ndarray):
+            while isinstance(value.base, np.ndarray):
+                value = value.base
+            if not isinstance(value, np.memmap):
+                buffers[id(value)] = value.nbytes
+        elif isinstance(value, DataFrame):
+            buffers[id(value)] = int(value.memory_usage(deep=True).sum())
+        elif hasattr(value, "buffers"):
+            buffers.update(value.buffers())
+    return buffers
+
+
+class DonorEngine(ABC):
+    """what the calculator, batch, marginal and planning paths ask of a cohort of donors
+
+    ``len`` counts donors and ``n_rows`` the rows behind them, each ``row_weights`` donors (None: one each).
+    """
+
+    columns: List[str]
+    abo: Optional[str]
+
+    def __len__(self) -> int:
+        weights = self.row_weights
+        return self.n_rows if weights is None else int(weights.sum())
+
+    @property
+    @abstractmethod
+    def n_rows(self) -> int:
+        """number of rows covered"""
+
+    @property
+    @abstractmethod
+    def row_weights(self) -> Optional[np.ndarray]:
+        """donors behind each covered row; None when every row is one donor"""
+
+    @property
+    @abstractmethod
+    def index(self) -> Index:
+        """labels of the covered rows"""
+
+    @property
+    @abstractmethod
+    def frame(self) -> DataFrame:
+        """the covered donors as a frame"""
+
+    @abstractmethod
+    def select(self, selection: np.ndarray) -> "DonorEngine":
+        """the covered rows picked by boolean mask or sorted row numbers"""
+
+    @abstractmethod
+    def blood_group(self, abo: str) -> "DonorEngine":
+        """donors of one blood group"""
+
+    @abstractmethod
+    def partition(self, abo: str) -> "DonorEngine":
+        """donors of one blood group, laid out to be calculated against from then on"""
+
+    @abstractmethod
+    def compact(self) -> "DonorEngine":
+        """the same donors, each distinct phenotype held once; counts are unchanged"""
+
+    @abstractmethod
+    def hits(self, antigens: Iterable[str]) -> np.ndarray:
+        """number of the given antigens each row carries"""
+
+    @abstractmethod
+    def indicators(self, antigens: Iterable[str]) -> np.ndarray:
+        """(n_rows, n_antigens) 0/1 matrix for the given antigen columns"""
+
+    @abstractmethod
+    def weighted_counts(self, antigens: Sequence[str], weights: np.ndarray) -> np.ndarray:
+        """(n_rows, k) sums of the (antigens, k) weights over the antigens each row carries"""
+
+    @property
+    def nbytes(self) -> int:
+        """bytes of memory held, leaving out pages of a mapped file"""
+        return sum(self.buffers().values())
+
+    def buffers(self) -> Dict[int, int]:
+        """the memory held, by buffer (see owned_buffers)"""
+        return {}
+
+    def close(self) -> None:
+        """release anything held open for these donors, once they are no longer served"""
+
+    def _derive(self, **attributes) -> "DonorEngine":
+        """a copy of this object's references with some of them replaced"""
+        derived = object.__new__(type(self))
+        derived.__dict__.update(self.__dict__, **attributes)
+        return derived
+
+    def incompatible_count(self, specs: List[str]) -> int:
+        """number of donors carrying any of the specs, from ``hits`` alone"""
+        has_dsa = self.hits(specs) > 0
+        weights = self.row_weights
+        return int(has_dsa.sum()) if weights is None else int(weights[has_dsa].sum())
+
+    def split(self, specs: List[str]) -> tuple:
+        """split into (compatible, incompatible) on the recipient's specs"""
+        has_dsa = self.hits(specs) > 0
+        return self.select(~has_dsa), self.select(has_dsa)
+
+    def carrier_counts(
+        self, antigens: Sequence[str], columns: Sequence[str], weights: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """the donors carrying each antigen, grouped by their ``weighted_counts`` over columns
+
+        Returns the distinct (groups, k) counts and a (len(antigens), groups)
+        matrix of the donors of each group that carry each antigen.
+        """
+        groups, inverse = np.unique(self.weighted_counts(columns, weights), axis=0, return_inverse=True)
+        donors = self.row_weights if self.row_weights is not None else np.ones(self.n_rows, dtype=np.int64)
+        membership = np.zeros((self.n_rows, len(groups)), dtype=np.int64)
+        membership[np.arange(self.n_rows), inverse.reshape(-1)] = donors
+        return groups, self.indicators(antigens).T.astype(np.int64) @ membership
+
+
+class DonorBitsets(DonorEngine):
+    """donor antigen columns packed into uint64 bitsets, wrapping the frame they were built from
+
+    Selections share the cohort's words and hold only their row numbers; ``partition`` copies its words out.
+    """
+
+    def __init__(self, donors: DataFrame):
+        self.source = donors
+        self.abo: Optional[str] = None  # set on a single blood group partition
+        self.rows: Optional[np.ndarray] = None  # rows of the packed words covered; None: all
+        self.source_rows: Optional[np.ndarray] = None  # source row behind each packed row; None: same row
+        self.weights: Optional[np.ndarray] = None  # donors behind each packed row; None: one each
+        self.ids: Optional[np.ndarray] = None  # donor id of each packed row, when there is no source frame
+        self.columns: List[str] = [col for col in donors.columns if col not in NON_ANTIGEN_COLUMNS]
+        self.positions: Dict[str, int] = {col: n for n, col in enumerate(self.columns)}
+        codes, blood_groups = donors.get("bg", Series(index=donors.index, dtype=object)).factorize()
+        self.blood_groups = Index(list(blood_groups), dtype=object)
+        self._bg_codes = codes.astype(np.int8)
+        self._bits = pack_indicators(donors[self.columns].eq(1).to_numpy(dtype=bool))
+        self._bg_codes.flags.writeable = False
+        self._bits.flags.writeable = False
+
+    @classmethod
+    def from_arrays(
+        cls,
+        bits: np.ndarray,
+        bg_codes: np.ndarray,
+        blood_groups: Sequence[str],
+        columns: Sequence[str],
+        source_rows: Optional[np.ndarray] = None,
+        weights: Optional[np.ndarray] = None,
+        ids: Optional[np.ndarray] = None,
+        abo: Optional[str] = None,
+    ) -> "DonorBitsets":
+        """bitsets over words packed elsewhere, such as a mapped donor store
+
+        There is no source frame: ``frame`` is rebuilt from the words, and
+        ``index`` numbers rows by ``source_rows``. The arrays are used as given,
+        not copied.
+        """
+        bitsets = object.__new__(cls)
+        bitsets.__dict__.update(
+            source=None,
+            abo=abo,
+            rows=None,
+            source_rows=source_rows,
+            weights=weights,
+            ids=ids,
+            columns=list(columns),
+            positions={col: n for n, col in enumerate(columns)},
+            blood_groups=Index(list(blood_groups), dtype=object),
+            _bg_codes=bg_codes,
+            _bits=bits,
+        )
+        return bitsets
+
+    @property
+    def n_rows(self) -> int:
+        """number of packed rows covered"""
+        return len(self._bits) if self.rows is None else len(self.rows)
+
+    @property
+    def row_weights(self) -> Optional[np.ndarray]:
+        """donors behind each covered row; None when every row is one donor"""
+        if self.weights is None or self.rows is None:
+            return self.weights
+        return self.weights[self.rows]
+
+    def buffers(self) -> Dict[int, int]:
+        """the words, row numbers, weights, ids and source frame, by buffer"""
+        return owned_buffers(
+            self._bits, self._bg_codes, self.rows, self.source_rows, self.weights, self.ids, self.source
+        )
+
+    def _source_positions(self) -> Optional[np.ndarray]:
+        """source frame row numbers of the covered donors; None: the whole source"""
+        if self.rows is None:
+            return self.source_rows
+        return self.rows if self.source_rows is None else self.source_rows[self.rows]
+
+    @property
+    def bg_codes(self) -> np.ndarray:
+        """blood group of each donor, as a code into ``blood_groups``"""
+        return self._bg_codes if self.rows is None else self._bg_codes[self.rows]
+
+    @property
+    def index(self) -> Index:
+        """source frame labels of the covered rows"""
+        positions = self._source_positions()
+        if self.source is None:
+            return Index(np.arange(self.n_rows) if positions is None else positions)
+        return self.source.index if positions is None else self.source.index[positions]
+
+    @property
+    def frame(self) -> DataFrame:
+        """the donor rows covered by these bitsets, as a frame"""
+        positions = self._source_positions()
+        if self.source is None:
+            return self._rebuilt_frame()
+        return self.source if positions is None else self.source.iloc[positions]
+
+    def _rebuilt_frame(self) -> DataFrame:
+        """the covered rows as a frame, unpacked from the words"""
+        frame = DataFrame(self.indicators(self.columns).astype(np.int64), columns=self.columns, index=self.index)
+        frame.insert(0, "bg", np.asarray(Categorical.from_codes(self.bg_codes, self.blood_groups), dtype=object))
+        if self.ids is not None:
+            frame.insert(0, "id", self.ids if self.rows is None else self.ids[self.rows])
+        return frame
+
+    def select(self, selection: np.ndarray) -> "DonorBitsets":
+        """a subset sharing this cohort's packed words, by boolean mask or sorted row numbers"""
+        rows = np.flatnonzero(selection) if selection.dtype == bool else np.asarray(selection, dtype=np.intp)
+        rows = rows if self.rows is None else self.rows[rows]
+        rows.flags.writeable = False
+        return self._derive(rows=rows)
+
+    def mask(self, antigens: Iterable[str]) -> np.ndarray:
+        """one bitset row with a bit set for each antigen
+
+        Raises KeyError for an antigen with no donor column, as selecting the
+        column from the frame would.
+        """
+        antigens = list(antigens)
+        missing = [ag for ag in antigens if ag not in self.positions]
+        if missing:
+            raise KeyError(f"{missing} not in donor antigen columns")
+
+        mask = np.zeros(self._bits.shape[1], dtype=np.uint64)
+        for antigen in antigens:
+            word, bit = divmod(self.positions[antigen], WORD_BITS)
+            mask[word] |= np.uint64(1) << np.uint64(bit)
+        return mask
+
+    def _words(self, words: np.ndarray) -> np.ndarray:
+        """(n_donors, len(words)) gather of selected words, without the full row gather"""
+        if self.rows is None:
+            return self._bits[:, words]
+        return self._bits[np.ix_(self.rows, words)]
+
+    def hits(self, antigens: Iterable[str]) -> np.ndarray:
+        """number of the given antigens each donor carries
+
+        Only the words the mask touches are read, so a handful of specs costs a
+        handful of word columns regardless of how many antigens are packed.
+        """
+        mask = self.mask(antigens)
+        words = np.flatnonzero(mask)
+        return np.bitwise_count(self._words(words) & mask[words]).sum(axis=1, dtype=np.int64)
+
+    def indicators(self, antigens: Iterable[str]) -> np.ndarray:
+        """(n_donors, n_antigens) 0/1 matrix for the given antigen columns"""
+        antigens = list(antigens)
+        self.mask(antigens)  # same KeyError as a missing frame column
+        positions = np.array([self.positions[ag] for ag in antigens], dtype=np.int64)
+        words, bits = np.divmod(positions, WORD_BITS)
+        unique_words, word_of_column = np.unique(words, return_inverse=True)
+        gathered = self._words(unique_words)[:, word_of_column]
+        return ((gathered >> bits.astype(np.uint64)) & np.uint64(1)).astype(np.uint8)
+
+    def weighted_counts(self, antigens: Sequence[str], weights: np.ndarray) -> np.ndarray:
+        """(n_donors, k) sums of the (antigens, k) weights over the antigens each donor carries"""
+        return self.indicators(antigens).astype(np.int64, copy=False) @ weights
+
+    def phenotypes(self, antigens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """the distinct 0/1 rows over the given antigens, and which of them each donor has"""
+        phenotypes, codes = np.unique(self.indicators(antigens), axis=0, return_inverse=True)
+        return phenotypes, codes.reshape(-1)
+
+    def postings(self, antigens: Sequence[str]) -> Dict[str, np.ndarray]:
+        """sorted int32 rows of the donors carrying each antigen"""
+        indicators = self.indicators(antigens)
+        return {antigen: np.flatnonzero(indicators[:, n]).astype(np.int32) for n, antigen in enumerate(antigens)}
+
+    def blood_group(self, abo: str) -> "DonorBitsets":
+        """donors of one blood group"""
+        if self.abo is not None:
+            return self if self.abo == abo else self.select(np.zeros(self.n_rows, dtype=bool))
+        code = self.blood_groups.get_indexer([abo])[0]
+        if code < 0:  # no donors of this group; -1 is also the code for a missing bg
+            return self.select(np.zeros(self.n_rows, dtype=bool))
+        return self.select(self.bg_codes == code)
+
+    def partition(self, abo: str) -> "DonorBitsets":
+        """donors of one blood group, with their words copied out contiguously
+
+        Meant to be built once per blood group at load time. The result is
+        immutable and reads no rows of this cohort's words at request time.
+        """
+        group = self.blood_group(abo)
+        rows = np.arange(self.n_rows) if group.rows is None else group.rows
+        bits = np.ascontiguousarray(self._bits[rows])
+        bg_codes = self._bg_codes[rows]
+        weights = None if self.weights is None else self.weights[rows]
+        ids = None if self.ids is None else self.ids[rows]
+        source_rows = group._source_positions()
+        source_rows = np.arange(self.n_rows) if source_rows is None else source_rows.copy()
+        for array in (bits, bg_codes, source_rows, weights, ids):
+            if array is not None:
+                array.flags.writeable = False
+        return self._derive(
+            abo=abo, rows=None, source_rows=source_rows, weights=weights, ids=ids, _bits=bits, _bg_codes=bg_codes
+        )
+
+    def compact(self) -> "DonorBitsets":
+        """one packed row per distinct (blood group, antigens) phenotype, weighted by its donors
+
+        Each phenotype keeps its first donor's row, in source order, so ``frame``
+        lists one representative donor per phenotype. Counts taken through
+        ``len`` and ``row_weights`` are unchanged. Meant for a whole cohort, at
+        load time.
+        """
+        if self.rows is not None or self.weights is not None:
+            raise ValueError("only a whole, uncompacted cohort can be compacted")
+        keys = np.column_stack([self._bg_codes.astype(np.int64).view(np.uint64), self._bits])
+        _, first, counts = np.unique(keys, axis=0, return_index=True, return_counts=True)
+        order = np.argsort(first)
+        rows, weights = first[order], counts[order].astype(np.int64)
+        bits = np.ascontiguousarray(self._bits[rows])
+        bg_codes = self._bg_codes[rows]
+        source_rows = rows if self.source_rows is None else self.source_rows[rows]
+        ids = None if self.ids is None else self.ids[rows]
+        for array in (bits, bg_codes, source_rows, weights, ids):
+            if array is not None:
+                array.flags.writeable = False
+        return self._derive(source_rows=source_rows, weights=weights, ids=ids, _bits=bits, _bg_codes=bg_codes)
+
+
+def blood_group_partitions(
+    donor_sets: Sequence[DonorEngine], blood_groups: Sequence[str] = BLOOD_GROUPS
+) -> Mapping[Tuple[int, str], DonorEngine]:
+    """every (donor_set, blood group) partition, keyed as the API selects them"""
+    return MappingProxyType(
+        {(n, abo): donors.partition(abo) for n, donors in enumerate(donor_sets) for abo in blood_groups}
+    )
@@ -0,0 +1,111 @@
+"""calculation result cache, keyed on everything in a /calc/ response but its time"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .calculator import Results
+from .data import DataProvenance
+
+DEFAULT_RESULT_CACHE_SIZE = 4096
+
+
+class CacheStats(BaseModel):
+    """result cache counters"""
+
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+
+class ResultCache:
+    """bounded LRU of calculator Results, held per data release; a max_size of 0 disables caching
+
+    ``invalidate`` drops a release's entries. Cached Results are shared between responses and must not be mutated.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_RESULT_CACHE_SIZE):
+        if max_size < 0:
+            raise ValueError(f"result cache size must not be negative: {max_size}")
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Results]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def key(
+        bg: str,
+        specs: Iterable[str],
+        recip_hla_used: Iterable[str],
+        donor_set: int,
+    ) -> Tuple:
+        """the canonical form of one calculation's inputs within a release
+
+        Spec and recipient order do not change a result, so both are sorted.
+        The release is not part of the key: entries are held under it.
+        """
+        return bg, tuple(sorted(set(specs))), tuple(sorted(set(recip_hla_used))), donor_set
+
+    @staticmethod
+    def _release(provenance: DataProvenance) -> Tuple:
+        """the part of a provenance that determines results"""
+        return provenance.donor_database_sha256, provenance.donor_table, provenance.matchability_band_version
+
+    def get(self, key: Hashable, provenance: DataProvenance) -> Optional[Results]:
+        """the cached Results for key under a data release, or None on a miss"""
+        entry = (self._release(provenance), key)
+        with self._lock:
+            if entry in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(entry)
+                return self._entries[entry]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, provenance: DataProvenance, results: Results) -> None:
+        """store the Results calculated for key, evicting the least recently used"""
+        if not self.max_size:
+            return
+        entry = (self._release(provenance), key)
+        with self._lock:
+            self._entries[entry] = results
+            self._entries.move_to_end(entry)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, provenance: DataProvenance) -> None:
+        """drop every entry calculated from a data release"""
+        release = self._release(provenance)
+        with self._lock:
+            stale = [entry for entry in self._entries if entry[0] == release]
+            for entry in stale:
+                del self._entries[entry]
+            if stale:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """drop every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        """a snapshot of the counters"""
+        with self._lock:
+            return CacheStats(
+                max_size=self.max_size,
+                size=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+            )
+
+
+result_cache = ResultCache(int(os.getenv("MATCHBOX_RESULT_CACHE_SIZE", DEFAULT_RESULT_CACHE_SIZE)))
@@ -1,61 +1,116 @@
 """the calculator"""
 
-from typing import Dict, List, Optional, Set
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
-from pandas import DataFrame, Series
+import numpy as np
+from pandas import DataFrame
 from pydantic import BaseModel
 
+from .bitset import DonorEngine
+from .postings import DonorIndex
+
+# donor representations that select and split themselves; anything else is a frame
+DONOR_ENGINES = (DonorEngine, DonorIndex)
+
 # NHSBT B/DR mismatch grades, and the levels they collapse to. Defined at module
 # level so the cutpoints are stated once and can be tested directly rather than
 # being buried in the counting loop.
 GRADE_ORDER = ("m12a", "m2b", "m3a", "m3b", "m4a", "m4b")
 GRADE_LEVELS = {"m12a": 1, "m2b": 2, "m3a": 3, "m3b": 3, "m4a": 4, "m4b": 4}
 FAVOURABLE_LEVELS = (1, 2)
+# loci counted for matchability, in the column order of mismatch_counts
+MISMATCH_LOCI = ("B", "DR")
 
 
-def split_by_dsa(donors: DataFrame, specs: List[str]) -> tuple:
+def split_by_dsa(donors: Union[DataFrame, DonorEngine, DonorIndex], specs: List[str]) -> tuple:
     """split donors into (compatible, incompatible) on the recipient's specs
 
     The single definition of what counts as a DSA against a donor, so the
     compatible and incompatible halves cannot disagree about the predicate that
-    separates them.
+    separates them. Packed donors answer the same predicate from their bitsets,
+    and an indexed partition from the union of the specs' postings.
     """
+    if isinstance(donors, DONOR_ENGINES):
+        return donors.split(specs or [])
     if not specs:
         return donors, donors.iloc[0:0]
     has_dsa = donors[specs].eq(1).any(axis=1)
     return donors[~has_dsa], donors[has_dsa]
 
 
+def incompatible_count(donors: Union[DataFrame, DonorEngine, DonorIndex], specs: List[str]) -> int:
+    """number of donors with a DSA against the specs, without building either half
+
+    The same predicate as ``split_by_dsa``. Packed donors count from their
+    popcount, and an indexed partition from the size of the specs' union.
+    """
+    if isinstance(donors, DONOR_ENGINES):
+        return donors.incompatible_count(specs or [])
+    if not specs:
+        return 0
+    return int(donors[specs].eq(1).any(axis=1).sum())
+
+
+def widened_recipient(recipient_bdr: Dict[str, Set[str]], locus: str, ag_defaults: Dict[str, str]) -> Set[str]:
+    """the recipient's antigens at one locus, plus the defaults of any rare ones
+
+    Widening first means a rare antigen does not read as a mismatch against its
+    common equivalent.
+    """
+    recipient = set(recipient_bdr.get(locus, set()))
+    recipient.update({ag_defaults[ag] for ag in list(recipient) if ag in ag_defaults})
+    return recipient
+
+
+def mismatch_weights(
+    columns: Iterable[str],
+    recipient_bdr: Dict[str, Set[str]],
+    hla_bdr: Dict[str, List[str]],
+    ag_defaults: Dict[str, str],
+) -> Tuple[List[str], np.ndarray]:
+    """the recipient's "not already held" vector over the B and DR donor columns
+
+    Returns the matchability columns present in ``columns`` and a (columns, 2)
+    0/1 matrix whose B and DR columns mark the antigens that would count as a
+    mismatch at that locus, against the recipient as widened by
+    ``widened_recipient``. A donor's counts are then its indicator row times
+    this matrix.
+    """
+    available = set(columns)
+    used = list(dict.fromkeys(c for locus in MISMATCH_LOCI for c in hla_bdr.get(locus, []) if c in available))
+    position = {column: n for n, column in enumerate(used)}
+    weights = np.zeros((len(used), len(MISMATCH_LOCI)), dtype=np.int64)
+    for n, locus in enumerate(MISMATCH_LOCI):
+        recipient = widened_recipient(recipient_bdr, locus, ag_defaults)
+        for column in hla_bdr.get(locus, []):
+            if column in position and column not in recipient:
+                weights[position[column], n] = 1
+    return used, weights
+
+
 def mismatch_counts(
-    donors: DataFrame,
+    donors: Union[DataFrame, DonorEngine],
     recipient_bdr: Dict[str, Set[str]],
     hla_bdr: Dict[str, List[str]],
     ag_defaults: Dict[str, str],
 ) -> DataFrame:
     """B and DR broad mismatch counts for every donor in a frame
 
-    The single definition of the count. The recipient's antigen set is widened by
-    the rare-antigen defaults before differencing, so a rare antigen does not read
-    as a mismatch against its common equivalent.
+    The single definition of the count: one matrix product of the donors' B/DR
+    indicators with the recipient's not-already-held matrix from
+    ``mismatch_weights``, rather than a set difference per donor.
 
     Takes the frame as a parameter rather than reading it off the instance, so
     the arithmetic can be tested against a known frame independently of a full
     Calculator.
     """
-    result = {}
-    for locus in ("B", "DR"):
-        columns = [c for c in hla_bdr.get(locus, []) if c in donors.columns]
-        recipient = set(recipient_bdr.get(locus, set()))
-        recipient.update({ag_defaults[ag] for ag in list(recipient) if ag in ag_defaults})
-
-        if not columns or donors.empty:
-            result[locus] = Series(0, index=donors.index, dtype=int)
-            continue
-
-        mask = donors[columns].eq(1)
-        result[locus] = mask.apply(lambda row: len(set(row.index[row]).difference(recipient)), axis=1)
-
-    return DataFrame(result, index=donors.index)
+    columns, weights = mismatch_weights(donors.columns, recipient_bdr, hla_bdr, ag_defaults)
+    if isinstance(donors, DonorEngine):  # packed, sparse or pushdown donors count from their own layout
+        counts = donors.weighted_counts(columns, weights)
+    else:
+        counts = donors[columns].eq(1).to_numpy(dtype=np.int64) @ weights
+    return DataFrame(counts, index=donors.index, columns=list(MISMATCH_LOCI))
 
 
 def mismatch_grade(b_mm: int, dr_mm: int) -> str:
@@ -77,6 +132,55 @@ def mismatch_grade(b_mm: int, dr_mm: int) -> str:
     raise ValueError(f"invalid B/DR mismatch counts: B={b_mm}, DR={dr_mm}")
 
 
+# (B, DR) mismatch counts -> index into GRADE_ORDER, and which of those grades
+# are favourable. Built from mismatch_grade and GRADE_LEVELS, so the cutpoints
+# are still stated once; grading a cohort is then a lookup rather than a call
+# per donor.
+GRADE_TABLE = np.array([[GRADE_ORDER.index(mismatch_grade(b, dr)) for dr in range(3)] for b in range(3)])
+FAVOURABLE_GRADES = np.array([GRADE_LEVELS[grade] in FAVOURABLE_LEVELS for grade in GRADE_ORDER])
+
+
+def grade_counts(b_mm: np.ndarray, dr_mm: np.ndarray, weights: Optional[np.ndarray] = None) -> Dict[str, int]:
+    """number of donors at each NHSBT grade, led by the favourable total
+
+    ``weights``, if given, counts each row as that many donors, so a group of
+    donors sharing one B/DR phenotype is graded once. Counts outside 0..2 are
+    rejected with mismatch_grade's own error, for the first row (of non-zero
+    weight) that has them.
+    """
+    b_mm = np.asarray(b_mm, dtype=np.int64)
+    dr_mm = np.asarray(dr_mm, dtype=np.int64)
+    invalid = (b_mm < 0) | (b_mm > 2) | (dr_mm < 0) | (dr_mm > 2)
+    if weights is not None:
+        invalid &= np.asarray(weights) > 0
+    if invalid.any():
+        first = np.flatnonzero(invalid)[0]
+        mismatch_grade(int(b_mm[first]), int(dr_mm[first]))
+
+    grades = GRADE_TABLE[np.clip(b_mm, 0, 2), np.clip(dr_mm, 0, 2)]
+    return grade_histogram(np.bincount(grades.reshape(-1), weights=weights, minlength=len(GRADE_ORDER)))
+
+
+def favourable_donors(b_mm: np.ndarray, dr_mm: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """per-donor (favourable, ungradeable) masks from B and DR mismatch counts
+
+    For what-if tallies that add or drop donors one by one; an ungradeable donor
+    is neither favourable nor not, and is what grade_counts would reject.
+    """
+    b_mm = np.asarray(b_mm, dtype=np.int64)
+    dr_mm = np.asarray(dr_mm, dtype=np.int64)
+    ungradeable = (b_mm < 0) | (b_mm > 2) | (dr_mm < 0) | (dr_mm > 2)
+    favourable = ~ungradeable & FAVOURABLE_GRADES[GRADE_TABLE[np.clip(b_mm, 0, 2), np.clip(dr_mm, 0, 2)]]
+    return favourable, ungradeable
+
+
+def grade_histogram(counts: np.ndarray) -> Dict[str, int]:
+    """match counts from donors per grade, in GRADE_ORDER, led by the favourable total"""
+    # 'favourable' is levels 1 and 2
+    fav = int(counts[FAVOURABLE_GRADES].sum())
+    return {"fav": fav, **{grade: int(n) for grade, n in zip(GRADE_ORDER, counts)}}
+
+
 class Results(BaseModel):
     """Calculator spec"""
 
@@ -87,12 +191,40 @@ class Results(BaseModel):
     match_counts: Optional[Dict[str, int]] = None
 
 
+def matchability_band(bands: Dict[int, int], fav_matched: int) -> int:
+    """the first matchability band whose threshold the favourable count reaches"""
+    return next((b for b, v in sorted(bands.items()) if fav_matched >= v))
+
+
+def tally_results(
+    total: int,
+    incompatible: int,
+    match_counts: Optional[Dict[str, int]],
+    matchability_bands: Optional[Dict[str, Dict[int, int]]],
+    abo: str,
+) -> Results:
+    """Results from the donor tallies of one calculation
+
+    cRF, availability and matchability are derived from counts alone, here, so
+    every path that produces the counts reports them identically.
+    """
+    fav_matched = match_counts["fav"] if match_counts else None
+    matchability = matchability_band(matchability_bands[abo], fav_matched) if fav_matched is not None else None
+    return Results(
+        crf=incompatible / total,
+        available=total - incompatible,
+        favourable=fav_matched,
+        matchability=matchability,
+        match_counts=match_counts,
+    )
+
+
 class Calculator:
     """Calculator class"""
 
     def __init__(
         self,
-        donors: DataFrame = None,
+        donors: Union[DataFrame, DonorEngine, DonorIndex] = None,
         specs: List[str] = None,
         abo: str = None,
         recipient_bdr: Optional[Dict[str, Set]] = None,
@@ -101,54 +233,59 @@ class Calculator:
         matchability_bands: Dict[str, Dict[int, int]] = None,
     ):
         self.abo = abo  # recipient blood group
-        self.donors = donors[donors.bg == self.abo]  # blood group identical donor hla types
+        if isinstance(donors, DONOR_ENGINES):
+            # a load-time blood group partition or index is used as is
+            self.donors = donors.blood_group(self.abo)  # blood group identical donor hla types
+        else:
+            self.donors = donors[donors.bg == self.abo]
         self.specs = specs  # recipient antibody specs
         self.hla_bdr = hla_bdr  # broad hla B and DR antigens for matchability calculation
         self.recipient_bdr = recipient_bdr  # recipient broad hla B and DR antigens for matchability calculation
-        self.compatible_donors, self.incompatible_donors = self._get_donors()
         self.ag_defaults = ag_defaults  # default antigens mapping rarer antigens to common ones
         self.matchability_bands = matchability_bands  # matchability bands for this blood group
 
     def calculate(self) -> Results:
         """calculcate crf and matachability"""
-        # calculate crf
-        crf = len(self.incompatible_donors) / len(self.donors)
-        # calculate matchability
-        match_counts = self._get_matching_level_count()
-        fav_matched = match_counts["fav"] if match_counts else None
-        matchability = self._calculate_matchability(fav_matched) if fav_matched is not None else None
-        return Results(
-            crf=crf,
-            available=len(self.compatible_donors),
-            favourable=fav_matched,
-            matchability=matchability,
-            match_counts=match_counts,
+        return tally_results(
+            total=len(self.donors),
+            incompatible=incompatible_count(self.donors, self.specs),
+            match_counts=self._get_matching_level_count(),
+            matchability_bands=self.matchability_bands,
+            abo=self.abo,
         )
 
-    def _get_donors(self) -> List[DataFrame]:
-        """get compatible/incompatible donors from those blood group identical"""
+    @cached_property
+    def _donor_split(self) -> tuple:
+        """compatible/incompatible donors from those blood group identical
+
+        Split only when something reads them: cRF and availability are counted
+        without either half, so only grading needs the compatible donors.
+        """
         return split_by_dsa(self.donors, self.specs)
 
+    @property
+    def compatible_donors(self) -> Union[DataFrame, DonorEngine]:
+        """blood group identical donors without a DSA"""
+        return self._donor_split[0]
+
+    @property
+    def incompatible_donors(self) -> Union[DataFrame, DonorEngine]:
+        """blood group identical donors with a DSA"""
+        return self._donor_split[1]
+
     def _get_matching_level_count(self) -> Optional[Dict[str, int]]:
         """calculate matching level count
 
         Counts and grades both come from the module-level helpers above, so the
         cutpoints are applied in one place rather than re-expressed as inline
-        conditions here.
+        conditions here. An index carrying grade classes for the same B/DR
+        antigens grades each phenotype class once instead of each donor.
         """
         if self.recipient_bdr:
+            classes = getattr(self.donors, "classes", None)
+            if classes is not None and classes.hla_bdr == self.hla_bdr:
+                return classes.match_counts(self.compatible_donors, self.recipient_bdr, self.ag_defaults)
             matchings = mismatch_counts(self.compatible_donors, self.recipient_bdr, self.hla_bdr, self.ag_defaults)
-            if matchings.empty:
-                return {"fav": 0, **{grade: 0 for grade in GRADE_ORDER}}
-
-            grades = matchings.apply(lambda row: mismatch_grade(int(row.B), int(row.DR)), axis=1)
-            counts = {grade: int((grades == grade).sum()) for grade in GRADE_ORDER}
-
-            # 'favourable' is levels 1 and 2
-            fav = sum(n for grade, n in counts.items() if GRADE_LEVELS[grade] in FAVOURABLE_LEVELS)
-            return {"fav": fav, **counts}
+            weights = getattr(self.compatible_donors, "row_weights", None)  # compacted donors
+            return grade_counts(matchings["B"].to_numpy(), matchings["DR"].to_numpy(), weights=weights)
         return None
-
-    def _calculate_matchability(self, fav_matched: int) -> int:
-        """calculate matchability"""
-        return next((b for b, v in sorted(self.matchability_bands[self.abo].items()) if fav_matched >= v))
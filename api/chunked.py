@@ -0,0 +1,201 @@
+"""out-of-core batch runs: recipients tallied against the donor table a block of rows at a time"""
+
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from pandas import DataFrame
+from pydantic import BaseModel
+
+from .batch import (
+    BatchRecord,
+    BatchRecordError,
+    PreparedRecord,
+    calculation_response,
+    error_detail,
+    group_tallies,
+    prepare_record,
+)
+from .bitset import DonorBitsets
+from .calculator import GRADE_ORDER, Results, grade_histogram, tally_results
+from .data import DONOR_CHUNK_ROWS, DataLoader
+from .input_validation import AntigenValidationError
+from .logger import log_manager
+
+logger = log_manager.get_logger("error.log", log_source="chunked.py")
+
+# a record's position, prepared record (None if invalid) and Results or error, as run_batch yields
+Outcome = Tuple[int, Optional[PreparedRecord], Union[Results, Exception]]
+
+
+class Throughput(BaseModel):
+    """how fast a chunked run read and evaluated the donor table"""
+
+    donors: int
+    blocks: int
+    seconds: float
+    donors_per_second: float
+
+
+class LookupTables(BaseModel):
+    """the lookup tables a record is validated against, without any donors"""
+
+    antigens: Dict[str, List[str]]
+    mbands: Dict[str, Dict[int, int]]
+    mantigens: Dict[str, List[str]]
+    antigen_defaults: Dict[str, str]
+    broad_split: Dict[str, Dict[str, Any]]
+
+
+class RecipientTally:
+    """one recipient's running totals over the blocks seen so far"""
+
+    def __init__(self, record: PreparedRecord):
+        self.record = record
+        self.total = 0
+        self.available = 0
+        self.histogram = np.zeros(len(GRADE_ORDER), dtype=np.int64) if record.recipient_bdr else None
+        self.error: Optional[ValueError] = None
+
+    def add(self, total: int, tally: Union[Tuple[int, Optional[np.ndarray]], ValueError]) -> None:
+        """add one block's tally; the first error raised for the recipient stands"""
+        if self.error is not None:
+            return
+        if isinstance(tally, ValueError):
+            self.error = tally
+            return
+        available, histogram = tally
+        self.total += total
+        self.available += available
+        if histogram is not None:
+            self.histogram += histogram
+
+    def state(self) -> Dict[str, Any]:
+        """the running totals as JSON, to send between processes or checkpoint"""
+        return {
+            "total": self.total,
+            "available": self.available,
+            "histogram": None if self.histogram is None else self.histogram.tolist(),
+            "error": None if self.error is None else str(self.error),
+        }
+
+    def add_state(self, state: Dict[str, Any]) -> None:
+        """add another tally's ``state``, as one more block"""
+        if state["error"] is not None:
+            self.add(0, ValueError(state["error"]))
+            return
+        histogram = None if state["histogram"] is None else np.array(state["histogram"], dtype=np.int64)
+        self.add(state["total"], (state["available"], histogram))
+
+    def outcome(self, matchability_bands: Dict[str, Dict[int, int]]) -> Union[Results, ValueError]:
+        """the Results a loaded batch would give, or the error it would"""
+        if self.error is not None:
+            return self.error
+        abo = self.record.bg
+        if not self.total:
+            return ValueError(f"no donors of blood group {abo} in this donor set")
+        match_counts = None if self.histogram is None else grade_histogram(self.histogram)
+        return tally_results(self.total, self.total - self.available, match_counts, matchability_bands, abo)
+
+
+def donor_set_blocks(block: DataFrame) -> Tuple[DonorBitsets, ...]:
+    """one block of donor rows packed as both donor sets, as DataLoader packs the whole table"""
+    donors = DonorBitsets(block)
+    dpb_typed = donors.hits([col for col in donors.columns if "DPB" in col]) > 0
+    return donors, donors.select(dpb_typed)
+
+
+def tally_blocks(
+    blocks: Iterable[DataFrame],
+    tallies: Sequence[RecipientTally],
+    hla_bdr: Dict[str, List[str]],
+    ag_defaults: Dict[str, str],
+) -> Throughput:
+    """add every block's tallies to the recipients' running totals"""
+    groups: Dict[Tuple[int, str], List[RecipientTally]] = defaultdict(list)
+    for tally in tallies:
+        groups[(tally.record.donor_set, tally.record.bg)].append(tally)
+    started = time.perf_counter()
+    n_donors = n_blocks = 0
+    for block in blocks:
+        donor_sets = donor_set_blocks(block)
+        for (donor_set, bg), members in groups.items():
+            donors = donor_sets[donor_set].blood_group(bg)
+            if not len(donors):
+                continue
+            block_tallies = group_tallies(
+                donors,
+                [member.record.specs for member in members],
+                [member.record.recipient_bdr for member in members],
+                hla_bdr,
+                ag_defaults,
+            )
+            for member, tally in zip(members, block_tallies):
+                member.add(len(donors), tally)
+        n_donors += len(block)
+        n_blocks += 1
+    seconds = time.perf_counter() - started
+    return Throughput(
+        donors=n_donors,
+        blocks=n_blocks,
+        seconds=seconds,
+        donors_per_second=n_donors / seconds if seconds else 0.0,
+    )
+
+
+def prepare_tallies(
+    records: Sequence[BatchRecord], data: LookupTables
+) -> Tuple[Dict[int, Outcome], Dict[int, RecipientTally]]:
+    """validate the records: (position, None, error) for each invalid one, an empty tally for each valid one"""
+    invalid: Dict[int, Outcome] = {}
+    tallies: Dict[int, RecipientTally] = {}
+    for position, record in enumerate(records):
+        try:
+            prepared = prepare_record(record.bg, record.specs, record.recip_hla, record.donor_set, data)
+        except (AntigenValidationError, BatchRecordError) as exc:
+            invalid[position] = (position, None, exc)
+            continue
+        tallies[position] = RecipientTally(prepared)
+    return invalid, tallies
+
+
+def run_chunked(
+    records: Sequence[BatchRecord], loader: DataLoader, block_rows: int = DONOR_CHUNK_ROWS
+) -> Tuple[List[Outcome], Throughput]:
+    """calculate every record in one pass over the donor table, ``block_rows`` at a time
+
+    Takes a loader that has not loaded its donors (``load_donors=False``).
+    Returns (position, prepared record, Results or error) for each record, in
+    input order, as ``run_batch`` yields them, and the run's throughput.
+    """
+    data = LookupTables(**loader.lookup_tables())
+    outcomes, tallies = prepare_tallies(records, data)
+    blocks = loader.donor_chunks(block_rows)
+    throughput = tally_blocks(blocks, list(tallies.values()), data.mantigens, data.antigen_defaults)
+    loader.check_database_unchanged()
+    logger.info(
+        "chunked run: %d recipients against %d donors in %d blocks, %.1fs (%.0f donors/s)",
+        len(tallies),
+        throughput.donors,
+        throughput.blocks,
+        throughput.seconds,
+        throughput.donors_per_second,
+    )
+    for position, tally in tallies.items():
+        outcomes[position] = (position, tally.record, tally.outcome(data.mbands))
+    return [outcomes[position] for position in sorted(outcomes)], throughput
+
+
+def chunked_items(records: Sequence[BatchRecord], outcomes: Sequence[Outcome], loader: DataLoader) -> List[dict]:
+    """the /calc/batch items of a chunked run's outcomes, with the donor set sizes counted by the database"""
+    sizes = loader.donor_set_sizes()
+    items = []
+    for position, prepared, outcome in outcomes:
+        record_id = records[position].id
+        if isinstance(outcome, Results):
+            response = calculation_response(prepared, outcome, loader, total=sizes[prepared.donor_set])
+            items.append({"id": record_id, "result": response})
+        else:
+            items.append({"id": record_id, "error": error_detail(outcome)})
+    return items
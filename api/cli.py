@@ -0,0 +1,208 @@
+"""command line tools
+
+matchbox snapshot build [--db data/donors.db] [--output data/donors.snapshot]
+matchbox batch waiting-list.csv [--output results.tsv] [--workers N] [--chunk-size ROWS]   (also matchbox-batch)
+"""
+
+import argparse
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .batch import batch_items
+from .batchfile import InputRow, read_records, write_jsonl, write_tsv
+from .chunked import LookupTables, chunked_items, run_chunked
+from .data import DEFAULT_DATABASE_PATH, DataLoader, DataLoadError
+from .schemas import BatchCalculationItem
+from .sharded import ShardProgress, iter_sharded, run_sharded_donors
+
+
+def snapshot_build(args: argparse.Namespace) -> int:
+    """compile a donor database into a snapshot"""
+    started = time.perf_counter()
+    try:
+        loader = DataLoader(
+            db_path=args.db,
+            table_name=args.table,
+            matchability_ver=args.matchability_ver,
+            compact_donors=args.compact,
+            snapshot_path=args.output,
+            use_snapshot=False,
+        )
+        path = loader.write_snapshot()
+    except (DataLoadError, FileNotFoundError, ValueError) as e:
+        print(f"matchbox: snapshot not built: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"{path}: {loader.provenance.donor_database} sha256 {loader.provenance.donor_database_sha256}, "
+        f"{path.stat().st_size:,} bytes in {time.perf_counter() - started:.2f}s"
+    )
+    return 0
+
+
+def json_item(item: dict) -> dict:
+    """a /calc/batch item as the route returns it, as JSON"""
+    return BatchCalculationItem.model_validate(item).model_dump(mode="json")
+
+
+def in_input_order(
+    rows: Sequence[InputRow], items: Iterable[Tuple[int, dict]]
+) -> Iterator[Tuple[Union[str, int], dict]]:
+    """(id, item) for every input row, in input order, each as soon as it and the rows before it are ready
+
+    ``items`` are (position, JSON /calc/batch item) pairs in any order, positions
+    counting the readable rows; an unreadable row is its error.
+    """
+    items = iter(items)
+    ready: Dict[int, dict] = {}
+    position = 0
+    for record_id, record in rows:
+        if isinstance(record, Exception):
+            yield record_id, {"error": record.detail()}
+            continue
+        while position not in ready:
+            n, item = next(items)
+            ready[n] = item
+        item = ready.pop(position)
+        position += 1
+        yield item["id"], item
+
+
+def report_progress(status: ShardProgress) -> None:
+    """print how far a sharded run has got"""
+    print(
+        f"matchbox-batch: {status.done:,}/{status.shards:,} shards done ({status.resumed:,} resumed) "
+        f"in {status.seconds:.2f}s",
+        file=sys.stderr,
+    )
+
+
+def batch(args: argparse.Namespace) -> int:
+    """calculate a waiting list file, writing one result row per recipient
+
+    Rows are written in input order, each as soon as it and the rows before it
+    are calculated, whether or not the run is sharded or chunked.
+    """
+    started = time.perf_counter()
+    settings = {"db_path": args.db, "table_name": args.table, "matchability_ver": args.matchability_ver}
+    sharded = args.workers > 1 or args.checkpoint_dir is not None
+    chunked = args.chunk_size is not None
+    throughput = None
+    output_format = args.format or ("jsonl" if Path(args.output or "").suffix in (".jsonl", ".json") else "tsv")
+    write = write_jsonl if output_format == "jsonl" else write_tsv
+    try:
+        if chunked and args.chunk_size < 1:
+            raise ValueError(f"invalid chunk size: {args.chunk_size}")
+        # sharded and chunked runs read their donors elsewhere; this process only needs the lookup tables
+        loader = DataLoader(**settings, load_donors=not (sharded or chunked))
+        tables = LookupTables(**loader.lookup_tables())
+        recipient_vocabulary = [
+            *tables.mantigens.get("B", []),
+            *tables.mantigens.get("DR", []),
+            *tables.broad_split.get("split_to_broad", {}),
+        ]
+        spec_vocabulary = [ag for ags in tables.antigens.values() for ag in ags]
+        with nullcontext(sys.stdin) if args.input == "-" else open(args.input, newline="") as source:
+            rows = list(read_records(source, spec_vocabulary, recipient_vocabulary))
+        records = [record for _, record in rows if not isinstance(record, Exception)]
+        progress = report_progress if args.progress else None
+        if chunked:
+            if sharded:
+                outcomes, throughput = run_sharded_donors(
+                    records,
+                    settings,
+                    workers=args.workers,
+                    block_rows=args.chunk_size,
+                    checkpoint_dir=args.checkpoint_dir,
+                    progress=progress,
+                )
+            else:
+                outcomes, throughput = run_chunked(records, loader, block_rows=args.chunk_size)
+            items = enumerate(map(json_item, chunked_items(records, outcomes, loader)))
+        elif sharded:
+            shards = iter_sharded(
+                records,
+                settings,
+                workers=args.workers,
+                checkpoint_dir=args.checkpoint_dir,
+                progress=progress,
+            )
+            items = (pair for shard in shards for pair in shard)
+        else:
+            items = ((position, json_item(item)) for position, item in batch_items(loader.base_data, records))
+        results = in_input_order(rows, items)
+        with nullcontext(sys.stdout) if args.output in (None, "-") else open(args.output, "w", newline="") as sink:
+            written = write(results, sink)
+    except (DataLoadError, OSError, ValueError) as e:
+        print(f"matchbox-batch: {e}", file=sys.stderr)
+        return 1
+
+    seconds = time.perf_counter() - started
+    print(
+        f"matchbox-batch: {written:,} recipients ({written - len(records):,} unreadable) in {seconds:.2f}s",
+        file=sys.stderr,
+    )
+    if throughput is not None:
+        print(
+            f"matchbox-batch: {throughput.donors:,} donors in {throughput.blocks:,} blocks, "
+            f"{throughput.seconds:.2f}s ({throughput.donors_per_second:,.0f} donors/s)",
+            file=sys.stderr,
+        )
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    """the matchbox command line"""
+    matchbox = argparse.ArgumentParser(prog="matchbox", description="cRF and matchability calculator tools")
+    commands = matchbox.add_subparsers(dest="command", required=True)
+
+    snapshot = commands.add_parser("snapshot", help="precompiled cohort snapshots")
+    snapshot_commands = snapshot.add_subparsers(dest="snapshot_command", required=True)
+    build = snapshot_commands.add_parser("build", help="compile a donor database into a snapshot")
+    build.add_argument("--db", default=DEFAULT_DATABASE_PATH, help="donor database (default: %(default)s)")
+    build.add_argument("--table", default=None, help="donor table (default: the calculator's)")
+    build.add_argument("--matchability-ver", type=int, default=None, help="matchability band version")
+    build.add_argument("--compact", action="store_true", default=None, help="compact donors into weighted phenotypes")
+    build.add_argument("--output", default=None, help="snapshot path (default: beside the database)")
+    build.set_defaults(run=snapshot_build)
+
+    waiting_list = commands.add_parser("batch", help="calculate a waiting list file without the web server")
+    add_batch_arguments(waiting_list)
+    return matchbox
+
+
+def add_batch_arguments(command: argparse.ArgumentParser) -> None:
+    """the arguments of matchbox batch and matchbox-batch"""
+    command.add_argument("input", help="CSV or TSV with id, bg, specs, recip_hla and donor_set columns (- for stdin)")
+    command.add_argument("--output", default=None, help="results file (default: stdout)")
+    command.add_argument("--format", choices=("tsv", "jsonl"), default=None, help="default: from --output, else tsv")
+    command.add_argument("--db", default=DEFAULT_DATABASE_PATH, help="donor database (default: %(default)s)")
+    command.add_argument("--table", default=None, help="donor table (default: the calculator's)")
+    command.add_argument("--matchability-ver", type=int, default=None, help="matchability band version")
+    command.add_argument("--workers", type=int, default=1, help="worker processes (default: %(default)s)")
+    command.add_argument(
+        "--chunk-size", type=int, default=None, help="stream the donor table this many rows at a time, not loading it"
+    )
+    command.add_argument("--checkpoint-dir", default=None, help="save finished shards here, and skip them on a rerun")
+    command.add_argument("--progress", action="store_true", help="report finished shards on stderr")
+    command.set_defaults(run=batch)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """run a matchbox command"""
+    args = parser().parse_args(argv)
+    return args.run(args)
+
+
+def batch_main(argv: Optional[List[str]] = None) -> int:
+    """matchbox-batch: matchbox batch as a command of its own"""
+    command = argparse.ArgumentParser(prog="matchbox-batch", description="calculate a waiting list file")
+    add_batch_arguments(command)
+    args = command.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,45 @@
 """database handling"""
 
+import asyncio
 import hashlib
+import os
 import re
 import sqlite3
+import threading
 import warnings
 from collections import defaultdict
+from datetime import UTC, datetime
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Literal, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel, ConfigDict, Field, model_validator
 
+from .bitset import NON_ANTIGEN_COLUMNS, DonorBitsets, DonorEngine, blood_group_partitions
+from .fingerprint import (
+    FileIdentity,
+    FingerprintCache,
+    FingerprintHealth,
+    file_identity,
+    fingerprint_cache_path,
+    verify_in_background,
+)
+from .grades import grade_classes
 from .logger import log_manager
+from .postings import antigen_indexes
+from .pushdown import DonorSQL, PushdownStore, open_pushdown, pushdown_indexes, pushdown_path
+from .snapshot import (
+    default_snapshot_path,
+    open_snapshot,
+    snapshot_fingerprint,
+    snapshot_key,
+    snapshot_tables,
+    write_snapshot,
+)
+from .sparse import DonorCSR
+from .store import DonorStore, open_donor_store, store_path
 
 logger = log_manager.get_logger("error.log", log_source="data.py")
 
@@ -24,6 +52,7 @@ logger = log_manager.get_logger("error.log", log_source="data.py")
 # excluded, exclude them next time the calculator excel file is updated
 EXCLUDED_ANTIGENS = ["A19_S", "CW13"]
 
+DONOR_CHUNK_ROWS = 50_000  # donor rows read from sqlite at a time
 DEFAULT_DATABASE_PATH = "data/donors.db"
 DEFAULT_DONOR_TABLE = "donors_v3"
 DEFAULT_MATCHABILITY_BAND_VERSION = 4
@@ -88,12 +117,56 @@ class DataLoader:
         upstream_source_file: str = None,
         upstream_source_file_size_signature: int = None,
         upstream_source_file_sha256: str = None,
+        compact_donors: bool = None,
+        sparse_donors: bool = None,
+        store_dir: str = None,
+        pushdown_dir: str = None,
+        snapshot_path: str = None,
+        use_snapshot: bool = True,
+        load_donors: bool = True,
+        fingerprint_cache_dir: str = None,
+        verify_fingerprint: bool = None,
+        release: str = None,
     ):
         self.db_path = db_path or DEFAULT_DATABASE_PATH
+        self.release = release  # configured release name (releases.py); None for the default
+        # collapse donors sharing a blood group and phenotype into weighted rows
+        if compact_donors is None:
+            compact_donors = os.getenv("MATCHBOX_COMPACT_DONORS", "").lower() in ("1", "true", "yes")
+        self.compact_donors = compact_donors
+        # hold each donor's antigens as sparse column numbers, for large custom cohorts
+        if sparse_donors is None:
+            sparse_donors = os.getenv("MATCHBOX_SPARSE_DONORS", "").lower() in ("1", "true", "yes")
+        self.sparse_donors = sparse_donors
+        # share packed donors between processes through a mapped file in this directory
+        self.store_dir = store_dir or os.getenv("MATCHBOX_DONOR_STORE") or None
+        # keep donors in a derived SQLite artifact in this directory and calculate with SQL
+        self.pushdown_dir = pushdown_dir or os.getenv("MATCHBOX_PUSHDOWN_DIR") or None
+        if self.pushdown_dir and (compact_donors or sparse_donors):
+            raise DataLoadError("Pushdown donors cannot also be compacted or sparse")
         self.table_name = table_name or DEFAULT_DONOR_TABLE
         self.matchability_ver = matchability_ver or DEFAULT_MATCHABILITY_BAND_VERSION
+        # a precompiled snapshot of this database, mapped instead of reading it when valid
+        self.snapshot_path = Path(
+            snapshot_path or os.getenv("MATCHBOX_SNAPSHOT") or default_snapshot_path(self.db_path)
+        )
+        # trust a recorded fingerprint while the database's file identity is unchanged
+        fingerprint_cache_dir = fingerprint_cache_dir or os.getenv("MATCHBOX_FINGERPRINT_CACHE")
+        self.fingerprints = (
+            FingerprintCache(fingerprint_cache_path(fingerprint_cache_dir, self.db_path))
+            if fingerprint_cache_dir
+            else None
+        )
+        if verify_fingerprint is None:
+            verify_fingerprint = os.getenv("MATCHBOX_VERIFY_FINGERPRINT", "").lower() in ("1", "true", "yes")
+        self.verify_fingerprint = verify_fingerprint
+        # snapshots and the donor store hold packed bitsets, which sparse and pushdown donors are meant to avoid
+        packed = not (sparse_donors or self.pushdown_dir)
+        snapshot = self._find_snapshot() if use_snapshot and load_donors and packed else None
         self._reject_wal_artifacts()
-        database_sha256 = self._file_sha256(self.db_path)
+        # whether the database (and snapshot) still hash to the fingerprints this release is served under
+        self.health = FingerprintHealth()
+        database_sha256 = self._fingerprint(snapshot)
         source_file, source_size_signature, source_sha256, data_release = self._resolve_upstream_source(
             database_sha256,
             upstream_source_file,
@@ -110,13 +183,29 @@ class DataLoader:
             matchability_band_version=self.matchability_ver,
             data_release=data_release,
         )
+        self.snapshot_verification: Optional[threading.Thread] = None
+        self.snapshot: Optional[DonorStore] = self._check_snapshot(snapshot) if snapshot else None
+        self.store: Optional[DonorStore] = None
+        self.pushdown: Optional[PushdownStore] = None
+        self.donors = None
+        self.conn = None
+        if self.snapshot:
+            return
+
         database_uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
         self.conn = sqlite3.connect(database_uri, uri=True)
         journal_mode = self.conn.execute("PRAGMA journal_mode").fetchone()
         if journal_mode and str(journal_mode[0]).lower() == "wal":
             self.conn.close()
             raise DataLoadError("Donor database must be checkpointed out of WAL mode")
-        self.donors = self._load_donors()
+        if not load_donors:
+            return  # streamed by the caller through donor_chunks
+        if self.pushdown_dir:
+            self.pushdown = self._open_pushdown()
+        elif self.store_dir and packed:
+            self.store = self._open_store()
+        else:
+            self.donors = self._load_donors()
 
     @staticmethod
     def _file_sha256(file_path: str) -> str:
@@ -135,6 +224,28 @@ class DataLoader:
             raise DataLoadError(f"Unable to fingerprint donor database: {path.name}") from exc
         return digest.hexdigest()
 
+    def _fingerprint(self, snapshot: Optional[DonorStore] = None) -> str:
+        """the database's SHA-256, from the snapshot or fingerprint cache if its file identity is unchanged"""
+        self._identity = file_identity(self.db_path)
+        self.verification: Optional[threading.Thread] = None
+        cache = self.fingerprints
+        cached = snapshot_fingerprint(snapshot, self._identity) if snapshot else None
+        if cached:
+            cache = None  # recorded by the snapshot, so not the cache's to drop
+        elif cache:
+            cached = cache.get(self._identity)
+        if cached:
+            if self.verify_fingerprint:
+                rehash = partial(self._file_sha256, self.db_path)
+                self.verification = verify_in_background(Path(self.db_path).name, cached, rehash, self.health, cache)
+            return cached
+
+        database_sha256 = self._file_sha256(self.db_path)
+        # only record a hash of a file that did not change while it was read
+        if self.fingerprints and self._identity is not None and file_identity(self.db_path) == self._identity:
+            self.fingerprints.put(self._identity, database_sha256)
+        return database_sha256
+
     def _resolve_upstream_source(
         self,
         database_sha256: str,
@@ -215,20 +326,162 @@ class DataLoader:
         if match := re.match(r"^([ABCDRQPW]{1,3})\d+", antigen):
             return match.group(1)
 
-    def _load_donors(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        """load data into memory"""
-        data = self._load_table(self.table_name)
-        # filter out donors with no dpb
-        dpb_cols = [col for col in data.columns if "DPB" in col]
-        donor_data = (data.copy(deep=False), data[data[dpb_cols].sum(axis=1) > 0].copy(deep=False))
-        # empty the donors variable
-        data = None
-        return donor_data
+    def donor_chunks(self, rows: int = DONOR_CHUNK_ROWS, start: int = 0, stop: int = None) -> Iterator[pd.DataFrame]:
+        """the donor table (rows ``start`` to ``stop``) ``rows`` at a time, antigen indicators as uint8
+
+        Read through one cursor, so a chunk deep into a large table costs no
+        more than the first.
+        """
+        limit = -1 if stop is None else max(0, int(stop) - int(start))
+        try:
+            cursor = self.conn.execute(f"SELECT * FROM {self.table_name} LIMIT ? OFFSET ?", (limit, int(start)))
+            columns = [description[0] for description in cursor.description]
+        except sqlite3.Error as e:
+            logger.error("Error loading table %s: %s", self.table_name, e)
+            yield pd.DataFrame()
+            return
+        while True:
+            records = cursor.fetchmany(rows)
+            chunk = pd.DataFrame(records, columns=columns)
+            antigens = [col for col in chunk.columns if col not in NON_ANTIGEN_COLUMNS]
+            yield chunk.assign(**{col: chunk[col].eq(1).astype(np.uint8) for col in antigens})
+            if len(records) < rows:
+                return
+
+    def donor_count(self) -> int:
+        """rows in the donor table"""
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+
+    def donor_set_sizes(self) -> Tuple[int, int]:
+        """donors in each donor set, counted in the database: all of them, and those typed at DPB"""
+        columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({self.table_name})") if "DPB" in row[1]]
+        typed = " OR ".join(f'"{column}" = 1' for column in columns) or "0"
+        query = f"SELECT COUNT(*), COALESCE(SUM({typed}), 0) FROM {self.table_name}"
+        return tuple(self.conn.execute(query).fetchone())
+
+    def _load_donors(self) -> Union[pd.DataFrame, DonorCSR]:
+        """load the donor table in chunks, antigen indicators as uint8 and blood groups as a category"""
+        if self.sparse_donors:
+            return DonorCSR.from_chunks(self.donor_chunks())
+        donors = pd.concat(list(self.donor_chunks()), ignore_index=True)
+        if "bg" in donors:
+            donors["bg"] = pd.Categorical(donors["bg"], categories=donors["bg"].dropna().unique())
+        donors.flags.writeable = False
+        return donors
+
+    def _pack_donors(self) -> Tuple[DonorBitsets, ...]:
+        """both donor sets as packed bitsets (or sparse rows), compacted if configured; DPB-typed is a row selection"""
+        donors = self.donors if self.donors is not None else self._load_donors()
+        if not isinstance(donors, DonorCSR):
+            donors = DonorBitsets(donors)
+        if self.compact_donors:
+            donors = donors.compact()
+        dpb_typed = donors.hits([col for col in donors.columns if "DPB" in col]) > 0
+        return donors, donors.select(dpb_typed)
+
+    def _open_store(self) -> DonorStore:
+        """map the shared donor store for this release, writing it if no process has yet"""
+        key = {
+            "donor_database_sha256": self.provenance.donor_database_sha256,
+            "donor_table": self.table_name,
+            "compact": self.compact_donors,
+        }
+        path = store_path(self.store_dir, self.provenance.donor_database_sha256, self.table_name, self.compact_donors)
+        try:
+            return open_donor_store(path, key, self._pack_donors)
+        except (OSError, ValueError) as e:
+            raise DataLoadError(f"Donor store {path} could not be used: {e}") from e
+
+    def _open_pushdown(self) -> PushdownStore:
+        """open the pushdown artifact for this release, writing it if no process has yet"""
+        key = {"donor_database_sha256": self.provenance.donor_database_sha256, "donor_table": self.table_name}
+        path = pushdown_path(self.pushdown_dir, self.provenance.donor_database_sha256, self.table_name)
+        try:
+            return open_pushdown(path, key, self.donor_chunks)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            raise DataLoadError(f"Pushdown artifact {path} could not be used: {e}") from e
+
+    def _find_snapshot(self) -> Optional[DonorStore]:
+        """map the snapshot's header, if there is a readable one"""
+        if not self.snapshot_path.is_file():
+            return None
+        try:
+            return open_snapshot(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring snapshot %s: %s", self.snapshot_path.name, e)
+            return None
+
+    def _check_snapshot(self, snapshot: DonorStore) -> Optional[DonorStore]:
+        """the snapshot if it was built for this provenance and layout, its payload hashed in the background"""
+        try:
+            snapshot.check(snapshot_key(self.provenance.model_dump(), self.compact_donors))
+        except ValueError as e:
+            logger.warning("Ignoring snapshot %s: %s", self.snapshot_path.name, e)
+            return None
+        expected = snapshot.header["payload_sha256"]
+        name = self.snapshot_path.name
+        self.snapshot_verification = verify_in_background(name, expected, snapshot.payload_sha256, self.health)
+        return snapshot
+
+    def check_database_unchanged(self) -> None:
+        """Refuse data read from a database that changed after it was fingerprinted."""
+        self._reject_wal_artifacts()
+        trusted = self.fingerprints is not None and self._identity is not None
+        if trusted and file_identity(self.db_path) == self._identity:
+            return  # cache configured, and not rewritten, replaced or touched since it was fingerprinted
+        final_sha256 = self._file_sha256(self.db_path)
+        if final_sha256 != self.provenance.donor_database_sha256:
+            raise DataLoadError("Donor database changed while calculator data was loading")
+
+    def lookup_tables(self) -> Dict[str, Any]:
+        """antigens, matchability bands and antigens, antigen defaults and broad/split mapping"""
+        if self.snapshot:
+            tables = snapshot_tables(self.snapshot)
+        else:
+            tables = {
+                "antigens": self.antigens(),
+                "mbands": self.matchability_bands(),
+                "mantigens": self.matchability_antigens(),
+                "antigen_defaults": self.antigen_defaults(),
+                "broad_split": self.broad_split_mapping(),
+            }
+        self._validate_matchability_bands(tables["mbands"])
+        return tables
+
+    def _donor_sets(self) -> Tuple[Tuple[DonorBitsets, ...], Any]:
+        """packed donor sets and their blood group partitions, mapped if possible"""
+        mapped = self.snapshot or self.store
+        if mapped:
+            return mapped.donor_sets(), mapped.partitions()
+        if self.pushdown:
+            donors = (DonorSQL(self.pushdown, 0), DonorSQL(self.pushdown, 1))
+            return donors, blood_group_partitions(donors)
+        donors = self._pack_donors()
+        return donors, blood_group_partitions(donors)
+
+    def write_snapshot(self, path: str = None) -> Path:
+        """compile this loader's data into a snapshot that later loaders map instead"""
+        if self.sparse_donors or self.pushdown:
+            raise DataLoadError("Sparse or pushdown donors cannot be written to a snapshot")
+        path = Path(path or self.snapshot_path)
+        tables = self.lookup_tables()
+        donors, _ = self._donor_sets()
+        if not self.snapshot:
+            self.check_database_unchanged()
+        key = snapshot_key(self.provenance.model_dump(), self.compact_donors)
+        write_snapshot(path, donors, key, tables, self._identity)
+        return path
 
     def antigens(self) -> Dict[str, List[str]]:
         """HLA antigens represented"""
         antigen_dict = defaultdict(list)
-        cols = self.donors[0].columns
+        mapped = self.store or self.pushdown
+        if mapped:
+            cols = mapped.columns
+        elif self.donors is not None:
+            cols = self.donors.columns
+        else:  # not loaded: the columns of the donor table itself
+            cols = self._load_table(self.table_name, "LIMIT 0").columns
         for col in cols:
             if col not in EXCLUDED_ANTIGENS:
                 if locus := self._get_locus(col):
@@ -289,26 +542,27 @@ class DataLoader:
     @property
     def base_data(self):
         """get data"""
-        antigens = self.antigens()
-        matchability_bands = self.matchability_bands()
-        self._validate_matchability_bands(matchability_bands)
-        matchability_antigens = self.matchability_antigens()
-        antigen_defaults = self.antigen_defaults()
-        broad_split = self.broad_split_mapping()
-
-        self._reject_wal_artifacts()
-        final_sha256 = self._file_sha256(self.db_path)
-        if final_sha256 != self.provenance.donor_database_sha256:
-            raise DataLoadError("Donor database changed while calculator data was loading")
-
+        tables = self.lookup_tables()
+        # a snapshot was matched to the database fingerprint when mapped, and reads nothing from the database;
+        # its payload digest is checked in the background
+        if not self.snapshot:
+            self.check_database_unchanged()
+
+        donors, partitions = self._donor_sets()
+        if self.pushdown:
+            indexes = pushdown_indexes(partitions, tables["mantigens"])
+        else:
+            classes = grade_classes(partitions, tables["mantigens"])
+            antigens = [ag for ags in tables["antigens"].values() for ag in ags]
+            indexes = antigen_indexes(partitions, antigens, classes)
         return LoadedData(
-            donors=self.donors,
-            antigens=antigens,
-            mbands=matchability_bands,
-            mantigens=matchability_antigens,
-            antigen_defaults=antigen_defaults,
-            broad_split=broad_split,
+            donors=donors,
+            partitions=partitions,
+            indexes=indexes,
             provenance=self.provenance,
+            release=self.release,
+            health=self.health,
+            **tables,
         )
 
 
@@ -316,18 +570,204 @@ class LoadedData(BaseModel):
     """loaded data"""
 
     donors: Any
+    partitions: Any
+    indexes: Any
     antigens: Dict[str, List[str]]
     mbands: Dict[str, Dict[int, int]]
     mantigens: Dict[str, List[str]]
     antigen_defaults: Dict[str, str]
     broad_split: Dict[str, Dict[str, Any]]
     provenance: DataProvenance
+    release: Optional[str] = None  # configured release name (releases.py); None for the default
+    health: Any = None  # FingerprintHealth of the database this release was loaded from
+
+    def close(self) -> None:
+        """release what this release holds open, such as pushdown connections, once it is no longer served"""
+        for donors in self.donors:
+            if isinstance(donors, DonorEngine):
+                donors.close()
+
+
+DEFAULT_DATA_WAIT = 30.0  # seconds a request waits for data still loading
+
+
+class DataNotReady(RuntimeError):
+    """Calculator data is still loading, or failed to load."""
+
+
+class Readiness(BaseModel):
+    """whether this process can serve calculations"""
+
+    status: Literal["loading", "ready", "failed", "unverified"]
+    detail: Optional[str] = None
+    provenance: Optional[DataProvenance] = None
+
+
+class ReloadStatus(BaseModel):
+    """the release being served, and the state of any reload"""
+
+    reloading: bool
+    provenance: Optional[DataProvenance] = None
+    reloaded_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class CalculatorData:
+    """the calculator data, loaded once per process: in the background by the server, in place by ``load``
+
+    ``reload`` swaps in a new release once it has loaded, then closes the old one and calls ``listeners``.
+    """
+
+    def __init__(self, loader: Callable[..., LoadedData] = None, **settings):
+        self._loader = loader or (lambda **settings: DataLoader(**settings).base_data)
+        self.settings: Dict[str, Any] = settings  # DataLoader arguments
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._watch_stop: Optional[threading.Event] = None
+        self.data: Optional[LoadedData] = None
+        self.error: Optional[Exception] = None
+        self.reloading = False
+        self.reloaded_at: Optional[datetime] = None
+        self.reload_error: Optional[Exception] = None
+        self.listeners: List[Callable[[Optional[LoadedData], LoadedData, Dict[str, Any]], None]] = []
+
+    def load(self) -> LoadedData:
+        """the data, loading it in this thread unless another has; re-raises a failed load"""
+        with self._lock:
+            if self.data is None and self.error is None:
+                try:
+                    self.data = self._loader(**self.settings)
+                except Exception as e:
+                    logger.error("Calculator data failed to load: %s", e)
+                    self.error = e
+                finally:
+                    self._loaded.set()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+    def start(self) -> None:
+        """begin loading on a background thread, unless begun"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load_in_background, name="data-load", daemon=True)
+                self._thread.start()
+
+    def _load_in_background(self) -> None:
+        """load, leaving any failure in ``error`` for readiness to report"""
+        try:
+            self.load()
+        except Exception:
+            pass
+
+    async def wait(self, timeout: float = DEFAULT_DATA_WAIT) -> LoadedData:
+        """the data, once loaded, without blocking the event loop"""
+        if self.data is None and self.error is None:
+            self.start()
+            if not await asyncio.to_thread(self._loaded.wait, timeout):
+                raise DataNotReady(f"Calculator data is still loading after {timeout:g}s")
+        if self.error is not None:
+            raise DataNotReady(f"Calculator data failed to load: {self.error}")
+        return self.data
+
+    def reload(self, **overrides) -> Optional[threading.Thread]:
+        """build the release in the background, with any DataLoader overrides, and swap it in
+
+        Returns the loading thread, or None if a reload is already under way.
+        """
+        with self._start_lock:
+            if self.reloading:
+                return None
+            self.reloading = True
+            settings = {**self.settings, **overrides}
+            thread = threading.Thread(target=self._reload, args=(settings,), name="data-reload", daemon=True)
+            thread.start()
+        return thread
+
+    def _reload(self, settings: Dict[str, Any]) -> None:
+        """load a release and swap it in if it loads"""
+        try:
+            data = self._loader(**settings)
+        except Exception as e:
+            logger.error("Data release reload failed, still serving the previous release: %s", e)
+            with self._lock, self._start_lock:
+                self.reload_error = e
+                self.reloading = False
+            return
+
+        # publish the release and end the reload together, so a new reload never starts against a partial swap
+        with self._lock, self._start_lock:
+            previous = self.data
+            self.data, self.error, self.settings = data, None, settings
+            self.reloaded_at = datetime.now(UTC)
+            self.reload_error = None
+            self.reloading = False
+            self._loaded.set()
+        if previous is not None and previous is not data:
+            try:
+                previous.close()
+            except Exception as e:
+                logger.error("Closing the replaced data release failed: %s", e)
+        for listener in self.listeners:
+            try:
+                listener(previous, data, settings)
+            except Exception as e:
+                logger.error("Data release listener %r failed: %s", listener, e)
+
+    def watch(self, path: str, interval: float) -> threading.Thread:
+        """reload whenever the file at path is replaced or rewritten
+
+        A change is acted on once the file's identity has held for a whole
+        interval, so a release is not read while it is still being copied in.
+        """
+        self.stop_watching()
+        stop = self._watch_stop = threading.Event()
+        args = (path, file_identity(path), interval, stop)
+        thread = threading.Thread(target=self._watch, args=args, name="data-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def _watch(self, path: str, served: Optional[FileIdentity], interval: float, stop: threading.Event) -> None:
+        """poll the file's identity until stopped"""
+        seen = served
+        while not stop.wait(interval):
+            current = file_identity(path)
+            if current is not None and current == seen and current != served and self.reload():
+                served = current
+            seen = current
+
+    def stop_watching(self) -> None:
+        """stop any file watch"""
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
+
+    def reload_status(self) -> ReloadStatus:
+        """the release being served, and the state of any reload"""
+        return ReloadStatus(
+            reloading=self.reloading,
+            provenance=self.data.provenance if self.data is not None else None,
+            reloaded_at=self.reloaded_at,
+            error=str(self.reload_error) if self.reload_error is not None else None,
+        )
+
+    def readiness(self) -> Readiness:
+        """loaded, and the database of the release served still matching the fingerprint it was loaded under"""
+        if self.error is not None:
+            return Readiness(status="failed", detail=str(self.error))
+        if self.data is None:
+            return Readiness(status="loading")
+        health = self.data.health
+        if health is not None and not health.healthy:
+            return Readiness(status="unverified", detail=health.detail, provenance=self.data.provenance)
+        return Readiness(status="ready", provenance=self.data.provenance)
 
 
-BaseData = DataLoader().base_data
+def configure_release(settings: Dict[str, Any]) -> None:
+    """load the release with these DataLoader settings in this process; a pool worker initializer"""
+    calculator_data.settings = settings
 
 
-# dependency function
-def load_data():
-    """get data"""
-    return BaseData
+calculator_data = CalculatorData()
@@ -0,0 +1,191 @@
+"""calculation pool: bounded, off the event loop
+
+With MATCHBOX_CALC_POOL=process, a calculation gets its release name for the data, to load with ``load_release``.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Literal, Optional, Tuple
+
+from pydantic import BaseModel
+
+DEFAULT_CALC_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_CALC_QUEUE_SIZE = 64
+DEFAULT_CALC_DEADLINE = 10.0  # seconds
+POOL_KINDS = ("thread", "process")
+
+
+class PoolSaturated(RuntimeError):
+    """Every worker is busy and the queue is full."""
+
+
+class CalculationTimeout(TimeoutError):
+    """A calculation did not finish within its deadline."""
+
+
+class PoolStats(BaseModel):
+    """calculation pool counters, for sizing the workers and queue"""
+
+    kind: Literal["thread", "process"]
+    workers: int
+    queue_size: int
+    deadline: float
+    in_flight: int
+    queued: int
+    peak_queued: int
+    completed: int
+    rejected: int
+    timed_out: int
+    mean_wait_ms: float
+    max_wait_ms: float
+
+
+def _timed(fn: Callable, data: Any, args: Tuple) -> Tuple[Any, float]:
+    """call fn in a worker, returning its result and how long it ran"""
+    started = time.perf_counter()
+    result = fn(data, *args)
+    return result, time.perf_counter() - started
+
+
+class CalculationPool:
+    """a bounded pool of calculation workers, shedding work past ``workers`` + ``queue_size`` and ``deadline``
+
+    A calculation that times out after starting runs on, and keeps its slot, as it cannot be interrupted safely.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_CALC_WORKERS,
+        queue_size: int = DEFAULT_CALC_QUEUE_SIZE,
+        deadline: float = DEFAULT_CALC_DEADLINE,
+        kind: str = "thread",
+    ):
+        if workers < 1 or queue_size < 0 or deadline <= 0:
+            raise ValueError(f"invalid calculation pool: {workers=}, {queue_size=}, {deadline=}")
+        if kind not in POOL_KINDS:
+            raise ValueError(f"unsupported calculation pool kind: {kind!r}")
+        self.workers = workers
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        # run in each new worker process, e.g. to point it at a hot-swapped data release
+        self.initializer: Optional[Callable] = None
+        self.initargs: Tuple = ()
+        self._lock = threading.Lock()  # slots are released from worker threads
+        self.in_flight = self.peak_queued = 0
+        self.completed = self.rejected = self.timed_out = 0
+        self._waits = 0
+        self._total_wait = self._max_wait = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        """the underlying executor, started on first use"""
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: workers must not inherit the loop's threads or locks
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=self.initializer,
+                    initargs=self.initargs,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="calc")
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        """calculations submitted but not yet running"""
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, fn: Callable, data: Any, *args) -> Any:
+        """fn(data, *args) on a worker, within the deadline
+
+        The slot taken here is given back when the calculation finishes or is
+        cancelled, not when the caller stops waiting for it.
+        """
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise PoolSaturated(f"calculation queue is full ({self.queue_size} waiting)")
+            self.in_flight += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        data = getattr(data, "release", None) if self.kind == "process" else data
+        submitted = time.perf_counter()
+        try:
+            future = self.executor.submit(_timed, fn, data, args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            result, ran = await asyncio.wait_for(asyncio.wrap_future(future), self.deadline)
+        except asyncio.TimeoutError as exc:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise CalculationTimeout(f"calculation exceeded its {self.deadline:g}s deadline") from exc
+
+        wait = max(0.0, time.perf_counter() - submitted - ran)
+        with self._lock:
+            self.completed += 1
+            self._waits += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        return result
+
+    def _release(self, future: Any = None) -> None:
+        """give back a calculation's slot"""
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> PoolStats:
+        """a snapshot of the counters"""
+        with self._lock:
+            return PoolStats(
+                kind=self.kind,
+                workers=self.workers,
+                queue_size=self.queue_size,
+                deadline=self.deadline,
+                in_flight=self.in_flight,
+                queued=self.queued,
+                peak_queued=self.peak_queued,
+                completed=self.completed,
+                rejected=self.rejected,
+                timed_out=self.timed_out,
+                mean_wait_ms=1000 * self._total_wait / self._waits if self._waits else 0.0,
+                max_wait_ms=1000 * self._max_wait,
+            )
+
+    def recycle(self, initializer: Optional[Callable] = None, initargs: Tuple = ()) -> None:
+        """run later calculations on fresh worker processes, started with initializer(*initargs)
+
+        Calculations already submitted finish on the old workers, which then
+        exit. Threads share the caller's data, so a thread pool only records
+        the initializer, in case it is switched to processes.
+        """
+        self.initializer, self.initargs = initializer, initargs
+        if self.kind == "process" and self._executor is not None:
+            retired, self._executor = self._executor, None
+            retired.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """stop the workers; the pool starts afresh if used again"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+calculation_pool = CalculationPool(
+    workers=int(os.getenv("MATCHBOX_CALC_WORKERS", DEFAULT_CALC_WORKERS)),
+    queue_size=int(os.getenv("MATCHBOX_CALC_QUEUE_SIZE", DEFAULT_CALC_QUEUE_SIZE)),
+    deadline=float(os.getenv("MATCHBOX_CALC_DEADLINE", DEFAULT_CALC_DEADLINE)),
+    kind=os.getenv("MATCHBOX_CALC_POOL", "thread"),
+)
@@ -0,0 +1,109 @@
+"""donor database fingerprint cache: a recorded SHA-256, trusted while the file's identity is unchanged
+
+With MATCHBOX_VERIFY_FINGERPRINT, a trusted fingerprint is also rehashed in the background by ``verify_in_background``.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from .logger import log_manager
+
+logger = log_manager.get_logger("error.log", log_source="fingerprint.py")
+
+FINGERPRINT_CACHE_SUFFIX = ".sha256.json"
+
+FileIdentity = Tuple[int, int, int, int]
+
+
+def file_identity(path: Path) -> Optional[FileIdentity]:
+    """(device, inode, size, mtime_ns) of a file, or None if it cannot be read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def fingerprint_cache_path(cache_dir: str, db_path: str) -> Path:
+    """where a database's fingerprint is recorded"""
+    return Path(cache_dir) / f"{Path(db_path).name}{FINGERPRINT_CACHE_SUFFIX}"
+
+
+class FingerprintCache:
+    """a recorded SHA-256 for one file, valid while the file's identity is unchanged"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def get(self, identity: Optional[FileIdentity]) -> Optional[str]:
+        """the recorded fingerprint, if it was recorded for this identity"""
+        if identity is None:
+            return None
+        try:
+            entry = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or tuple(entry.get("identity") or ()) != identity:
+            return None
+        return entry.get("sha256")
+
+    def put(self, identity: FileIdentity, sha256: str) -> None:
+        """record a fingerprint; a cache that cannot be written is only logged"""
+        partial = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            partial.write_text(json.dumps({"identity": list(identity), "sha256": sha256}))
+            os.replace(partial, self.path)
+        except OSError as e:
+            logger.warning("Unable to record fingerprint in %s: %s", self.path.name, e)
+            partial.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        """forget the recorded fingerprint"""
+        try:
+            self.path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning("Unable to clear fingerprint in %s: %s", self.path.name, e)
+
+
+class FingerprintHealth:
+    """whether the database behind one loaded release still hashes to its fingerprint"""
+
+    def __init__(self):
+        self.healthy = True
+        self.detail: Optional[str] = None
+
+    def mark_mismatch(self, detail: str) -> None:
+        """the database no longer matches the fingerprint its data was served under"""
+        self.healthy = False
+        self.detail = detail
+
+
+def verify_in_background(
+    name: str,
+    expected: str,
+    rehash: Callable[[], str],
+    health: FingerprintHealth,
+    cache: Optional[FingerprintCache] = None,
+) -> threading.Thread:
+    """fully rehash in a daemon thread, marking ``health`` if the result differs from ``expected``"""
+
+    def verify():
+        try:
+            actual = rehash()
+        except Exception as e:  # any failure to rehash is a failed verification
+            actual, failure = None, f"could not be rehashed: {e}"
+        else:
+            failure = f"hashes to {actual}, not {expected}"
+        if actual != expected:
+            logger.error("Verification failed: %s %s", name, failure)
+            health.mark_mismatch(f"{name} {failure}")
+            if cache is not None:
+                cache.clear()
+
+    thread = threading.Thread(target=verify, name="fingerprint-verify", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,65 @@
+"""B/DR grade classes: a partition's donors grouped by the B and DR broads they carry, graded once a class"""
+
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+
+from .bitset import DonorBitsets, owned_buffers
+from .calculator import MISMATCH_LOCI, grade_counts, mismatch_weights
+
+
+class GradeClasses:
+    """the donors of one partition grouped by their B and DR broads, as one class code per donor"""
+
+    def __init__(self, donors: DonorBitsets, hla_bdr: Dict[str, List[str]]):
+        self.hla_bdr = hla_bdr
+        self.columns, _ = mismatch_weights(donors.columns, {}, hla_bdr, {})
+        phenotypes, codes = donors.phenotypes(self.columns)
+        # float32 holds the 0/1 phenotypes and their small mismatch counts exactly
+        self.phenotypes = phenotypes.astype(np.float32)  # (classes, columns)
+        self.codes = codes.astype(np.int32)  # class of each partition row
+        self.sizes = self._tally(self.codes, donors.row_weights)
+        for array in (self.phenotypes, self.codes, self.sizes):
+            array.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.phenotypes)
+
+    def buffers(self) -> Dict[int, int]:
+        """the phenotypes, codes and sizes, by buffer (see bitset.owned_buffers)"""
+        return owned_buffers(self.phenotypes, self.codes, self.sizes)
+
+    def counts(self, compatible: DonorBitsets) -> np.ndarray:
+        """compatible donors in each class
+
+        ``compatible`` must be the partition the classes were built from, or a
+        selection of it.
+        """
+        if compatible.rows is None:
+            return self.sizes
+        return self._tally(self.codes[compatible.rows], compatible.row_weights)
+
+    def _tally(self, codes: np.ndarray, weights: Optional[np.ndarray]) -> np.ndarray:
+        """donors per class among rows of the given codes, weighted for a compacted partition"""
+        tally = np.bincount(codes, weights=weights, minlength=len(self.phenotypes))
+        return tally.astype(np.int64, copy=False)
+
+    def match_counts(
+        self, compatible: DonorBitsets, recipient_bdr: Dict[str, Set[str]], ag_defaults: Dict[str, str]
+    ) -> Dict[str, int]:
+        """grade counts for the compatible donors, grading each class once"""
+        _, weights = mismatch_weights(self.columns, recipient_bdr, self.hla_bdr, ag_defaults)
+        mismatches = np.rint(self.phenotypes @ weights.astype(np.float32)).astype(np.int64)
+        return grade_counts(
+            mismatches[:, MISMATCH_LOCI.index("B")],
+            mismatches[:, MISMATCH_LOCI.index("DR")],
+            weights=self.counts(compatible),
+        )
+
+
+def grade_classes(
+    partitions: Mapping[Tuple[int, str], DonorBitsets], hla_bdr: Dict[str, List[str]]
+) -> Mapping[Tuple[int, str], GradeClasses]:
+    """grade classes for every (donor_set, blood group) partition"""
+    return MappingProxyType({key: GradeClasses(partition, hla_bdr) for key, partition in partitions.items()})
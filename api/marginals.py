@@ -0,0 +1,109 @@
+"""marginal cRF: what each spec costs the recipient, and what each candidate antigen would"""
+
+from typing import Dict, List, Optional, Sequence, Set
+
+import numpy as np
+from pydantic import BaseModel
+
+from .bitset import DonorEngine
+from .calculator import (
+    MISMATCH_LOCI,
+    Results,
+    favourable_donors,
+    grade_counts,
+    matchability_band,
+    mismatch_counts,
+    mismatch_weights,
+    tally_results,
+)
+
+
+class Marginal(BaseModel):
+    """the outcome of one what-if: one spec removed, or one antigen added"""
+
+    antigen: str
+    crf: float
+    available: int
+    favourable: Optional[int] = None
+    matchability: Optional[int] = None
+
+
+class Marginals(BaseModel):
+    """the current result, and every single-antigen change to the specs"""
+
+    results: Results
+    removed: List[Marginal]
+    added: List[Marginal]
+
+
+def spec_marginals(
+    donors: DonorEngine,
+    abo: str,
+    specs: Sequence[str],
+    candidates: Sequence[str],
+    recipient_bdr: Optional[Dict[str, Set[str]]],
+    hla_bdr: Dict[str, List[str]],
+    ag_defaults: Dict[str, str],
+    matchability_bands: Dict[str, Dict[int, int]],
+) -> Marginals:
+    """the result for specs, plus each spec removed and each candidate added
+
+    ``donors`` is one blood group partition. Each Marginal reports what a
+    Calculator would for the changed spec list. Favourable counts and
+    matchability are only reported when there is a recipient to grade against,
+    and a removal that would make a donor with ungradeable B/DR counts
+    compatible reports none.
+    """
+    specs = list(dict.fromkeys(specs))
+    candidates = [ag for ag in dict.fromkeys(candidates) if ag not in specs]
+    total = len(donors)
+    if not total:
+        raise ValueError(f"no donors of blood group {abo} in this donor set")
+
+    # donors behind each row: more than one each for a compacted partition
+    weights = donors.row_weights if donors.row_weights is not None else np.ones(donors.n_rows, dtype=np.int64)
+    spec_hits = donors.indicators(specs).astype(np.int64)
+    hit_counts = spec_hits.sum(axis=1)
+    compatible = hit_counts == 0
+    sole = hit_counts == 1
+    incompatible = total - int(weights[compatible].sum())
+
+    match_counts = favourable = ungradeable = None
+    mismatch_columns, mismatch = [], np.zeros((0, len(MISMATCH_LOCI)), dtype=np.int64)
+    if recipient_bdr:
+        mismatch_columns, mismatch = mismatch_weights(donors.columns, recipient_bdr, hla_bdr, ag_defaults)
+        counts = mismatch_counts(donors, recipient_bdr, hla_bdr, ag_defaults)
+        b_mm, dr_mm = (counts[locus].to_numpy() for locus in MISMATCH_LOCI)
+        # raises for ungradeable compatible donors, as the Calculator would
+        match_counts = grade_counts(b_mm[compatible], dr_mm[compatible], weights=weights[compatible])
+        favourable, ungradeable = favourable_donors(b_mm, dr_mm)
+    results = tally_results(total, incompatible, match_counts, matchability_bands, abo)
+
+    def marginal(antigen: str, changed_incompatible: int, fav: Optional[int]) -> Marginal:
+        return Marginal(
+            antigen=antigen,
+            crf=changed_incompatible / total,
+            available=total - changed_incompatible,
+            favourable=fav,
+            matchability=matchability_band(matchability_bands[abo], fav) if fav is not None else None,
+        )
+
+    # donors hit by exactly one spec become compatible when that spec is dropped
+    freed = weights[sole] @ spec_hits[sole]
+    removed_fav: List[Optional[int]] = [None] * len(specs)
+    if favourable is not None:
+        gained = weights[sole & favourable] @ spec_hits[sole & favourable]
+        blocked = spec_hits[sole & ungradeable].sum(axis=0)
+        removed_fav = [None if blocked[n] else results.favourable + int(gained[n]) for n in range(len(specs))]
+    removed = [marginal(ag, incompatible - int(freed[n]), removed_fav[n]) for n, ag in enumerate(specs)]
+
+    # compatible donors carrying a candidate become incompatible when it is added
+    groups, carriers = donors.split(specs)[0].carrier_counts(candidates, mismatch_columns, mismatch)
+    lost = carriers.sum(axis=1)
+    added_fav: List[Optional[int]] = [None] * len(candidates)
+    if favourable is not None:
+        lost_fav = carriers @ favourable_donors(groups[:, 0], groups[:, 1])[0]
+        added_fav = [results.favourable - int(lost_fav[n]) for n in range(len(candidates))]
+    added = [marginal(ag, incompatible + int(lost[n]), added_fav[n]) for n, ag in enumerate(candidates)]
+
+    return Marginals(results=results, removed=removed, added=added)
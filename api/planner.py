@@ -0,0 +1,195 @@
+"""antigen-avoidance planning: the fewest specs to drop to reach a target cRF"""
+
+import math
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+from pydantic import BaseModel
+
+from .bitset import DonorEngine
+from .calculator import (
+    MISMATCH_LOCI,
+    Results,
+    favourable_donors,
+    grade_counts,
+    matchability_band,
+    mismatch_counts,
+    tally_results,
+)
+
+# seconds a single planning request may search for
+PLAN_TIME_BUDGET = 0.5
+MAX_PLANS = 20
+
+
+class Plan(BaseModel):
+    """one way to relax the specs, and the result of doing so"""
+
+    removed: List[str]
+    specs: List[str]
+    crf: float
+    available: int
+    favourable: Optional[int] = None
+    matchability: Optional[int] = None
+
+
+class Relaxation(BaseModel):
+    """the current result and the ranked plans that reach the target"""
+
+    results: Results
+    target: float
+    plans: List[Plan]
+    complete: bool  # False if the time budget ran out first, so a smaller plan may exist
+
+
+def allowed_incompatible(total: int, target: float) -> int:
+    """the most incompatible donors that still leave cRF below target, or -1"""
+    allowed = max(-1, math.ceil(target * total) - 1)
+    while allowed + 1 < total and (allowed + 1) / total < target:
+        allowed += 1
+    while allowed >= 0 and allowed / total >= target:
+        allowed -= 1
+    return allowed
+
+
+def relaxation_plans(
+    donors: DonorEngine,
+    abo: str,
+    specs: Sequence[str],
+    target: float,
+    recipient_bdr: Optional[Dict[str, Set[str]]],
+    hla_bdr: Dict[str, List[str]],
+    ag_defaults: Dict[str, str],
+    matchability_bands: Dict[str, Dict[int, int]],
+    limit: int = 5,
+    max_removals: Optional[int] = None,
+    time_budget: float = PLAN_TIME_BUDGET,
+    clock: Callable[[], float] = time.monotonic,
+) -> Relaxation:
+    """up to ``limit`` plans, fewest specs dropped first, that bring cRF below target
+
+    ``donors`` is one blood group partition. Plans of one size are ranked by the
+    cRF they reach, then by favourable count; a plan is never a superset of a
+    smaller one. Each plan reports what a Calculator would for its remaining
+    specs, with favourable counts and matchability only when there is a
+    recipient to grade against and every freed donor can be graded.
+    """
+    deadline = clock() + time_budget
+    specs = list(dict.fromkeys(specs))
+    total = len(donors)
+    if not total:
+        raise ValueError(f"no donors of blood group {abo} in this donor set")
+
+    # donors behind each row: more than one each for a compacted partition
+    row_weights = donors.row_weights if donors.row_weights is not None else np.ones(donors.n_rows, dtype=np.int64)
+    spec_hits = donors.indicators(specs).astype(bool)
+    incompatible_rows = spec_hits.any(axis=1)
+    incompatible = int(row_weights[incompatible_rows].sum())
+
+    match_counts = favourable = ungradeable = None
+    if recipient_bdr:
+        counts = mismatch_counts(donors, recipient_bdr, hla_bdr, ag_defaults)
+        b_mm, dr_mm = (counts[locus].to_numpy() for locus in MISMATCH_LOCI)
+        # raises for ungradeable compatible donors, as the Calculator would
+        compatible_rows = ~incompatible_rows
+        match_counts = grade_counts(b_mm[compatible_rows], dr_mm[compatible_rows], weights=row_weights[compatible_rows])
+        favourable, ungradeable = favourable_donors(b_mm, dr_mm)
+    results = tally_results(total, incompatible, match_counts, matchability_bands, abo)
+
+    allowed = allowed_incompatible(total, target)
+    if allowed < 0 or incompatible <= allowed:
+        # unreachable, or already reached without dropping anything
+        current = [] if allowed < 0 else [Plan(removed=[], specs=specs, **results.model_dump(exclude={"match_counts"}))]
+        return Relaxation(results=results, target=target, plans=current, complete=True)
+    needed = incompatible - allowed
+
+    # incompatible donors grouped by hit signature, with their donor weights
+    signatures, inverse = np.unique(spec_hits[incompatible_rows], axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    incompatible_weights = row_weights[incompatible_rows]
+    weights = np.bincount(inverse, weights=incompatible_weights, minlength=len(signatures)).astype(np.int64)
+    fav_weights = blocked_weights = None
+    if favourable is not None:
+        fav_weights = np.bincount(
+            inverse, weights=incompatible_weights * favourable[incompatible_rows], minlength=len(signatures)
+        )
+        blocked_weights = np.bincount(inverse, weights=ungradeable[incompatible_rows], minlength=len(signatures))
+    hit_counts = signatures.sum(axis=1)
+    # what dropping each spec could free at most, for the bound
+    upper = signatures.T.astype(np.int64) @ weights
+
+    def drop(remaining: np.ndarray, n: int):
+        """hit counts after dropping spec n, and the donors that freed"""
+        remaining = remaining - signatures[:, n]
+        return remaining, int(weights[(remaining == 0) & signatures[:, n]].sum())
+
+    def plan(removed: List[int], remaining: np.ndarray) -> Plan:
+        freed = remaining == 0
+        changed = incompatible - int(weights[freed].sum())
+        fav = None
+        if fav_weights is not None and not blocked_weights[freed].any():
+            fav = results.favourable + int(fav_weights[freed].sum())
+        return Plan(
+            removed=[specs[n] for n in sorted(removed)],
+            specs=[ag for n, ag in enumerate(specs) if n not in removed],
+            crf=changed / total,
+            available=total - changed,
+            favourable=fav,
+            matchability=matchability_band(matchability_bands[abo], fav) if fav is not None else None,
+        )
+
+    # greedy: drop whichever spec frees most, breaking ties on progress towards freeing
+    remaining, freed, greedy = hit_counts.copy(), 0, []
+    while freed < needed:
+        live = remaining > 0
+        progress = (signatures[live] / remaining[live, np.newaxis]).T @ weights[live]
+        gains = [drop(remaining, n)[1] if n not in greedy else -1 for n in range(len(specs))]
+        best = max((n for n in range(len(specs)) if n not in greedy), key=lambda n: (gains[n], progress[n]))
+        remaining, gain = drop(remaining, best)
+        freed += gain
+        greedy.append(best)
+    found = {frozenset(greedy): plan(greedy, remaining)}
+
+    # branch and bound by plan size, specs in descending order of what they could free
+    order = sorted(range(len(specs)), key=lambda n: -upper[n])
+    prefix = np.concatenate([[0], np.cumsum(upper[order])])
+    largest = min(len(greedy), max_removals or len(specs))
+    minimal: List[frozenset] = []
+    complete = True
+
+    def search(start: int, chosen: List[int], remaining: np.ndarray, freed: int, size: int) -> bool:
+        """collect every plan of exactly ``size`` specs; False once out of time"""
+        if clock() > deadline:
+            return False
+        if len(chosen) == size:
+            key = frozenset(chosen)
+            if freed >= needed and not any(smaller <= key for smaller in minimal):
+                found[key] = plan(chosen, remaining)
+            return True
+        left = size - len(chosen)
+        for i in range(start, len(order) - left + 1):
+            if freed + prefix[i + left] - prefix[i] < needed:
+                break  # the best remaining specs cannot free enough
+            n = order[i]
+            dropped, gain = drop(remaining, n)
+            if freed + gain >= needed and left > 1:
+                # reaches the target early: found at a smaller size, or not minimal
+                continue
+            if not search(i + 1, chosen + [n], dropped, freed + gain, size):
+                return False
+        return True
+
+    for size in range(1, largest + 1):
+        if not search(0, [], hit_counts.copy(), 0, size):
+            complete = False
+            break
+        minimal.extend(key for key in found if len(key) == size)
+        if len(minimal) >= limit:
+            break
+
+    plans = sorted(
+        (found[key] for key in found if len(key) <= largest and not any(other < key for other in found)),
+        key=lambda p: (len(p.removed), p.crf, -(p.favourable or 0)),
+    )
+    return Relaxation(results=results, target=target, plans=plans[:limit], complete=complete)
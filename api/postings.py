@@ -0,0 +1,91 @@
+"""inverted antigen -> donor index"""
+
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+from .bitset import DonorBitsets, owned_buffers
+
+
+class DonorIndex:
+    """antigen -> sorted donor rows over one blood group partition, with its B/DR grade classes if given"""
+
+    def __init__(self, donors: DonorBitsets, antigens: Iterable[str], classes=None):
+        self.donors = donors
+        self.abo = donors.abo
+        self.classes = classes
+        antigens = [ag for ag in dict.fromkeys(antigens) if ag in donors.positions]
+        postings = donors.postings(antigens)
+        for rows in postings.values():
+            rows.flags.writeable = False
+        self.postings: Mapping[str, np.ndarray] = MappingProxyType(postings)
+
+    def __len__(self) -> int:
+        return len(self.donors)
+
+    @property
+    def nbytes(self) -> int:
+        """bytes of memory held by the partition, its postings and its grade classes"""
+        return sum(self.buffers().values())
+
+    def buffers(self) -> Dict[int, int]:
+        """the memory held, by buffer (see bitset.owned_buffers)"""
+        return owned_buffers(self.donors, *self.postings.values(), self.classes)
+
+    def posting(self, antigen: str) -> np.ndarray:
+        """sorted rows of the donors carrying one antigen
+
+        An antigen the index was not built for (one excluded from the exposed
+        vocabulary, say) is read from the packed words instead, so the answer
+        never depends on what was indexed.
+        """
+        if antigen in self.postings:
+            return self.postings[antigen]
+        return np.flatnonzero(self.donors.hits([antigen]))
+
+    def union(self, specs: Iterable[str]) -> np.ndarray:
+        """sorted rows of the donors carrying any of the specs"""
+        postings = [self.posting(ag) for ag in dict.fromkeys(specs)]
+        if not postings:
+            return np.array([], dtype=np.intp)
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def incompatible_count(self, specs: Iterable[str]) -> int:
+        """number of donors carrying any of the specs, from the union alone"""
+        union = self.union(specs)
+        weights = self.donors.row_weights
+        return len(union) if weights is None else int(weights[union].sum())
+
+    def blood_group(self, abo: str) -> Union["DonorIndex", DonorBitsets]:
+        """donors of one blood group: this index, if it is for that group"""
+        return self if abo == self.abo else self.donors.blood_group(abo)
+
+    def split(self, specs: List[str]) -> Tuple[DonorBitsets, DonorBitsets]:
+        """split into (compatible, incompatible) on the recipient's specs
+
+        Both halves are row selections of the partition; neither gathers any
+        packed words until something reads them.
+        """
+        incompatible = self.union(specs or [])
+        has_dsa = np.zeros(self.donors.n_rows, dtype=bool)
+        has_dsa[incompatible] = True
+        return self.donors.select(~has_dsa), self.donors.select(incompatible)
+
+
+def antigen_indexes(
+    partitions: Mapping[Tuple[int, str], DonorBitsets],
+    antigens: Iterable[str],
+    classes: Optional[Mapping[Tuple[int, str], object]] = None,
+) -> Mapping[Tuple[int, str], DonorIndex]:
+    """an index over the given antigens for every (donor_set, blood group) partition
+
+    ``classes``, if given, are the partitions' grade classes, keyed the same way.
+    """
+    antigens = list(antigens)
+    classes = classes or {}
+    return MappingProxyType(
+        {key: DonorIndex(partition, antigens, classes.get(key)) for key, partition in partitions.items()}
+    )
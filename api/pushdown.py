@@ -0,0 +1,404 @@
+"""SQLite pushdown donors: a derived artifact beside the database, answered with aggregate SQL"""
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from pandas import DataFrame, Index
+
+from .bitset import BLOOD_GROUPS, NON_ANTIGEN_COLUMNS, DonorEngine, owned_buffers
+from .calculator import MISMATCH_LOCI, grade_counts, mismatch_weights
+from .store import build_lock
+
+PUSHDOWN_SUFFIX = ".pushdown.db"
+DEFAULT_PUSHDOWN_CACHE_KB = 8192
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT NOT NULL);
+CREATE TABLE antigens (position INTEGER PRIMARY KEY, antigen TEXT NOT NULL UNIQUE);
+CREATE TABLE donors (row INTEGER PRIMARY KEY, id INTEGER, bg TEXT, dpb_typed INTEGER NOT NULL);
+CREATE TABLE donor_antigens (antigen TEXT NOT NULL, row INTEGER NOT NULL, PRIMARY KEY (antigen, row)) WITHOUT ROWID;
+"""
+# built after the rows are in, which is much faster than maintaining them while inserting
+INDEXES = """
+CREATE INDEX donor_antigens_by_row ON donor_antigens (row, antigen);
+CREATE INDEX donors_by_group ON donors (dpb_typed, bg, row);
+"""
+
+
+def pushdown_path(directory: Path, db_sha256: str, table: str) -> Path:
+    """the derived artifact for one donor database fingerprint and table"""
+    return Path(directory) / f"{db_sha256}-{table}{PUSHDOWN_SUFFIX}"
+
+
+def write_pushdown(path: Path, chunks: Iterable[DataFrame], key: Dict[str, Any]) -> None:
+    """normalise donor frames, read a chunk at a time, into a new artifact at path"""
+    partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    partial.unlink(missing_ok=True)
+    try:
+        with sqlite3.connect(partial) as conn:
+            conn.executescript(SCHEMA)
+            conn.execute("INSERT INTO meta VALUES (?)", (json.dumps(key, sort_keys=True),))
+            offset, columns = 0, None
+            for chunk in chunks:
+                if columns is None:
+                    columns = [col for col in chunk.columns if col not in NON_ANTIGEN_COLUMNS]
+                    conn.executemany("INSERT INTO antigens VALUES (?, ?)", enumerate(columns))
+                indicators = chunk[columns].eq(1).to_numpy(dtype=bool)
+                dpb = [n for n, col in enumerate(columns) if "DPB" in col]
+                ids = chunk["id"].tolist() if "id" in chunk else [None] * len(chunk)
+                bgs = chunk["bg"].astype(object).tolist() if "bg" in chunk else [None] * len(chunk)
+                dpb_typed = indicators[:, dpb].any(axis=1).astype(int).tolist()
+                rows = range(offset, offset + len(chunk))
+                conn.executemany("INSERT INTO donors VALUES (?, ?, ?, ?)", zip(rows, ids, bgs, dpb_typed))
+                donor, column = np.nonzero(indicators)
+                conn.executemany(
+                    "INSERT INTO donor_antigens VALUES (?, ?)",
+                    zip([columns[n] for n in column], (donor + offset).tolist()),
+                )
+                offset += len(chunk)
+            conn.executescript(INDEXES)
+            conn.execute("ANALYZE")
+        conn.close()
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+
+
+class PushdownStore:
+    """a derived pushdown artifact, read through one read-only connection per thread, until closed"""
+
+    def __init__(self, path: Path, cache_kb: int = None):
+        self.path = Path(path)
+        self.cache_kb = cache_kb or int(os.getenv("MATCHBOX_PUSHDOWN_CACHE_KB", DEFAULT_PUSHDOWN_CACHE_KB))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Set[sqlite3.Connection] = set()  # every thread's, so close can reach them
+        conn = self.connection()
+        self.key = json.loads(conn.execute("SELECT key FROM meta").fetchone()[0])
+        antigens = conn.execute("SELECT antigen FROM antigens ORDER BY position")
+        self.columns: List[str] = [antigen for (antigen,) in antigens]
+
+    def connection(self) -> sqlite3.Connection:
+        """this thread's connection, its page cache capped at ``cache_kb``"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn not in self._connections:
+            conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA cache_size = -{int(self.cache_kb)}")
+            conn.execute("PRAGMA mmap_size = 0")
+            with self._lock:
+                self._connections.add(conn)
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """close every thread's connection; a thread that queries again opens a new one"""
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        """all rows of one query"""
+        return self.connection().execute(sql, list(params)).fetchall()
+
+
+def open_pushdown(path: Path, key: Dict[str, Any], chunks: Callable[[], Iterable[DataFrame]]) -> PushdownStore:
+    """open the artifact at path, writing it from ``chunks()`` first if no process has yet
+
+    Concurrent starters serialise on a lock file beside it, as for the donor
+    store (see store.build_lock). An artifact written for other data is rejected.
+    """
+    path = Path(path)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with build_lock(path):
+            if not path.exists():
+                write_pushdown(path, chunks(), key)
+    store = PushdownStore(path)
+    if store.key != json.loads(json.dumps(key, sort_keys=True)):
+        raise ValueError(f"{path} was written for different data: {store.key}")
+    return store
+
+
+def _marks(values: Sequence[Any]) -> str:
+    """one placeholder per value"""
+    return ", ".join("?" * len(values))
+
+
+class DonorSQL(DonorEngine):
+    """donors read from a pushdown artifact with SQL, selected by condition; ``select`` alone pins rows"""
+
+    def __init__(self, store: PushdownStore, donor_set: int = 0):
+        self.store = store
+        self.donor_set = donor_set
+        self.abo: Optional[str] = None
+        self.conditions: Tuple[Tuple[bool, Tuple[str, ...]], ...] = ()  # donors carrying (or not) any of the specs
+        self.row_ids: Optional[np.ndarray] = None  # rows picked by select; None: every row meeting the conditions
+        self.columns: List[str] = store.columns
+        self.positions: Dict[str, int] = {col: n for n, col in enumerate(store.columns)}
+        self.blood_groups = Index(list(BLOOD_GROUPS), dtype=object)
+
+    def _where(self) -> Tuple[str, List[Any]]:
+        """the SQL condition, over ``donors d``, for the donors this selection covers"""
+        clauses, params = [], []
+        if self.donor_set:
+            clauses.append("d.dpb_typed = 1")
+        if self.abo is not None:
+            clauses.append("d.bg = ?")
+            params.append(self.abo)
+        for carrying, specs in self.conditions:
+            carries = f"EXISTS (SELECT 1 FROM donor_antigens s WHERE s.row = d.row AND s.antigen IN ({_marks(specs)}))"
+            clauses.append(carries if carrying else f"NOT {carries}")
+            params.extend(specs)
+        return " AND ".join(clauses) or "1", params
+
+    def _row_ids(self) -> np.ndarray:
+        """the covered donors' rows, ascending"""
+        if self.row_ids is not None:
+            return self.row_ids
+        where, params = self._where()
+        rows = self.store.query(f"SELECT d.row FROM donors d WHERE {where} ORDER BY d.row", params)
+        return np.array([row for (row,) in rows], dtype=np.int64)
+
+    def _positions(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """where each of the given rows falls among the covered rows, and which of them are covered"""
+        row_ids = self._row_ids()
+        positions = np.clip(np.searchsorted(row_ids, rows), 0, max(len(row_ids) - 1, 0))
+        covered = row_ids[positions] == rows if len(row_ids) else np.zeros(len(rows), dtype=bool)
+        return positions[covered], covered
+
+    def _entries(self, antigens: Sequence[str]) -> Tuple[np.ndarray, List[str]]:
+        """(position, antigen) of each of the antigens the covered donors carry"""
+        self._check(antigens)
+        antigens = list(dict.fromkeys(antigens))
+        if not antigens:
+            return np.zeros(0, dtype=np.int64), []
+        where, params = self._where()
+        entries = self.store.query(
+            f"SELECT a.row, a.antigen FROM donor_antigens a JOIN donors d ON d.row = a.row "
+            f"WHERE a.antigen IN ({_marks(antigens)}) AND {where}",
+            [*antigens, *params],
+        )
+        rows = np.array([row for row, _ in entries], dtype=np.int64)
+        positions, covered = self._positions(rows)
+        return positions, [antigen for (_, antigen), kept in zip(entries, covered) if kept]
+
+    def _check(self, antigens: Iterable[str]) -> None:
+        """KeyError for an antigen with no donor column, as DonorBitsets.mask raises"""
+        missing = [ag for ag in antigens if ag not in self.positions]
+        if missing:
+            raise KeyError(f"{missing} not in donor antigen columns")
+
+    @property
+    def n_rows(self) -> int:
+        """number of donors covered, counted by SQLite"""
+        if self.row_ids is not None:
+            return len(self.row_ids)
+        where, params = self._where()
+        return self.store.query(f"SELECT COUNT(*) FROM donors d WHERE {where}", params)[0][0]
+
+    def buffers(self) -> Dict[int, int]:
+        """the rows pinned by select, if any: the donors themselves stay in SQLite"""
+        return owned_buffers(self.row_ids)
+
+    def close(self) -> None:
+        """close the artifact's connections"""
+        self.store.close()
+
+    @property
+    def row_weights(self) -> None:
+        """None: every row is one donor"""
+        return None
+
+    @property
+    def index(self) -> Index:
+        """the covered donors' rows in the donor table"""
+        return Index(self._row_ids())
+
+    @property
+    def bg_codes(self) -> np.ndarray:
+        """blood group of each donor, as a code into ``blood_groups``"""
+        return self.blood_groups.get_indexer(self.frame["bg"])
+
+    @property
+    def frame(self) -> DataFrame:
+        """the covered donors as a frame, read back from the artifact"""
+        where, params = self._where()
+        donors = self.store.query(f"SELECT d.row, d.id, d.bg FROM donors d WHERE {where} ORDER BY d.row", params)
+        _, covered = self._positions(np.array([row for row, _, _ in donors], dtype=np.int64))
+        donors = [donor for donor, kept in zip(donors, covered) if kept]
+        frame = DataFrame(self.indicators(self.columns).astype(np.int64), columns=self.columns, index=self.index)
+        frame.insert(0, "bg", np.array([bg for _, _, bg in donors], dtype=object))
+        ids = [donor_id for _, donor_id, _ in donors]
+        if None not in ids:  # a table without ids, as the other engines hold it: rows only
+            frame.insert(0, "id", np.array(ids, dtype=np.int64))
+        return frame
+
+    def select(self, selection: np.ndarray) -> "DonorSQL":
+        """the covered donors picked by boolean mask or sorted position, pinned by row"""
+        row_ids = self._row_ids()[selection]
+        row_ids.flags.writeable = False
+        return self._derive(row_ids=row_ids)
+
+    def blood_group(self, abo: str) -> "DonorSQL":
+        """donors of one blood group"""
+        if self.abo is not None:
+            return self if self.abo == abo else self.select(np.zeros(self.n_rows, dtype=bool))
+        return self._derive(abo=abo)
+
+    def partition(self, abo: str) -> "DonorSQL":
+        """donors of one blood group: only a condition, there is nothing to copy"""
+        return self.blood_group(abo)
+
+    def compact(self) -> "DonorSQL":
+        """these donors: SQLite counts them where they lie, so there is no layout to compact"""
+        return self
+
+    def split(self, specs: List[str]) -> tuple:
+        """split into (compatible, incompatible) on the recipient's specs, as two conditions"""
+        specs = list(dict.fromkeys(specs))
+        self._check(specs)
+        if not specs:
+            return self, self.select(np.zeros(self.n_rows, dtype=bool))
+        if self.row_ids is not None:
+            return super().split(specs)
+        return (
+            self._derive(conditions=(*self.conditions, (False, tuple(specs)))),
+            self._derive(conditions=(*self.conditions, (True, tuple(specs)))),
+        )
+
+    def incompatible_count(self, specs: List[str]) -> int:
+        """number of donors carrying any of the specs, counted by SQLite"""
+        specs = list(dict.fromkeys(specs))
+        self._check(specs)
+        if not specs or self.row_ids is not None:
+            return super().incompatible_count(specs)
+        return self._derive(conditions=(*self.conditions, (True, tuple(specs)))).n_rows
+
+    def hits(self, antigens: Iterable[str]) -> np.ndarray:
+        """number of the given antigens each donor carries"""
+        positions, _ = self._entries(list(antigens))
+        return np.bincount(positions, minlength=self.n_rows).astype(np.int64)
+
+    def indicators(self, antigens: Iterable[str]) -> np.ndarray:
+        """(n_donors, n_antigens) 0/1 matrix for the given antigen columns"""
+        antigens = list(antigens)
+        positions, carried = self._entries(antigens)
+        distinct = list(dict.fromkeys(antigens))
+        slot = {antigen: n for n, antigen in enumerate(distinct)}
+        matrix = np.zeros((self.n_rows, len(distinct)), dtype=np.uint8)
+        matrix[positions, [slot[antigen] for antigen in carried]] = 1
+        return matrix[:, [slot[antigen] for antigen in antigens]]
+
+    def weighted_counts(self, antigens: Sequence[str], weights: np.ndarray) -> np.ndarray:
+        """(n_donors, k) sums of the (antigens, k) weights over the antigens each donor carries"""
+        positions, carried = self._entries(antigens)
+        by_antigen: Dict[str, np.ndarray] = {}
+        for antigen, weight in zip(antigens, weights.astype(np.int64)):
+            by_antigen[antigen] = by_antigen.get(antigen, 0) + weight
+        counts = np.zeros((self.n_rows, weights.shape[1]), dtype=np.int64)
+        if carried:
+            np.add.at(counts, positions, np.array([by_antigen[antigen] for antigen in carried]))
+        return counts
+
+    def carrier_counts(
+        self, antigens: Sequence[str], columns: Sequence[str], weights: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """the donors carrying each antigen, grouped by their weighted counts over columns, in one GROUP BY"""
+        antigens, columns = list(antigens), list(columns)
+        self._check([*antigens, *columns])
+        if self.row_ids is not None or not antigens:
+            return super().carrier_counts(antigens, columns, weights)
+        weights = np.asarray(weights, dtype=np.int64)
+        keys = [f"k{n}" for n in range(weights.shape[1])]
+        where, params = self._where()
+        if columns and keys:
+            sums = [f"{_weighted_sum(columns, weights[:, n])} AS {key}" for n, key in enumerate(keys)]
+            donors = (
+                f"SELECT d.row AS row, {', '.join(sums)} FROM donors d "
+                f"LEFT JOIN donor_antigens a ON a.row = d.row AND a.antigen IN ({_marks(columns)}) "
+                f"WHERE {where} GROUP BY d.row"
+            )
+            params = [
+                *(value for n in range(len(keys)) for value in _case_params(columns, weights[:, n])),
+                *columns,
+                *params,
+            ]
+        else:
+            donors = f"SELECT d.row AS row{''.join(f', 0 AS {key}' for key in keys)} FROM donors d WHERE {where}"
+        grouping = ", ".join(["c.antigen", *(f"x.{key}" for key in keys)])
+        rows = self.store.query(
+            f"SELECT {grouping}, COUNT(*) FROM donor_antigens c JOIN ({donors}) x ON x.row = c.row "
+            f"WHERE c.antigen IN ({_marks(antigens)}) GROUP BY {grouping}",
+            [*params, *antigens],
+        )
+        groups = sorted({tuple(key) for _, *key, _ in rows})
+        group = {key: n for n, key in enumerate(groups)}
+        slots: Dict[str, List[int]] = {}
+        for n, antigen in enumerate(antigens):
+            slots.setdefault(antigen, []).append(n)
+        carriers = np.zeros((len(antigens), len(groups)), dtype=np.int64)
+        for antigen, *key, donors_carrying in rows:
+            carriers[slots[antigen], group[tuple(key)]] = donors_carrying
+        return np.array(groups, dtype=np.int64).reshape(len(groups), len(keys)), carriers
+
+
+class PushdownGrades:
+    """grades a pushdown partition's compatible donors with one aggregate query, standing in for GradeClasses"""
+
+    def __init__(self, hla_bdr: Dict[str, List[str]]):
+        self.hla_bdr = hla_bdr
+
+    def match_counts(
+        self, compatible: DonorSQL, recipient_bdr: Dict[str, Set[str]], ag_defaults: Dict[str, str]
+    ) -> Dict[str, int]:
+        """grade counts for the compatible donors, from their donors per (B, DR) mismatch count"""
+        columns, weights = mismatch_weights(compatible.columns, recipient_bdr, self.hla_bdr, ag_defaults)
+        if compatible.row_ids is not None:
+            counts = compatible.weighted_counts(columns, weights)
+            return grade_counts(counts[:, 0], counts[:, 1])
+
+        b, dr = ([col for col, weight in zip(columns, weights[:, n]) if weight] for n in range(len(MISMATCH_LOCI)))
+        where, params = compatible._where()
+        # groups in order of their first donor, so an ungradeable donor is
+        # reported as the in-memory engines report it: the first in row order
+        groups = compatible.store.query(
+            f"SELECT b, dr, COUNT(*) FROM ("
+            f"SELECT d.row AS row, {_mismatches(b)} AS b, {_mismatches(dr)} AS dr FROM donors d "
+            f"LEFT JOIN donor_antigens a ON a.row = d.row AND a.antigen IN ({_marks(b + dr)}) "
+            f"WHERE {where} GROUP BY d.row"
+            f") GROUP BY b, dr ORDER BY MIN(row)",
+            [*b, *dr, *b, *dr, *params],
+        )
+        b_mm, dr_mm, donors = (np.array(column, dtype=np.int64) for column in zip(*groups)) if groups else ([], [], [])
+        return grade_counts(b_mm, dr_mm, weights=np.asarray(donors, dtype=np.int64))
+
+
+def _case_params(columns: Sequence[str], weights: np.ndarray) -> List[Any]:
+    """the (antigen, weight) parameters of ``_weighted_sum``, for the non-zero weights"""
+    return [value for column, weight in zip(columns, weights) if weight for value in (column, int(weight))]
+
+
+def _weighted_sum(columns: Sequence[str], weights: np.ndarray) -> str:
+    """SQL for the sum of the weights of the columns a donor carries, over its joined ``donor_antigens a``"""
+    cases = " ".join("WHEN ? THEN ?" for weight in weights if weight)
+    return f"COALESCE(SUM(CASE a.antigen {cases} ELSE 0 END), 0)" if cases else "0"
+
+
+def _mismatches(antigens: Sequence[str]) -> str:
+    """SQL for the number of the antigens a donor carries, over its joined ``donor_antigens a``"""
+    return f"COALESCE(SUM(a.antigen IN ({_marks(antigens)})), 0)" if antigens else "0"
+
+
+def pushdown_indexes(
+    partitions: Mapping[Tuple[int, str], DonorSQL], hla_bdr: Dict[str, List[str]]
+) -> Mapping[Tuple[int, str], DonorSQL]:
+    """the partitions, each carrying a PushdownGrades to grade with"""
+    grades = PushdownGrades(hla_bdr)
+    return MappingProxyType({key: partition._derive(classes=grades) for key, partition in partitions.items()})
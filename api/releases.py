@@ -0,0 +1,186 @@
+"""data releases served side by side: the default ``calculator_data`` and those named in MATCHBOX_RELEASES
+
+Named releases load on first use and stay while they fit in MATCHBOX_RELEASE_MEMORY_MB, least recently used first out.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .bitset import owned_buffers
+from .data import CalculatorData, DataLoader, DataLoadError, DataProvenance, LoadedData, calculator_data
+
+DEFAULT_RELEASE = "default"
+DEFAULT_RELEASE_MEMORY_MB = 1024
+
+
+class UnknownRelease(KeyError):
+    """A release was asked for that is not configured."""
+
+
+class ReleaseInfo(BaseModel):
+    """one configured release"""
+
+    name: str
+    loaded: bool
+    nbytes: Optional[int] = None
+    provenance: Optional[DataProvenance] = None
+
+
+class ReleaseStats(BaseModel):
+    """configured releases, and the memory the loaded ones hold"""
+
+    memory_budget: int
+    resident_bytes: int
+    evictions: int
+    releases: List[ReleaseInfo]
+
+
+def loaded_nbytes(data: LoadedData) -> int:
+    """roughly the memory a release holds: its donors, partitions and indexes, each buffer once"""
+    buffers = owned_buffers(*data.donors, *data.partitions.values(), *data.indexes.values())
+    return sum(buffers.values())
+
+
+class ReleaseCache:
+    """the default release plus named ones loaded on demand, under a memory budget"""
+
+    def __init__(
+        self,
+        settings: Mapping[str, Dict[str, Any]],
+        memory_budget: int = DEFAULT_RELEASE_MEMORY_MB << 20,
+        default: CalculatorData = None,
+        loader: Callable[..., LoadedData] = None,
+    ):
+        if DEFAULT_RELEASE in settings:
+            raise ValueError(f"{DEFAULT_RELEASE!r} names the default release and cannot be configured")
+        self.settings = dict(settings)
+        self.memory_budget = memory_budget
+        self.default = default or calculator_data
+        self._loader = loader or (lambda **settings: DataLoader(**settings).base_data)
+        self._resident: "OrderedDict[str, Tuple[LoadedData, int]]" = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.listeners: List[Callable[[LoadedData], None]] = []  # called with each unloaded release
+
+    @property
+    def names(self) -> List[str]:
+        """every release that can be selected, the default first"""
+        return [DEFAULT_RELEASE, *self.settings]
+
+    def _resident_release(self, name: str) -> Optional[LoadedData]:
+        """a loaded release, marked as just used; call with the lock held"""
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return self._resident[name][0]
+        return None
+
+    def load(self, name: Optional[str] = None) -> LoadedData:
+        """a release, loading it in this thread if it is not loaded"""
+        if name in (None, DEFAULT_RELEASE):
+            return self.default.load()
+        if name not in self.settings:
+            raise UnknownRelease(name)
+        with self._lock:
+            if (data := self._resident_release(name)) is not None:
+                return data
+            loading = self._loading.setdefault(name, threading.Lock())
+        with loading:
+            with self._lock:
+                if (data := self._resident_release(name)) is not None:
+                    return data
+            data = self._loader(**{**self.settings[name], "release": name})
+            with self._lock:
+                self._resident[name] = (data, loaded_nbytes(data))
+                evicted = self._evict(keep=name)
+        for release in evicted:
+            release.close()
+            for listener in self.listeners:
+                listener(release)
+        return data
+
+    async def get(self, name: Optional[str] = None) -> LoadedData:
+        """a release, loading it off the event loop if it is not loaded"""
+        if name in (None, DEFAULT_RELEASE):
+            return await self.default.wait()
+        with self._lock:
+            if (data := self._resident_release(name)) is not None:
+                return data
+        return await asyncio.to_thread(self.load, name)
+
+    def _default_nbytes(self) -> int:
+        """the memory the default release holds, if loaded"""
+        return loaded_nbytes(self.default.data) if self.default.data is not None else 0
+
+    def _evict(self, keep: str) -> List[LoadedData]:
+        """unload least recently used releases until the loaded ones fit; call with the lock held"""
+        evicted = []
+        resident = self._default_nbytes() + sum(nbytes for _, nbytes in self._resident.values())
+        for name in list(self._resident):
+            if resident <= self.memory_budget:
+                break
+            if name != keep:
+                data, nbytes = self._resident.pop(name)
+                resident -= nbytes
+                self.evictions += 1
+                evicted.append(data)
+        return evicted
+
+    def stats(self) -> ReleaseStats:
+        """configured releases, and the memory the loaded ones hold"""
+        default = self.default.data
+        with self._lock:
+            releases = [
+                ReleaseInfo(
+                    name=DEFAULT_RELEASE,
+                    loaded=default is not None,
+                    nbytes=self._default_nbytes() if default is not None else None,
+                    provenance=default.provenance if default is not None else None,
+                )
+            ]
+            for name in self.settings:
+                data, nbytes = self._resident.get(name, (None, None))
+                releases.append(
+                    ReleaseInfo(
+                        name=name,
+                        loaded=data is not None,
+                        nbytes=nbytes,
+                        provenance=data.provenance if data is not None else None,
+                    )
+                )
+        return ReleaseStats(
+            memory_budget=self.memory_budget,
+            resident_bytes=sum(release.nbytes or 0 for release in releases),
+            evictions=self.evictions,
+            releases=releases,
+        )
+
+
+def configured_releases() -> Dict[str, Dict[str, Any]]:
+    """the named releases in MATCHBOX_RELEASES"""
+    try:
+        settings = json.loads(os.getenv("MATCHBOX_RELEASES") or "{}")
+    except ValueError as e:
+        raise DataLoadError(f"MATCHBOX_RELEASES is not valid JSON: {e}") from e
+    if not isinstance(settings, dict) or not all(isinstance(value, dict) for value in settings.values()):
+        raise DataLoadError("MATCHBOX_RELEASES must map release names to DataLoader arguments")
+    return settings
+
+
+release_cache = ReleaseCache(
+    configured_releases(),
+    memory_budget=int(os.getenv("MATCHBOX_RELEASE_MEMORY_MB", DEFAULT_RELEASE_MEMORY_MB)) << 20,
+)
+
+
+def load_release(data: Any) -> LoadedData:
+    """the data a pool worker was handed: the data itself, or a release name (None for the default) to load"""
+    if data is None or isinstance(data, str):
+        return release_cache.load(data)
+    return data
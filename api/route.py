@@ -1,38 +1,55 @@
 """routes"""
 
+import asyncio
 import os
-from collections import defaultdict
+import secrets
 from datetime import UTC, datetime
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
 from .assets import asset_version
-from .calculator import Calculator
-from .data import load_data
-from .input_validation import AntigenValidationError, validate_recipient_hla, validate_specificities
+from .batch import (
+    BLOCK_SIZE,
+    CALCULATION_CONTEXTS,
+    BatchRecord,
+    PreparedRecord,
+    calculate_members,
+    calculation_response,
+    error_detail,
+    group_records,
+    prepare_record,
+)
+from .cache import CacheStats, result_cache
+from .calculator import Calculator, Results
+from .data import DataLoadError, DataNotReady, LoadedData, Readiness, ReloadStatus, calculator_data, configure_release
+from .executor import CalculationTimeout, PoolSaturated, PoolStats, calculation_pool
+from .input_validation import AntigenValidationError, validate_specificities
+from .marginals import Marginals, spec_marginals
 from .parser import parse_donor_type
+from .planner import MAX_PLANS, Relaxation, relaxation_plans
 from .ratelimiter import limiter
-from .recipient import canonicalise_recipient_hla
-from .schemas import CalculationResponse
+from .releases import ReleaseStats, UnknownRelease, load_release, release_cache
+from .schemas import (
+    BatchCalculationRequest,
+    BatchCalculationResponse,
+    BatchStreamAbort,
+    BatchStreamItem,
+    CalculationResponse,
+    ComparisonResponse,
+    MarginalsResponse,
+    RelaxationResponse,
+    ReloadRequest,
+)
 
 router = APIRouter()
 templates = Jinja2Templates(directory="web")
 templates.env.globals["asset_version"] = asset_version
 
-CALCULATION_CONTEXTS = {
-    0: {
-        "donor_cohort": "all_donors",
-        "calculation_mode": "all_donors_reference",
-    },
-    1: {
-        "donor_cohort": "dp_typed_only",
-        "calculation_mode": "dp_typed_subset",
-    },
-}
+NDJSON = "application/x-ndjson"  # streamed /calc/batch responses
 
 
 class NormaliseRequest(BaseModel):
@@ -41,6 +58,84 @@ class NormaliseRequest(BaseModel):
     text: str
 
 
+async def load_data(
+    release: Optional[str] = Query(None, max_length=64, description="Data release [default, or a configured one]"),
+) -> LoadedData:
+    """a data release, awaiting it while it loads; 422 if unknown, 503 if it takes too long or failed"""
+    try:
+        return await release_cache.get(release)
+    except UnknownRelease as exc:
+        raise HTTPException(status_code=422, detail=unknown_release(release)) from exc
+    except (DataNotReady, DataLoadError, OSError, ValueError) as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"}) from exc
+
+
+def unknown_release(release: str) -> dict:
+    """error detail for a release= that is not configured"""
+    return {"field": "release", "invalid": [release], "message": f"unknown release; one of {release_cache.names}"}
+
+
+def release_swapped(previous: Optional[LoadedData], data: LoadedData, settings: dict) -> None:
+    """start serving a hot-swapped release afresh: results cached and pool workers loaded under the old one go"""
+    if previous is not None and previous.provenance != data.provenance:
+        result_cache.invalidate(previous.provenance)
+    calculation_pool.recycle(configure_release, (settings,))
+
+
+def release_unloaded(data: LoadedData) -> None:
+    """drop the cached results of a release unloaded to fit the memory budget"""
+    default = calculator_data.data
+    if default is None or default.provenance != data.provenance:
+        result_cache.invalidate(data.provenance)
+
+
+calculator_data.listeners.append(release_swapped)
+release_cache.listeners.append(release_unloaded)
+
+
+def require_admin(authorization: Optional[str] = Header(default=None)) -> None:
+    """admin routes need the MATCHBOX_ADMIN_TOKEN bearer token, and do not exist without one"""
+    token = os.getenv("MATCHBOX_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorization or not secrets.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+
+@router.post("/admin/reload", response_model=ReloadStatus, status_code=202, dependencies=[Depends(require_admin)])
+async def admin_reload(body: Optional[ReloadRequest] = None):
+    """build the data release again, with any changed settings, and swap it in once it loads
+
+    Requests keep being served from the current release meanwhile; 409 if a
+    reload is already under way. Poll GET /admin/reload for the outcome.
+    """
+    overrides = body.model_dump(exclude_none=True) if body else {}
+    if calculator_data.reload(**overrides) is None:
+        raise HTTPException(status_code=409, detail="a reload is already under way")
+    return calculator_data.reload_status()
+
+
+@router.get("/admin/reload", response_model=ReloadStatus, dependencies=[Depends(require_admin)])
+async def admin_reload_status():
+    """the release being served, and whether a reload is running or failed"""
+    return calculator_data.reload_status()
+
+
+@router.get("/healthz")
+async def healthz():
+    """liveness: the server is up and its event loop answering"""
+    return {"status": "ok"}
+
+
+@router.get("/readyz", response_model=Readiness)
+async def readyz():
+    """readiness: calculator data loaded and its database fingerprint still verified; 503 otherwise"""
+    readiness = calculator_data.readiness()
+    if readiness.status != "ready":
+        return JSONResponse(status_code=503, content=readiness.model_dump(mode="json"))
+    return readiness
+
+
 @router.get("/", response_class=HTMLResponse)
 async def index(request: Request, data=Depends(load_data)):
     """index page"""
@@ -73,51 +168,330 @@ async def calc(
     recip_hla: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?\d{1,3},?)+$", description="Recipient HLA-B/DR"),
 ):
     """calculate matchability"""
-    donors = data.donors[donor_set]
-    total = len(donors)
-    recip_hla_input = recip_hla.split(",") if recip_hla else []
-    recip_hla_list, recip_hla_conversions = canonicalise_recipient_hla(
-        recip_hla_input,
-        data.mantigens,
-        data.broad_split.get("split_to_broad", {}),
-    )
-    specs = [] if not specs else specs.split(",")
     try:
-        validate_specificities(specs, data.antigens)
-        validate_recipient_hla(recip_hla_list, data.mantigens)
+        prepared = prepare_record(bg, specs, recip_hla, donor_set, data)
     except AntigenValidationError as exc:
         raise HTTPException(status_code=422, detail=exc.detail()) from exc
 
-    recip_hla_dict = defaultdict(set)
-    for hla in recip_hla_list:
-        recip_hla_dict["B" if hla.startswith("B") else "DR"].add(hla)
+    key = result_cache.key(bg, prepared.specs, prepared.recip_hla_used, donor_set)
+    results = result_cache.get(key, data.provenance)
+    if results is None:
+        results = await offload(calculate_record, data, prepared)
+        result_cache.put(key, data.provenance, results)
+    return calculation_response(prepared, results, data)
 
-    calculator = Calculator(
-        donors=data.donors[donor_set],
-        specs=specs,
-        abo=bg,
-        recipient_bdr=recip_hla_dict,
-        hla_bdr=data.mantigens,
-        ag_defaults=data.antigen_defaults,
-        matchability_bands=data.mbands,
-    )
-    results = calculator.calculate()
-    calculation_context = CALCULATION_CONTEXTS[donor_set]
+
+@router.get("/calc/cache", response_model=CacheStats, dependencies=[Depends(require_admin)])
+async def calc_cache():
+    """result cache counters, for sizing MATCHBOX_RESULT_CACHE_SIZE"""
+    return result_cache.stats()
+
+
+@router.get("/calc/releases", response_model=ReleaseStats, dependencies=[Depends(require_admin)])
+async def calc_releases():
+    """the releases that can be selected with release=, and the memory the loaded ones hold"""
+    return release_cache.stats()
+
+
+@router.get("/calc/compare", response_model=ComparisonResponse)
+@limiter.limit("60/minute", error_message="Too many requests, slow down!")
+async def calc_compare(
+    request: Request,
+    bg: str = Query(..., max_length=2, pattern=r"^[ABO]$|^AB$", description="Blood group"),
+    specs: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?[AB]?\d{1,4},?)+$", description="Recipient specs"),
+    donor_set: int = Query(0, ge=0, le=1, description="Donor set [ALL=0, DPB=1]"),
+    recip_hla: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?\d{1,3},?)+$", description="Recipient HLA-B/DR"),
+    releases: Optional[str] = Query(None, max_length=1024, description="Releases to compare [all if omitted]"),
+):
+    """one recipient against several data releases, e.g. band versions, side by side
+
+    Each release validates the inputs against its own antigens, so a spec
+    unknown to one release is an error for that release only.
+    """
+    names = list(dict.fromkeys(releases.split(","))) if releases else release_cache.names
+    unknown = [name for name in names if name not in release_cache.names]
+    if unknown:
+        raise HTTPException(status_code=422, detail=unknown_release(unknown[0]))
+    comparisons = await asyncio.gather(*(compare_release(name, bg, specs, donor_set, recip_hla) for name in names))
     return {
         "bg": bg,
-        "specs": specs,
+        "specs": [] if not specs else specs.split(","),
+        "donor_set": donor_set,
+        **CALCULATION_CONTEXTS[donor_set],
+        "recip_hla": recip_hla,
+        "calculated_at": datetime.now(UTC),
+        "releases": comparisons,
+    }
+
+
+async def compare_release(name: str, bg: str, specs: Optional[str], donor_set: int, recip_hla: Optional[str]) -> dict:
+    """one release's entry in a comparison, with the reason if it has no result
+
+    A release that cannot be loaded or calculated in time is an error for that
+    release only, so the others are still compared.
+    """
+    try:
+        data = await release_cache.get(name)
+        prepared = prepare_record(bg, specs, recip_hla, donor_set, data)
+    except AntigenValidationError as exc:
+        return {"release": name, "provenance": data.provenance, "error": exc.detail()}
+    except (DataNotReady, DataLoadError, OSError, ValueError) as exc:
+        return {"release": name, "error": {"field": "release", "invalid": [name], "message": str(exc)}}
+
+    key = result_cache.key(bg, prepared.specs, prepared.recip_hla_used, donor_set)
+    results = result_cache.get(key, data.provenance)
+    if results is None:
+        try:
+            results = await offload(calculate_record, data, prepared)
+        except HTTPException as exc:  # shed or timed out
+            return {
+                "release": name,
+                "provenance": data.provenance,
+                "error": {"status_code": exc.status_code, "message": exc.detail},
+            }
+        result_cache.put(key, data.provenance, results)
+    return {
+        "release": name,
+        "provenance": data.provenance,
         "results": results,
-        "total": total,
+        "total": len(data.donors[donor_set]),
+        "recip_hla_used": prepared.recip_hla_used or None,
+    }
+
+
+@router.get("/calc/pool", response_model=PoolStats, dependencies=[Depends(require_admin)])
+async def calc_pool():
+    """calculation pool queue depth, wait times and shed requests, for sizing its workers"""
+    return calculation_pool.stats()
+
+
+@router.get("/calc/marginals", response_model=MarginalsResponse)
+@limiter.limit("60/minute", error_message="Too many requests, slow down!")
+async def calc_marginals(
+    request: Request,
+    bg: str = Query(..., max_length=2, pattern=r"^[ABO]$|^AB$", description="Blood group"),
+    specs: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?[AB]?\d{1,4},?)+$", description="Recipient specs"),
+    data=Depends(load_data, use_cache=True),
+    donor_set: int = Query(0, ge=0, le=1, description="Donor set [ALL=0, DPB=1]"),
+    recip_hla: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?\d{1,3},?)+$", description="Recipient HLA-B/DR"),
+    candidates: Optional[str] = Query(
+        None,
+        pattern=r"^$|^([ABCD][QRPW]?[AB]?\d{1,4},?)+$",
+        description="Antigens to try adding [default: every antigen not already a spec]",
+    ),
+):
+    """cRF and favourable count with each spec removed, and with each candidate added
+
+    Every what-if is answered from one pass over the blood group partition, not
+    one calculation per antigen.
+    """
+    try:
+        prepared = prepare_record(bg, specs, recip_hla, donor_set, data)
+        if candidates:
+            candidate_list = candidates.split(",")
+            try:
+                validate_specificities(candidate_list, data.antigens)
+            except AntigenValidationError as exc:
+                raise AntigenValidationError("candidates", exc.invalid) from exc
+        else:
+            candidate_list = [ag for ags in data.antigens.values() for ag in ags]
+    except AntigenValidationError as exc:
+        raise HTTPException(status_code=422, detail=exc.detail()) from exc
+
+    marginals = await offload(calculate_marginals, data, prepared, candidate_list)
+    return {
+        "bg": bg,
+        "specs": prepared.specs,
+        **marginals.model_dump(),
+        "total": len(data.donors[donor_set]),
         "donor_set": donor_set,
-        **calculation_context,
         "calculated_at": datetime.now(UTC),
         "provenance": data.provenance,
-        "recip_hla": recip_hla,
-        "recip_hla_used": recip_hla_list or None,
-        "recip_hla_conversions": recip_hla_conversions,
+        "recip_hla_used": prepared.recip_hla_used or None,
+    }
+
+
+@router.get("/calc/plan", response_model=RelaxationResponse)
+@limiter.limit("60/minute", error_message="Too many requests, slow down!")
+async def calc_plan(
+    request: Request,
+    bg: str = Query(..., max_length=2, pattern=r"^[ABO]$|^AB$", description="Blood group"),
+    specs: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?[AB]?\d{1,4},?)+$", description="Recipient specs"),
+    data=Depends(load_data, use_cache=True),
+    donor_set: int = Query(0, ge=0, le=1, description="Donor set [ALL=0, DPB=1]"),
+    recip_hla: Optional[str] = Query(None, pattern=r"^$|^([ABCD][QRPW]?\d{1,3},?)+$", description="Recipient HLA-B/DR"),
+    target: float = Query(0.85, gt=0, le=1, description="cRF to get below"),
+    limit: int = Query(5, ge=1, le=MAX_PLANS, description="Most plans to return"),
+    max_removals: Optional[int] = Query(None, ge=1, description="Most specs a plan may drop"),
+):
+    """the fewest specs to drop to bring cRF below target, as ranked plans
+
+    The search is bounded in time; ``complete`` is false when it stopped early,
+    in which case the plans returned are valid but a smaller one may exist.
+    """
+    try:
+        prepared = prepare_record(bg, specs, recip_hla, donor_set, data)
+    except AntigenValidationError as exc:
+        raise HTTPException(status_code=422, detail=exc.detail()) from exc
+
+    relaxation = await offload(calculate_plans, data, prepared, target, limit, max_removals)
+    return {
+        "bg": bg,
+        "specs": prepared.specs,
+        **relaxation.model_dump(),
+        "total": len(data.donors[donor_set]),
+        "donor_set": donor_set,
+        "calculated_at": datetime.now(UTC),
+        "provenance": data.provenance,
+        "recip_hla_used": prepared.recip_hla_used or None,
     }
 
 
+@router.post("/calc/batch", response_model=BatchCalculationResponse)
+@limiter.limit("10/minute", error_message="Too many requests, slow down!")
+async def calc_batch(request: Request, body: BatchCalculationRequest, data=Depends(load_data)):
+    """calculate a whole waiting list in one request
+
+    Every record is validated as /calc/ would validate it, and reported on its
+    own: an invalid record gets an ``error`` entry instead of failing the
+    batch. Valid records are calculated together per donor set and blood group,
+    a block at a time, each block offloaded under its own deadline; a block
+    that is shed or overruns gives its records an ``error`` entry, and the
+    blocks already calculated are kept.
+
+    With ``Accept: application/x-ndjson`` the items are streamed instead, one
+    JSON line per record carrying its ``position`` in the request: invalid
+    records first, then each block of a group as soon as it is calculated. A
+    stream cut short by a full pool or a deadline ends with a
+    ``{"status_code", "detail"}`` line.
+    """
+    # validated before the response starts, so a full pool here is still a plain 503
+    invalid, blocks = await offload(prepare_batch, data, body.records)
+    if NDJSON in request.headers.get("accept", ""):
+        return StreamingResponse(stream_batch(data, body.records, invalid, blocks), media_type=NDJSON)
+
+    items = [None] * len(body.records)
+    for item in invalid:
+        items[item.pop("position")] = item
+    for members in blocks:
+        try:
+            calculated = await offload(calculate_block, data, members)
+        except HTTPException as exc:
+            detail = {"field": None, "invalid": [], "message": str(exc.detail)}
+            calculated = [{"position": position, "error": detail} for position, _ in members]
+        for item in calculated:
+            position = item.pop("position")
+            items[position] = {"id": body.records[position].id, **item}
+    return {"results": items}
+
+
+async def stream_batch(
+    data, records: List[BatchRecord], invalid: List[dict], blocks: List[List[Tuple[int, PreparedRecord]]]
+) -> AsyncIterator[str]:
+    """the NDJSON lines of a streamed /calc/batch, each block calculated only as the client reads"""
+    for item in invalid:
+        yield BatchStreamItem.model_validate(item).model_dump_json() + "\n"
+    for members in blocks:
+        try:
+            items = await offload(calculate_block, data, members)
+        except HTTPException as exc:
+            yield BatchStreamAbort(status_code=exc.status_code, detail=str(exc.detail)).model_dump_json() + "\n"
+            return
+        for item in items:
+            item["id"] = records[item["position"]].id
+            yield BatchStreamItem.model_validate(item).model_dump_json() + "\n"
+
+
+async def offload(fn, data, *args):
+    """fn(data, *args) on the calculation pool, off the event loop
+
+    A full pool is shed as a 503, and a calculation that overruns its deadline
+    becomes a 504.
+    """
+    try:
+        return await calculation_pool.run(fn, data, *args)
+    except PoolSaturated as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"}) from exc
+    except CalculationTimeout as exc:
+        raise HTTPException(status_code=504, detail=str(exc)) from exc
+
+
+# Calculations run on pool workers. Each takes the loaded data first, or None in
+# a process pool, where the worker loads its own.
+
+
+def calculate_record(data, prepared: PreparedRecord) -> Results:
+    """one /calc/ calculation"""
+    data = load_release(data)
+    calculator = Calculator(
+        donors=data.indexes[(prepared.donor_set, prepared.bg)],
+        specs=prepared.specs,
+        abo=prepared.bg,
+        recipient_bdr=prepared.recipient_bdr,
+        hla_bdr=data.mantigens,
+        ag_defaults=data.antigen_defaults,
+        matchability_bands=data.mbands,
+    )
+    return calculator.calculate()
+
+
+def calculate_marginals(data, prepared: PreparedRecord, candidates: List[str]) -> Marginals:
+    """the /calc/marginals what-ifs"""
+    data = load_release(data)
+    return spec_marginals(
+        data.partitions[(prepared.donor_set, prepared.bg)],
+        prepared.bg,
+        prepared.specs,
+        candidates,
+        prepared.recipient_bdr,
+        data.mantigens,
+        data.antigen_defaults,
+        data.mbands,
+    )
+
+
+def calculate_plans(
+    data, prepared: PreparedRecord, target: float, limit: int, max_removals: Optional[int]
+) -> Relaxation:
+    """the /calc/plan search"""
+    data = load_release(data)
+    return relaxation_plans(
+        data.partitions[(prepared.donor_set, prepared.bg)],
+        prepared.bg,
+        prepared.specs,
+        target,
+        prepared.recipient_bdr,
+        data.mantigens,
+        data.antigen_defaults,
+        data.mbands,
+        limit=limit,
+        max_removals=max_removals,
+    )
+
+
+def prepare_batch(data, records: List[BatchRecord]) -> Tuple[List[dict], List[List[Tuple[int, PreparedRecord]]]]:
+    """the invalid /calc/batch stream items, and the valid records in blocks of one group each"""
+    data = load_release(data)
+    invalid, groups = group_records(records, data)
+    items = [
+        {"position": position, "id": records[position].id, "error": error_detail(exc)} for position, _, exc in invalid
+    ]
+    blocks = [members[n : n + BLOCK_SIZE] for members in groups.values() for n in range(0, len(members), BLOCK_SIZE)]
+    return items, blocks
+
+
+def calculate_block(data, members: List[Tuple[int, PreparedRecord]]) -> List[dict]:
+    """the /calc/batch stream items of one block, without their ids"""
+    data = load_release(data)
+    items = []
+    for position, prepared, outcome in calculate_members(members, data):
+        if isinstance(outcome, Results):
+            items.append({"position": position, "result": calculation_response(prepared, outcome, data)})
+        else:
+            items.append({"position": position, "error": error_detail(outcome)})
+    return items
+
+
 @router.get("/broad-split/")
 async def broad_split(data=Depends(load_data)):
     """get broad/split antigen mappings"""
@@ -1,12 +1,17 @@
-"""Public API response contracts."""
+"""Public API request and response contracts."""
 
 from datetime import datetime
-from typing import Dict, List, Literal, Optional
+from typing import Dict, List, Literal, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from .batch import BatchRecord
 from .calculator import Results
 from .data import DataProvenance
+from .marginals import Marginal
+from .planner import Plan
+
+MAX_BATCH_RECORDS = 10_000
 
 
 class CalculationResponse(BaseModel):
@@ -24,3 +29,100 @@ class CalculationResponse(BaseModel):
     recip_hla: Optional[str]
     recip_hla_used: Optional[List[str]]
     recip_hla_conversions: Dict[str, str]
+
+
+class BatchCalculationRequest(BaseModel):
+    """A waiting list to calculate in one request."""
+
+    records: List[BatchRecord] = Field(max_length=MAX_BATCH_RECORDS)
+
+
+class BatchCalculationItem(BaseModel):
+    """One record's outcome: a calculation response, or the reason it has none."""
+
+    id: Union[str, int]
+    result: Optional[CalculationResponse] = None
+    error: Optional[Dict[str, object]] = None
+
+
+class BatchStreamItem(BatchCalculationItem):
+    """One line of a streamed batch: a record's outcome and its place in the request."""
+
+    position: int
+
+
+class BatchStreamAbort(BaseModel):
+    """The last line of a streamed batch that could not be finished, and why."""
+
+    status_code: int
+    detail: str
+
+
+class BatchCalculationResponse(BaseModel):
+    """Per-record outcomes, in request order."""
+
+    results: List[BatchCalculationItem]
+
+
+class MarginalsResponse(BaseModel):
+    """The current calculation, and the cRF with each spec removed or each candidate added."""
+
+    bg: str
+    specs: List[str]
+    results: Results
+    removed: List[Marginal]
+    added: List[Marginal]
+    total: int
+    donor_set: Literal[0, 1]
+    calculated_at: datetime
+    provenance: DataProvenance
+    recip_hla_used: Optional[List[str]]
+
+
+class RelaxationResponse(BaseModel):
+    """The current calculation, and ranked ways of dropping specs to bring cRF below a target."""
+
+    bg: str
+    specs: List[str]
+    results: Results
+    target: float
+    plans: List[Plan]
+    complete: bool
+    total: int
+    donor_set: Literal[0, 1]
+    calculated_at: datetime
+    provenance: DataProvenance
+    recip_hla_used: Optional[List[str]]
+
+
+class ReloadRequest(BaseModel):
+    """DataLoader settings to change on reload; omitted ones keep their current values."""
+
+    db_path: Optional[str] = Field(default=None, min_length=1)
+    # interpolated into SQL as an identifier, so only a plain one is accepted
+    table_name: Optional[str] = Field(default=None, pattern=r"^[A-Za-z_][A-Za-z0-9_]*$")
+    matchability_ver: Optional[int] = Field(default=None, gt=0)
+
+
+class ReleaseComparison(BaseModel):
+    """One release's result for a compared recipient, or the reason it has none."""
+
+    release: str
+    provenance: Optional[DataProvenance] = None
+    results: Optional[Results] = None
+    total: Optional[int] = None
+    recip_hla_used: Optional[List[str]] = None
+    error: Optional[Dict[str, object]] = None
+
+
+class ComparisonResponse(BaseModel):
+    """One recipient calculated against several data releases."""
+
+    bg: str
+    specs: List[str]
+    donor_set: Literal[0, 1]
+    donor_cohort: Literal["all_donors", "dp_typed_only"]
+    calculation_mode: Literal["all_donors_reference", "dp_typed_subset"]
+    recip_hla: Optional[str]
+    calculated_at: datetime
+    releases: List[ReleaseComparison]
@@ -0,0 +1,262 @@
+"""sharded batch runs: records, or donor row ranges, calculated on a pool of worker processes"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from .batch import BatchRecord, PreparedRecord, calculate_batch
+from .chunked import LookupTables, Outcome, RecipientTally, Throughput, prepare_tallies, tally_blocks
+from .data import DEFAULT_DATABASE_PATH, DONOR_CHUNK_ROWS, DataLoader
+from .fingerprint import file_identity
+from .logger import log_manager
+from .schemas import BatchCalculationItem
+
+logger = log_manager.get_logger("error.log", log_source="sharded.py")
+
+DEFAULT_SHARD_SIZE = 512  # records per shard
+DEFAULT_SHARD_DONORS = 500_000  # donor rows per shard, streaming donors
+DEFAULT_SHARD_WORKERS = os.cpu_count() or 1
+
+# the calculator data (or, streaming donors, the loader) of this worker process
+_worker_data: Any = None
+
+
+class ShardProgress(BaseModel):
+    """how far a sharded run has got"""
+
+    shards: int
+    done: int
+    resumed: int  # of those done, how many were read from checkpoints
+    seconds: float
+
+
+class Checkpoints:
+    """the finished shards of one job, as JSON files in a directory named after the job; none without one"""
+
+    def __init__(self, directory: Optional[str], job: Dict[str, Any]):
+        key = hashlib.sha256(json.dumps(job, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        self.path = Path(directory) / f"job-{key}" if directory else None
+
+    def load(self, shard: int) -> Optional[Any]:
+        """a shard's saved result, if there is one"""
+        if self.path is None:
+            return None
+        try:
+            return json.loads((self.path / f"shard-{shard}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def save(self, shard: int, result: Any) -> None:
+        """record a finished shard, replacing the file whole so a killed run leaves no partial one"""
+        if self.path is None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path / f"shard-{shard}.json"
+        partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        partial.write_text(json.dumps(result))
+        os.replace(partial, path)
+
+
+def _attach(settings: Dict[str, Any], load_donors: bool) -> None:
+    """load this worker's data once, mapping the run's shared donor store"""
+    global _worker_data
+    if load_donors:
+        _worker_data = DataLoader(**settings).base_data
+    else:
+        _worker_data = DataLoader(**{**settings, "use_snapshot": False, "load_donors": False})
+
+
+def _record_shard(records: List[BatchRecord]) -> List[Dict[str, Any]]:
+    """the /calc/batch items of one shard, as JSON"""
+    items = calculate_batch(_worker_data, records)
+    return [BatchCalculationItem.model_validate(item).model_dump(mode="json") for item in items]
+
+
+def _donor_shard(prepared: List[PreparedRecord], start: int, stop: int, block_rows: int) -> Dict[str, Any]:
+    """the recipients' tallies against donor rows start to stop, as JSON"""
+    tallies = [RecipientTally(record) for record in prepared]
+    tables = LookupTables(**_worker_data.lookup_tables())
+    blocks = _worker_data.donor_chunks(block_rows, start, stop)
+    throughput = tally_blocks(blocks, tallies, tables.mantigens, tables.antigen_defaults)
+    return {"tallies": [tally.state() for tally in tallies], "donors": throughput.donors, "blocks": throughput.blocks}
+
+
+def _iter_shards(
+    shards: Sequence[Tuple],
+    work: Callable,
+    initargs: Tuple,
+    workers: int,
+    checkpoints: Checkpoints,
+    progress: Optional[Callable[[ShardProgress], None]],
+) -> Iterator[Tuple[int, Any, bool]]:
+    """work(*shard) for every shard not already checkpointed, on a pool of worker processes
+
+    Yields (shard, result, calculated in this run) for the checkpointed shards
+    first, then for each of the others as its worker finishes it.
+    """
+    started = time.perf_counter()
+    results: List[Any] = [checkpoints.load(n) for n in range(len(shards))]
+    todo = [n for n, result in enumerate(results) if result is None]
+    resumed = len(shards) - len(todo)
+
+    def report(done: int) -> None:
+        status = ShardProgress(shards=len(shards), done=done, resumed=resumed, seconds=time.perf_counter() - started)
+        logger.info("sharded run: %d/%d shards done (%d resumed), %.1fs", done, len(shards), resumed, status.seconds)
+        if progress is not None:
+            progress(status)
+
+    report(resumed)
+    for n, result in enumerate(results):
+        if result is not None:
+            yield n, result, False
+    if not todo:
+        return
+    # spawn: workers start clean, and load only what _attach gives them
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(todo)), mp_context=context, initializer=_attach, initargs=initargs
+    ) as pool:
+        futures = {pool.submit(work, *shards[n]): n for n in todo}
+        for done, future in enumerate(as_completed(futures), start=resumed + 1):
+            n = futures[future]
+            result = future.result()
+            checkpoints.save(n, result)
+            report(done)
+            yield n, result, True
+
+
+def _run_shards(
+    shards: Sequence[Tuple],
+    work: Callable,
+    initargs: Tuple,
+    workers: int,
+    checkpoints: Checkpoints,
+    progress: Optional[Callable[[ShardProgress], None]],
+) -> Tuple[List[Any], List[int]]:
+    """every shard's result, as ``_iter_shards`` calculates them, and the shards calculated in this run"""
+    results: List[Any] = [None] * len(shards)
+    calculated = []
+    for n, result, fresh in _iter_shards(shards, work, initargs, workers, checkpoints, progress):
+        results[n] = result
+        if fresh:
+            calculated.append(n)
+    return results, calculated
+
+
+def _job(kind: str, records: Sequence[BatchRecord], settings: Dict[str, Any], **plan) -> Dict[str, Any]:
+    """what identifies a job for its checkpoints: its inputs, and the database as it is now"""
+    database = settings.get("db_path") or DEFAULT_DATABASE_PATH
+    return {
+        "kind": kind,
+        "records": [record.model_dump() for record in records],
+        "settings": settings,
+        "database": file_identity(Path(database)),
+        **plan,
+    }
+
+
+def iter_sharded(
+    records: Sequence[BatchRecord],
+    settings: Dict[str, Any] = None,
+    workers: int = DEFAULT_SHARD_WORKERS,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    checkpoint_dir: Optional[str] = None,
+    progress: Optional[Callable[[ShardProgress], None]] = None,
+) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+    """the (position, /calc/batch item) pairs of each shard, as its worker finishes it
+
+    ``settings`` are the DataLoader arguments each worker loads its data with.
+    Items are JSON, as /calc/batch returns them. Shards resumed from
+    checkpoints come first.
+    """
+    if workers < 1 or shard_size < 1:
+        raise ValueError(f"invalid sharded run: {workers=}, {shard_size=}")
+    settings = dict(settings or {})
+    groups: Dict[Tuple[int, str], List[int]] = defaultdict(list)
+    for position, record in enumerate(records):
+        groups[(record.donor_set, record.bg)].append(position)
+    positions = [group[n : n + shard_size] for group in groups.values() for n in range(0, len(group), shard_size)]
+    shards = [([records[position] for position in shard],) for shard in positions]
+    checkpoints = Checkpoints(checkpoint_dir, _job("records", records, settings, shard_size=shard_size))
+
+    with tempfile.TemporaryDirectory(prefix="matchbox-store-") as store_dir:
+        if not settings.get("store_dir") and not os.getenv("MATCHBOX_DONOR_STORE"):
+            settings["store_dir"] = store_dir  # so workers share one mapped copy of the donors
+        for n, shard_items, _ in _iter_shards(shards, _record_shard, (settings, True), workers, checkpoints, progress):
+            yield list(zip(positions[n], shard_items))
+
+
+def run_sharded(
+    records: Sequence[BatchRecord],
+    settings: Dict[str, Any] = None,
+    workers: int = DEFAULT_SHARD_WORKERS,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    checkpoint_dir: Optional[str] = None,
+    progress: Optional[Callable[[ShardProgress], None]] = None,
+) -> List[Dict[str, Any]]:
+    """the /calc/batch items of every record, in input order, calculated by worker processes
+
+    ``settings`` are the DataLoader arguments each worker loads its data with.
+    Items are JSON, as /calc/batch returns them.
+    """
+    items: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    for shard in iter_sharded(records, settings, workers, shard_size, checkpoint_dir, progress):
+        for position, item in shard:
+            items[position] = item
+    return items
+
+
+def run_sharded_donors(
+    records: Sequence[BatchRecord],
+    settings: Dict[str, Any] = None,
+    workers: int = DEFAULT_SHARD_WORKERS,
+    shard_donors: int = DEFAULT_SHARD_DONORS,
+    block_rows: int = DONOR_CHUNK_ROWS,
+    checkpoint_dir: Optional[str] = None,
+    progress: Optional[Callable[[ShardProgress], None]] = None,
+) -> Tuple[List[Outcome], Throughput]:
+    """every record calculated against a donor table too large to load, its rows split between workers
+
+    Returns what ``run_chunked`` returns for the same records and table. The
+    throughput covers only the shards calculated in this run, not those
+    resumed from checkpoints.
+    """
+    if workers < 1 or shard_donors < 1:
+        raise ValueError(f"invalid sharded run: {workers=}, {shard_donors=}")
+    settings = dict(settings or {})
+    started = time.perf_counter()
+    loader = DataLoader(**{**settings, "use_snapshot": False, "load_donors": False})
+    data = LookupTables(**loader.lookup_tables())
+    outcomes, tallies = prepare_tallies(records, data)
+    prepared = [tally.record for tally in tallies.values()]
+    n_donors = loader.donor_count()
+    shards = [(prepared, start, start + shard_donors, block_rows) for start in range(0, n_donors, shard_donors)]
+    checkpoints = Checkpoints(
+        checkpoint_dir, _job("donors", records, settings, shard_donors=shard_donors, block_rows=block_rows)
+    )
+    results, calculated = _run_shards(shards, _donor_shard, (settings, False), workers, checkpoints, progress)
+    loader.check_database_unchanged()
+
+    for result in results:
+        for tally, state in zip(tallies.values(), result["tallies"]):
+            tally.add_state(state)
+    for position, tally in tallies.items():
+        outcomes[position] = (position, tally.record, tally.outcome(data.mbands))
+    seconds = time.perf_counter() - started
+    donors = sum(results[n]["donors"] for n in calculated)
+    throughput = Throughput(
+        donors=donors,
+        blocks=sum(results[n]["blocks"] for n in calculated),
+        seconds=seconds,
+        donors_per_second=donors / seconds if seconds else 0.0,
+    )
+    return [outcomes[position] for position in sorted(outcomes)], throughput
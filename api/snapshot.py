@@ -0,0 +1,77 @@
+"""precompiled cohort snapshots: a donor store that also carries the lookup tables and provenance
+
+Used in place of the database when built for the same provenance and layout; its payload is verified in the background.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+from .bitset import DonorBitsets
+from .fingerprint import FileIdentity
+from .store import DonorStore, replace_store
+
+SNAPSHOT_SUFFIX = ".snapshot"
+SNAPSHOT_TABLES = ("antigens", "mbands", "mantigens", "antigen_defaults", "broad_split")
+
+
+def default_snapshot_path(db_path: str) -> Path:
+    """where the snapshot of a donor database is looked for: beside it"""
+    return Path(db_path).with_suffix(SNAPSHOT_SUFFIX)
+
+
+def snapshot_key(provenance: Dict[str, Any], compact: bool) -> Dict[str, Any]:
+    """the header entries a snapshot must carry to stand in for the database"""
+    return {"snapshot": True, "provenance": provenance, "compact": bool(compact)}
+
+
+def write_snapshot(
+    path: Path,
+    donor_sets: Sequence[DonorBitsets],
+    key: Dict[str, Any],
+    tables: Dict[str, Any],
+    database: Optional[FileIdentity] = None,
+) -> None:
+    """write the packed donor sets and lookup tables to a snapshot at path, verifying its payload
+
+    ``database`` is the identity of the database file the snapshot was built from.
+    """
+    metadata = {
+        "antigens": {locus: list(antigens) for locus, antigens in tables["antigens"].items()},
+        # JSON keys are strings; bands are read back with int keys in snapshot_tables
+        "mbands": {
+            bg: {int(band): int(size) for band, size in bands.items()} for bg, bands in tables["mbands"].items()
+        },
+        "mantigens": {locus: list(antigens) for locus, antigens in tables["mantigens"].items()},
+        "antigen_defaults": dict(tables["antigen_defaults"]),
+        "broad_split": tables["broad_split"],
+        # size and mtime only: a copy of the image or volume keeps them, but not the device and inode
+        "database_stat": list(database[2:]) if database else None,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    replace_store(Path(path), donor_sets, key, metadata, verify=True)
+
+
+def open_snapshot(path: Path) -> DonorStore:
+    """map the snapshot at path, reading only its header; check its key before using it"""
+    snapshot = DonorStore(Path(path))
+    missing = [name for name in SNAPSHOT_TABLES if name not in snapshot.metadata]
+    if missing:
+        raise ValueError(f"{path} is not a snapshot; it has no {', '.join(missing)}")
+    if not snapshot.header.get("payload_sha256"):
+        raise ValueError(f"{path} has no payload digest")
+    return snapshot
+
+
+def snapshot_fingerprint(snapshot: DonorStore, database: Optional[FileIdentity]) -> Optional[str]:
+    """the database SHA-256 the snapshot was built from, if the database's size and mtime are unchanged since"""
+    recorded = snapshot.metadata.get("database_stat")
+    if database is None or not recorded or tuple(recorded) != database[2:]:
+        return None
+    return (snapshot.header.get("provenance") or {}).get("donor_database_sha256")
+
+
+def snapshot_tables(snapshot: DonorStore) -> Dict[str, Any]:
+    """the lookup tables stored in a snapshot, as DataLoader builds them"""
+    tables = dict(snapshot.metadata)
+    tables["mbands"] = {bg: {int(band): size for band, size in bands.items()} for bg, bands in tables["mbands"].items()}
+    return {name: tables[name] for name in SNAPSHOT_TABLES}
@@ -0,0 +1,231 @@
+"""sparse donor cohorts: compressed sparse rows that answer what DonorBitsets answers"""
+
+from typing import Dict, Iterable, Sequence, Tuple
+
+import numpy as np
+from pandas import DataFrame, Index, Series
+
+from .bitset import NON_ANTIGEN_COLUMNS, WORD_BITS, DonorBitsets, owned_buffers
+
+
+def _index_dtype(n_columns: int) -> np.dtype:
+    """the narrowest dtype holding a column number"""
+    return np.dtype(np.uint16 if n_columns <= np.iinfo(np.uint16).max + 1 else np.int32)
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """the concatenated ranges [start, start + count) as one index array"""
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+class DonorCSR(DonorBitsets):
+    """donor antigen columns as sorted column numbers per donor row, delimited by ``indptr``; no source frame"""
+
+    def __init__(self, donors: DataFrame):
+        self._build([donors])
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[DataFrame]) -> "DonorCSR":
+        """one cohort from donor frames read a chunk at a time, none of which is kept"""
+        csr = object.__new__(cls)
+        csr._build(chunks)
+        return csr
+
+    def _build(self, chunks: Iterable[DataFrame]) -> None:
+        """set every attribute from donor frames sharing the same columns"""
+        columns, counts, indices, blood_groups, ids = None, [], [], [], []
+        for chunk in chunks:
+            chunk_columns = [col for col in chunk.columns if col not in NON_ANTIGEN_COLUMNS]
+            if columns is None:
+                columns = chunk_columns
+            elif chunk_columns != columns:
+                raise ValueError("donor chunks have different antigen columns")
+            rows, cols = np.nonzero(chunk[columns].eq(1).to_numpy(dtype=bool))
+            counts.append(np.bincount(rows, minlength=len(chunk)))
+            indices.append(cols.astype(_index_dtype(len(columns))))
+            blood_groups.append(chunk.get("bg", Series(index=chunk.index, dtype=object)).to_numpy(dtype=object))
+            if "id" in chunk and chunk["id"].dtype.kind in "iu":
+                ids.append(chunk["id"].to_numpy(dtype=np.int64))
+        columns = columns or []
+        counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+        codes, groups = Series(np.concatenate(blood_groups) if blood_groups else [], dtype=object).factorize()
+        self.__dict__.update(
+            source=None,
+            abo=None,
+            rows=None,
+            source_rows=None,
+            weights=None,
+            ids=np.concatenate(ids) if ids and sum(map(len, ids)) == len(counts) else None,
+            columns=columns,
+            positions={col: n for n, col in enumerate(columns)},
+            blood_groups=Index(list(groups), dtype=object),
+            _bg_codes=codes.astype(np.int8),
+            indptr=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            indices=np.concatenate(indices) if indices else np.zeros(0, dtype=_index_dtype(len(columns))),
+            _bits=None,
+        )
+        for array in (self._bg_codes, self.indptr, self.indices, self.ids):
+            if array is not None:
+                array.flags.writeable = False
+
+    def buffers(self) -> Dict[int, int]:
+        """the entries as well as DonorBitsets' arrays, by buffer"""
+        return {**super().buffers(), **owned_buffers(self.indptr, self.indices)}
+
+    @property
+    def n_rows(self) -> int:
+        """number of packed rows covered"""
+        return len(self.indptr) - 1 if self.rows is None else len(self.rows)
+
+    @property
+    def nnz(self) -> int:
+        """number of antigen entries in the covered rows"""
+        if self.rows is None:
+            return len(self.indices)
+        return int((self.indptr[self.rows + 1] - self.indptr[self.rows]).sum())
+
+    def _entries(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(row, column) of every antigen the covered donors carry, rows numbered within the selection"""
+        if self.rows is None:
+            return np.repeat(np.arange(self.n_rows), np.diff(self.indptr)), self.indices
+        starts = self.indptr[self.rows]
+        counts = self.indptr[self.rows + 1] - starts
+        return np.repeat(np.arange(len(self.rows)), counts), self.indices[_ranges(starts, counts)]
+
+    def _lookup(self, antigens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """the distinct positions of the antigens, and where each antigen falls among them
+
+        Raises KeyError for an antigen with no donor column, as DonorBitsets.mask does.
+        """
+        missing = [ag for ag in antigens if ag not in self.positions]
+        if missing:
+            raise KeyError(f"{missing} not in donor antigen columns")
+        return np.unique(np.array([self.positions[ag] for ag in antigens], dtype=np.int64), return_inverse=True)
+
+    def _selected(self, antigens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(row, slot) of each entry among the antigens' distinct positions, and where each antigen falls"""
+        positions, inverse = self._lookup(list(antigens))
+        slot = np.full(len(self.columns), -1, dtype=np.int64)
+        slot[positions] = np.arange(len(positions))
+        row, column = self._entries()
+        slots = slot[column]
+        keep = slots >= 0
+        return row[keep], slots[keep], inverse.reshape(-1)
+
+    def mask(self, antigens: Iterable[str]) -> np.ndarray:
+        """one bitset row with a bit set for each antigen, as DonorBitsets.mask"""
+        positions, _ = self._lookup(list(antigens))
+        mask = np.zeros(max(1, -(-len(self.columns) // WORD_BITS)), dtype=np.uint64)
+        for position in positions:
+            word, bit = divmod(int(position), WORD_BITS)
+            mask[word] |= np.uint64(1) << np.uint64(bit)
+        return mask
+
+    def hits(self, antigens: Iterable[str]) -> np.ndarray:
+        """number of the given antigens each donor carries, from the entries alone"""
+        row, _, _ = self._selected(list(dict.fromkeys(antigens)))
+        return np.bincount(row, minlength=self.n_rows).astype(np.int64)
+
+    def indicators(self, antigens: Iterable[str]) -> np.ndarray:
+        """(n_donors, n_antigens) 0/1 matrix for the given antigen columns"""
+        row, slot, inverse = self._selected(list(antigens))
+        distinct = np.zeros((self.n_rows, int(inverse.max(initial=-1)) + 1), dtype=np.uint8)
+        distinct[row, slot] = 1
+        return distinct[:, inverse]
+
+    def weighted_counts(self, antigens: Sequence[str], weights: np.ndarray) -> np.ndarray:
+        """(n_donors, k) sums of the (antigens, k) weights over the antigens each donor carries"""
+        row, slot, inverse = self._selected(antigens)
+        # an antigen named twice adds its weights twice, as the dense product does
+        distinct = np.zeros((int(inverse.max(initial=-1)) + 1, weights.shape[1]), dtype=np.int64)
+        np.add.at(distinct, inverse, weights)
+        entry_weights = distinct[slot]
+        counts = [np.bincount(row, weights=entry_weights[:, k], minlength=self.n_rows) for k in range(weights.shape[1])]
+        return np.column_stack(counts).astype(np.int64).reshape(self.n_rows, weights.shape[1])
+
+    def phenotypes(self, antigens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """the distinct 0/1 rows over the given antigens, and which of them each donor has
+
+        Grouped on the antigens packed into a word per 64, built from the
+        entries, rather than on a donors x antigens matrix.
+        """
+        row, slot, inverse = self._selected(antigens)
+        n_distinct = int(inverse.max(initial=-1)) + 1
+        keys = np.zeros((self.n_rows, max(1, -(-n_distinct // WORD_BITS))), dtype=np.uint64)
+        word, bit = np.divmod(slot, WORD_BITS)
+        np.bitwise_or.at(keys, (row, word), np.left_shift(np.uint64(1), bit.astype(np.uint64)))
+        packed, codes = np.unique(keys, axis=0, return_inverse=True)
+        bits = np.arange(n_distinct)
+        distinct = (packed[:, bits // WORD_BITS] >> (bits % WORD_BITS).astype(np.uint64)) & np.uint64(1)
+        return distinct.astype(np.uint8)[:, inverse], codes.reshape(-1)
+
+    def postings(self, antigens: Sequence[str]) -> Dict[str, np.ndarray]:
+        """sorted int32 rows of the donors carrying each antigen: the entries, transposed"""
+        row, slot, inverse = self._selected(antigens)
+        order = np.argsort(slot, kind="stable")  # rows stay ascending within each antigen
+        bounds = np.searchsorted(slot[order], np.arange(int(inverse.max(initial=-1)) + 2))
+        rows = row[order].astype(np.int32)
+        distinct = [rows[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+        return {antigen: distinct[n].copy() for antigen, n in zip(antigens, inverse)}
+
+    def partition(self, abo: str) -> "DonorCSR":
+        """donors of one blood group, with their entries copied out contiguously
+
+        Meant to be built once per blood group at load time, as DonorBitsets.partition.
+        """
+        group = self.blood_group(abo)
+        rows = np.arange(self.n_rows) if group.rows is None else group.rows
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        indices = self.indices[_ranges(starts, counts)]
+        bg_codes = self._bg_codes[rows]
+        weights = None if self.weights is None else self.weights[rows]
+        ids = None if self.ids is None else self.ids[rows]
+        source_rows = group._source_positions()
+        source_rows = np.arange(len(self.indptr) - 1) if source_rows is None else source_rows.copy()
+        for array in (indptr, indices, bg_codes, source_rows, weights, ids):
+            if array is not None:
+                array.flags.writeable = False
+        return self._derive(
+            abo=abo,
+            rows=None,
+            source_rows=source_rows,
+            weights=weights,
+            ids=ids,
+            indptr=indptr,
+            indices=indices,
+            _bg_codes=bg_codes,
+        )
+
+    def compact(self) -> "DonorCSR":
+        """one row per distinct (blood group, antigens) phenotype, weighted by its donors
+
+        As DonorBitsets.compact: each phenotype keeps its first donor's row, in
+        source order. Phenotypes are told apart on their entries packed a word
+        per 64 columns, which only lives while the rows are grouped.
+        """
+        if self.rows is not None or self.weights is not None:
+            raise ValueError("only a whole, uncompacted cohort can be compacted")
+        row, column = self._entries()
+        keys = np.zeros((self.n_rows, 1 + max(1, -(-len(self.columns) // WORD_BITS))), dtype=np.uint64)
+        keys[:, 0] = self._bg_codes.astype(np.int64).view(np.uint64)
+        word, bit = np.divmod(column.astype(np.int64), WORD_BITS)
+        np.bitwise_or.at(keys, (row, word + 1), np.left_shift(np.uint64(1), bit.astype(np.uint64)))
+        _, first, counts = np.unique(keys, axis=0, return_index=True, return_counts=True)
+        order = np.argsort(first)
+        rows, weights = first[order], counts[order].astype(np.int64)
+        starts = self.indptr[rows]
+        entries = self.indptr[rows + 1] - starts
+        indptr = np.concatenate([[0], np.cumsum(entries)]).astype(np.int64)
+        indices = self.indices[_ranges(starts, entries)]
+        bg_codes = self._bg_codes[rows]
+        source_rows = rows if self.source_rows is None else self.source_rows[rows]
+        ids = None if self.ids is None else self.ids[rows]
+        for array in (indptr, indices, bg_codes, source_rows, weights, ids):
+            if array is not None:
+                array.flags.writeable = False
+        return self._derive(
+            source_rows=source_rows, weights=weights, ids=ids, indptr=indptr, indices=indices, _bg_codes=bg_codes
+        )
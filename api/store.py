@@ -0,0 +1,249 @@
+"""memory-mapped donor store: packed donor sets written once to a file that every worker maps read-only"""
+
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bitset import BLOOD_GROUPS, DonorBitsets
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialised, see build_lock
+    fcntl = None
+
+# layout: magic, little-endian uint64 header length, JSON header, then each array at an aligned offset after it
+STORE_FORMAT = 1
+STORE_MAGIC = b"MBXDONOR"
+ALIGNMENT = 64
+DIGEST_BLOCK = 16 * 1024 * 1024  # bytes of the payload hashed at a time
+
+
+def store_path(store_dir: str, donor_database_sha256: str, donor_table: str, compact: bool) -> Path:
+    """where the store for one donor release and layout lives"""
+    layout = "compact" if compact else "full"
+    return Path(store_dir) / f"{donor_database_sha256}-{donor_table}-{layout}.v{STORE_FORMAT}.donors"
+
+
+def _store_arrays(donors: DonorBitsets) -> Tuple[Dict[str, np.ndarray], Dict[str, List[int]]]:
+    """one donor set's arrays, its rows gathered and sorted by blood group, and each blood group's row range"""
+    order = np.argsort(donors.bg_codes, kind="stable")
+    rows = order if donors.rows is None else donors.rows[order]
+    codes = donors.bg_codes[order]
+    positions = donors._source_positions()
+    source_rows = order if positions is None else positions[order]
+    arrays = {
+        "bits": donors._bits[rows],
+        "bg_codes": codes,
+        "source_rows": source_rows.astype(np.int64),
+    }
+    if donors.weights is not None:
+        arrays["weights"] = donors.weights[rows]
+    if donors.ids is not None:
+        arrays["ids"] = donors.ids[rows]
+    elif donors.source is not None and "id" in donors.source and donors.source["id"].dtype.kind in "iu":
+        arrays["ids"] = donors.source["id"].to_numpy(dtype=np.int64)[source_rows]
+
+    ranges = {}
+    for abo in BLOOD_GROUPS:
+        code = donors.blood_groups.get_indexer([abo])[0]
+        start, stop = np.searchsorted(codes, code, side="left"), np.searchsorted(codes, code, side="right")
+        ranges[abo] = [int(start), int(stop)] if code >= 0 else [0, 0]
+    return arrays, ranges
+
+
+def write_store(
+    path: Path,
+    donor_sets: Sequence[DonorBitsets],
+    key: Dict[str, object],
+    metadata: Optional[Dict[str, object]] = None,
+) -> None:
+    """write the donor sets, and any metadata, to a store file at path"""
+    columns = donor_sets[0].columns if donor_sets else []
+    if any(donors.columns != columns for donors in donor_sets):
+        raise ValueError("donor sets must share their antigen columns")
+
+    blobs: List[Tuple[int, np.ndarray]] = []
+    offset = 0
+    sets = []
+    for donors in donor_sets:
+        arrays, ranges = _store_arrays(donors)
+        specs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            specs[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+            blobs.append((offset, array))
+            offset += array.nbytes
+        sets.append({"blood_groups": list(donors.blood_groups), "partitions": ranges, "arrays": specs})
+
+    digest = hashlib.sha256()
+    written = 0
+    for position, array in blobs:
+        digest.update(bytes(position - written))  # the alignment padding, as it reads back
+        digest.update(array)
+        written = position + array.nbytes
+    header = {
+        "format": STORE_FORMAT,
+        **key,
+        "columns": columns,
+        "donor_sets": sets,
+        "metadata": metadata or {},
+        "payload_sha256": digest.hexdigest(),
+    }
+    header = json.dumps(header).encode()
+    data_start = -(-(len(STORE_MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+    with open(path, "wb") as store:
+        store.write(STORE_MAGIC)
+        store.write(np.array(len(header), dtype="<u8").tobytes())
+        store.write(header)
+        for position, array in blobs:
+            store.seek(data_start + position)
+            store.write(array.tobytes())
+        store.truncate(data_start + offset)
+        store.flush()
+        os.fsync(store.fileno())
+
+
+class DonorStore:
+    """a read-only mapping of a store file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as store:
+            magic = store.read(len(STORE_MAGIC))
+            if magic != STORE_MAGIC:
+                raise ValueError(f"{self.path} is not a donor store")
+            header_length = int(np.frombuffer(store.read(8), dtype="<u8")[0])
+            self.header = json.loads(store.read(header_length))
+        if self.header.get("format") != STORE_FORMAT:
+            raise ValueError(f"{self.path} is store format {self.header.get('format')}, not {STORE_FORMAT}")
+        self._data_start = -(-(len(STORE_MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+        self.columns: List[str] = self.header["columns"]
+        self.metadata: Dict[str, object] = self.header.get("metadata", {})
+        for stored in self.header["donor_sets"]:
+            for spec in stored["arrays"].values():
+                end = self._data_start + spec["offset"] + np.dtype(spec["dtype"]).itemsize * int(np.prod(spec["shape"]))
+                if end > len(self._map):
+                    raise ValueError(f"{self.path} is truncated")
+
+    def payload_sha256(self) -> str:
+        """SHA-256 of everything after the header, which reads the whole file once"""
+        digest = hashlib.sha256()
+        for start in range(self._data_start, len(self._map), DIGEST_BLOCK):
+            digest.update(self._map[start : start + DIGEST_BLOCK])
+        return digest.hexdigest()
+
+    def check(self, key: Dict[str, object]) -> None:
+        """ValueError unless the header carries ``key``"""
+        mismatched = {name: self.header.get(name) for name, value in key.items() if self.header.get(name) != value}
+        if mismatched:
+            raise ValueError(f"{self.path} was written for different data: {mismatched}")
+
+    def verify(self) -> None:
+        """ValueError unless the payload still hashes to the digest written into the header"""
+        expected = self.header.get("payload_sha256")
+        if not expected:
+            raise ValueError(f"{self.path} has no payload digest")
+        if self.payload_sha256() != expected:
+            raise ValueError(f"{self.path} does not match its payload digest")
+
+    def _array(self, spec: Dict[str, object]) -> np.ndarray:
+        """a read-only view of one stored array"""
+        shape, dtype = tuple(spec["shape"]), np.dtype(spec["dtype"])
+        if not np.prod(shape):
+            array = np.empty(shape, dtype=dtype)
+            array.flags.writeable = False
+            return array
+        return np.ndarray(shape, dtype=dtype, buffer=self._map, offset=self._data_start + spec["offset"])
+
+    def _donor_set(self, n: int, rows: Optional[slice] = None, abo: Optional[str] = None) -> DonorBitsets:
+        """one stored donor set, or a blood group slice of it"""
+        stored = self.header["donor_sets"][n]
+        arrays = {name: self._array(spec) for name, spec in stored["arrays"].items()}
+        if rows is not None:
+            arrays = {name: array[rows] for name, array in arrays.items()}
+        return DonorBitsets.from_arrays(
+            arrays["bits"],
+            arrays["bg_codes"],
+            stored["blood_groups"],
+            self.columns,
+            source_rows=arrays["source_rows"],
+            weights=arrays.get("weights"),
+            ids=arrays.get("ids"),
+            abo=abo,
+        )
+
+    def donor_sets(self) -> Tuple[DonorBitsets, ...]:
+        """every stored donor set, in blood group order"""
+        return tuple(self._donor_set(n) for n in range(len(self.header["donor_sets"])))
+
+    def partitions(self) -> Mapping[Tuple[int, str], DonorBitsets]:
+        """every (donor_set, blood group) partition, as slices of the mapping"""
+        return MappingProxyType(
+            {
+                (n, abo): self._donor_set(n, slice(*stored["partitions"][abo]), abo)
+                for n, stored in enumerate(self.header["donor_sets"])
+                for abo in BLOOD_GROUPS
+            }
+        )
+
+
+def replace_store(
+    path: Path,
+    donor_sets: Sequence[DonorBitsets],
+    key: Dict[str, object],
+    metadata: Optional[Dict[str, object]] = None,
+    verify: bool = False,
+) -> None:
+    """write a store beside path and rename it into place, so readers never see it partly written
+
+    With ``verify`` the written payload is hashed against its digest before
+    the rename, so a store that did not write back intact never replaces one.
+    """
+    partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        write_store(partial, donor_sets, key, metadata)
+        if verify:
+            DonorStore(partial).verify()
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+
+
+@contextmanager
+def build_lock(path: Path) -> Iterator[None]:
+    """hold the lock file beside path, so that one process at a time builds it (Linux and macOS only)"""
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def open_donor_store(path: Path, key: Dict[str, object], build: Callable[[], Sequence[DonorBitsets]]) -> DonorStore:
+    """map the store at path, writing it from ``build()`` first if no process has yet
+
+    Concurrent starters serialise on a lock file beside the store, so exactly
+    one of them builds it; the file only appears, complete, by rename. A store
+    whose header does not carry ``key`` is rejected.
+    """
+    path = Path(path)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with build_lock(path):
+            if not path.exists():
+                replace_store(path, build(), key)
+    return checked_store(path, key)
+
+
+def checked_store(path: Path, key: Dict[str, object]) -> DonorStore:
+    """map the store at path, rejecting it unless its header carries ``key``"""
+    store = DonorStore(path)
+    store.check(key)
+    return store
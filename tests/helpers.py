@@ -0,0 +1,48 @@
+"""shared test fixtures: a small donor database and a batch of records"""
+
+import sqlite3
+
+import pandas as pd
+
+from api.batch import BatchRecord
+
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bands = {
+    "A": [35, 30, 25, 20, 15, 10, 5, 2, 1, 0],
+    "B": [35, 30, 25, 20, 15, 10, 5, 2, 1, 0],
+    "O": [45, 35, 30, 25, 20, 15, 10, 5, 2, 0],
+    "AB": [10, 5, 3, 2, 1, 1, None, 1, None, 0],
+}
+
+
+def make_database(path):
+    """a small donor database with every table the loader reads"""
+    with sqlite3.connect(path) as conn:
+        mock_donors.assign(DPB1=mock_donors.id % 2).to_sql("donors", conn, index=False)
+        bands = pd.DataFrame(
+            [
+                {"bg": bg, "ver": 4, "sizes": 1, **{str(n + 1): v for n, v in enumerate(sizes)}}
+                for bg, sizes in mock_bands.items()
+            ]
+        )
+        bands.to_sql("matchability_bands", conn, index=False)
+        antigens = [("B", ag) for ag in ("B7", "B8", "B12", "B42", "B46")] + [("DR", ag) for ag in ("DR3", "DR9")]
+        pd.DataFrame(antigens, columns=["locus", "antigen"]).to_sql("matchability_antigens", conn, index=False)
+        pd.DataFrame({"locus": ["B", "DR"], "rare": ["B42", "DR9"], "default": ["B7", "DR4"]}).to_sql(
+            "antigen_defaults", conn, index=False
+        )
+        pd.DataFrame({"Locus": ["DR"], "Split": ["DR17"], "Broad": ["DR3"]}).to_sql(
+            "broad_split_mapping", conn, index=False
+        )
+    return path
+
+
+records = [
+    BatchRecord(id=1, bg="A", specs="A2,B7", recip_hla="B8,DR3"),
+    BatchRecord(id=2, bg="O", recip_hla="B42,DR9", donor_set=1),
+    BatchRecord(id=3, bg="AB", specs="A1,A3,A9,A23,A24,A43"),
+    BatchRecord(id=4, bg="B", specs="DR17", recip_hla="B7", donor_set=1),
+    BatchRecord(id=5, bg="X"),
+    BatchRecord(id=6, bg="O", specs="A9999"),
+    BatchRecord(id=7, bg="O"),
+]
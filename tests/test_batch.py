@@ -0,0 +1,132 @@
+"""tests for batch calculation"""
+
+import itertools
+import tracemalloc
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+import api.batch
+from api.batch import BatchRecord, BatchRecordError, calculate_group, group_tallies, prepare_record, run_batch
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.calculator import Calculator, Results
+from api.input_validation import AntigenValidationError
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {bg: {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0} for bg in ("A", "B", "O", "AB")}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+mock_data = MagicMock()
+mock_data.donors = (mock_bitsets, mock_bitsets)
+mock_data.partitions = blood_group_partitions((mock_bitsets, mock_bitsets))
+mock_data.antigens = {"A": ["A1", "A2", "A24", "A43"], "B": mock_mantigens["B"], "DR": ["DR3", "DR9", "DR17"]}
+mock_data.mantigens = mock_mantigens
+mock_data.mbands = mock_mbands
+mock_data.antigen_defaults = mock_ag_defaults
+mock_data.broad_split = {"broad_to_splits": {"B12": ["B44"]}, "split_to_broad": {"B44": "B12"}}
+
+SPECS = [[], ["A2"], ["A1", "A2"], ["B7", "B8", "A24"], ["DR17", "B42", "B46", "DR9"]]
+RECIPIENTS = [{}, {"B": {"B7", "B8"}, "DR": {"DR3"}}, {"B": {"B42", "B46"}, "DR": {"DR9", "DR3"}}, {"DR": {"DR9"}}]
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+def test_calculate_group_matches_a_calculator_per_recipient(abo):
+    specs, recipients = zip(*itertools.product(SPECS, RECIPIENTS))
+    partition = mock_bitsets.partition(abo)
+
+    outcomes = calculate_group(
+        partition, abo, specs, recipients, mock_mantigens, mock_ag_defaults, mock_mbands, block_size=3
+    )
+
+    assert len(outcomes) == len(specs)
+    for spec, recipient, outcome in zip(specs, recipients, outcomes):
+        expected = Calculator(
+            donors=mock_donors,
+            specs=spec,
+            abo=abo,
+            recipient_bdr=recipient,
+            hla_bdr=mock_mantigens,
+            ag_defaults=mock_ag_defaults,
+            matchability_bands=mock_mbands,
+        ).calculate()
+        assert outcome.model_dump_json() == expected.model_dump_json()
+
+
+def test_blocks_shrink_as_the_partition_grows(monkeypatch):
+    partition = DonorBitsets(pd.concat([mock_donors] * 100, ignore_index=True)).partition("O")
+    specs, recipients = zip(*itertools.product(SPECS, RECIPIENTS * 13))
+
+    def peak(cells):
+        monkeypatch.setattr(api.batch, "BLOCK_CELLS", cells)
+        tracemalloc.start()
+        try:
+            tallies = group_tallies(partition, specs, recipients, mock_mantigens, mock_ag_defaults)
+            return tallies, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    whole, whole_peak = peak(len(specs) * partition.n_rows)  # blocks of BLOCK_SIZE recipients
+    blocked, blocked_peak = peak(4 * partition.n_rows)  # blocks of four
+    assert list(map(repr, blocked)) == list(map(repr, whole))
+    assert blocked_peak * 10 < whole_peak
+
+
+def test_calculate_group_reports_invalid_counts_per_recipient():
+    hla_bdr = {"B": ["B7", "B8", "B12"], "DR": ["DR3"]}
+    donors = DonorBitsets(pd.DataFrame({"id": [1], "bg": ["O"], "B7": [1], "B8": [1], "B12": [1], "DR3": [0]}))
+
+    outcomes = calculate_group(donors, "O", [[], ["B7"]], [{"DR": {"DR3"}}, {"DR": {"DR3"}}], hla_bdr, {}, mock_mbands)
+
+    assert isinstance(outcomes[0], ValueError)
+    assert "invalid B/DR mismatch counts" in str(outcomes[0])
+    empty_counts = {"fav": 0, "m12a": 0, "m2b": 0, "m3a": 0, "m3b": 0, "m4a": 0, "m4b": 0}
+    assert outcomes[1] == Results(crf=1.0, available=0, favourable=0, matchability=10, match_counts=empty_counts)
+
+
+def test_prepare_record_canonicalises_and_validates_like_calc():
+    prepared = prepare_record("A", "A1,B7", "B44,DR9", 1, mock_data)
+
+    assert prepared.specs == ["A1", "B7"]
+    assert prepared.recip_hla_used == ["B12", "DR9"]
+    assert prepared.recip_hla_conversions == {"B44": "B12"}
+    assert prepared.recipient_bdr == {"B": {"B12"}, "DR": {"DR9"}}
+
+    with pytest.raises(AntigenValidationError):
+        prepare_record("A", "A9999", None, 0, mock_data)
+    with pytest.raises(BatchRecordError, match="bg"):
+        prepare_record("C", None, None, 0, mock_data)
+    with pytest.raises(BatchRecordError, match="donor_set"):
+        prepare_record("A", None, None, 2, mock_data)
+
+
+def test_run_batch_reports_each_record_once():
+    records = [
+        BatchRecord(id="p1", bg="O", specs="A2", recip_hla="B7"),
+        BatchRecord(id="p2", bg="X"),
+        BatchRecord(id="p3", bg="A", specs="A1,A2", donor_set=1),
+        BatchRecord(id="p4", bg="O", specs="A9999"),
+        BatchRecord(id="p5", bg="O"),
+    ]
+
+    outcomes = {position: (prepared, outcome) for position, prepared, outcome in run_batch(records, mock_data)}
+
+    assert sorted(outcomes) == [0, 1, 2, 3, 4]
+    assert isinstance(outcomes[1][1], BatchRecordError)
+    assert isinstance(outcomes[3][1], AntigenValidationError)
+    for position in (0, 2, 4):
+        prepared, outcome = outcomes[position]
+        assert (
+            outcome
+            == Calculator(
+                donors=mock_donors,
+                specs=prepared.specs,
+                abo=prepared.bg,
+                recipient_bdr=prepared.recipient_bdr,
+                hla_bdr=mock_mantigens,
+                ag_defaults=mock_ag_defaults,
+                matchability_bands=mock_mbands,
+            ).calculate()
+        )
@@ -0,0 +1,212 @@
+"""tests for waiting list files and the offline batch command"""
+
+import io
+import json
+import subprocess
+import sys
+
+import pytest
+
+from api.batch import BatchRecord, BatchRecordError
+from api.batchfile import (
+    BATCH_HEADERS,
+    PROFILE_HEADERS,
+    escape_tsv_cell,
+    profile_record,
+    profile_row,
+    read_records,
+    write_tsv,
+)
+from api.cli import batch_main, main
+from tests.helpers import make_database
+
+# the response fixture of tests/profile_export.test.js
+response = {
+    "bg": "O",
+    "specs": ["A1", "DPB4"],
+    "results": {"crf": 0.25, "matchability": 9, "favourable": 50, "available": 327},
+    "total": 3642,
+    "donor_set": 1,
+    "donor_cohort": "dp_typed_only",
+    "calculation_mode": "dp_typed_subset",
+    "calculated_at": "2026-07-31T12:00:00+00:00",
+    "recip_hla": "B44,DR17",
+    "recip_hla_used": ["B12", "DR3"],
+    "recip_hla_conversions": {"B44": "B12", "DR17": "DR3"},
+    "provenance": {
+        "upstream_source_file": "hla-mm-and-crf_2024.xlsb",
+        "upstream_source_file_size_signature": 24099579,
+        "donor_database": "donors.db",
+        "donor_database_sha256": "a" * 64,
+        "donor_table": "donors_v3",
+        "matchability_band_version": 4,
+        "data_release": "nhsbt_hla_mm_crf_2024",
+    },
+}
+
+
+def tsv_row(item):
+    """one written TSV row, by header"""
+    sink = io.StringIO()
+    write_tsv([("R1", item)], sink)
+    header, values = sink.getvalue().splitlines()
+    return dict(zip(header.split("\t"), values.split("\t")))
+
+
+def test_rows_have_the_browser_export_columns_and_values():
+    row = tsv_row({"result": response})
+
+    assert list(BATCH_HEADERS[: len(PROFILE_HEADERS)]) == list(profile_row(profile_record(response)))
+    assert (row["CRF (%)"], row["Matchability"], row["Favourable"]) == ("25", "", "")
+    assert row["Matchability Status"] == "not_applicable_dp_typed_subset"
+    assert row["Calculation Cohort Size"] == "3642"
+    assert row["Recipient HLA Used"] == "B12,DR3"
+    assert row["Recipient HLA Conversions"] == '"{""B44"":""B12"",""DR17"":""DR3""}"'
+    assert row["Data Release"] == "nhsbt_hla_mm_crf_2024"
+    assert (row["Export Schema Version"], row["Recipient ID"], row["Error"]) == ("2", "R1", "")
+
+    zeros = {**response, "donor_set": 0, "results": {"crf": 0, "matchability": 0, "favourable": 0, "available": 0}}
+    row = tsv_row({"result": zeros})
+    assert [row[header] for header in PROFILE_HEADERS[:4]] == ["0", "0", "0", "0"]
+    assert row["Matchability Status"] == "calculated"
+
+
+def test_cells_are_escaped_as_the_browser_escapes_them():
+    assert escape_tsv_cell('value\twith\n"structure"') == '"value\twith\n""structure"""'
+    assert escape_tsv_cell('=HYPERLINK("https://example.test")') == '"\'=HYPERLINK(""https://example.test"")"'
+    assert escape_tsv_cell(' \t=HYPERLINK("https://example.test")') == '"\' \t=HYPERLINK(""https://example.test"")"'
+    assert escape_tsv_cell("\u00a0@SUM(A1)") == "'\u00a0@SUM(A1)"
+    assert escape_tsv_cell("\u0085=1") == "\u0085=1"
+    assert escape_tsv_cell(-1) == "-1"
+    assert escape_tsv_cell(12.5) == "12.5"
+
+
+@pytest.mark.parametrize(
+    "value, text",
+    [
+        (25.0, "25"),
+        (-0.0, "0"),
+        (0.1 + 0.2, "0.30000000000000004"),
+        (1e-6, "0.000001"),
+        (1e-7, "1e-7"),
+        (-2.5e-8, "-2.5e-8"),
+        (1e20, "100000000000000000000"),
+        (1e21, "1e+21"),
+        (1.5e300, "1.5e+300"),
+        (float("nan"), "NaN"),
+        (True, "true"),
+    ],
+)
+def test_numbers_are_written_as_javascript_prints_them(value, text):
+    assert escape_tsv_cell(value) == text
+
+
+def test_records_are_read_with_their_tokens_normalised():
+    source = io.StringIO(
+        "ID\tbg\tspecs\trecip_hla\tdonor_set\tnotes\n"
+        "R1\to\tHLA-A02, dp4;B07\tB44 DR17\t1\tignored\n"
+        "R2\tA\tA2 Q9\t\t\t\n"
+        "\t\t\t\t\t\n"
+        "R3\tB\t\t\tnone\t\n"
+    )
+    rows = list(read_records(source, ["A2", "DPB4", "B7"], ["B12", "DR3", "B44", "DR17"]))
+
+    assert rows[0] == ("R1", BatchRecord(id="R1", bg="O", specs="A2,DPB4,B7", recip_hla="B44,DR17", donor_set=1))
+    assert rows[1] == ("R2", BatchRecord(id="R2", bg="A", specs="A2,Q9"))
+    assert rows[2][0] == "R3" and isinstance(rows[2][1], BatchRecordError)
+    assert rows[2][1].field == "donor_set" and rows[2][1].invalid == ["none"]
+    with pytest.raises(ValueError, match="bg"):
+        list(read_records(io.StringIO("id,specs\nR1,A2\n"), [], []))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_command_writes_a_row_per_recipient(tmp_path, capsys, workers):
+    database = make_database(tmp_path / "donors.db")
+    waiting_list = tmp_path / "waiting-list.csv"
+    waiting_list.write_text("id,bg,specs,recip_hla,donor_set\nR1,O,A2,B7,0\nR2,A,A1 B07,,1\nR3,O,A9999,,0\nR4,X,,,0\n")
+    output = tmp_path / "results.jsonl"
+    args = [str(waiting_list), "--db", str(database), "--table", "donors", "--output", str(output)]
+
+    assert main(["batch", *args, "--workers", str(workers)]) == 0
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [line["id"] for line in lines] == ["R1", "R2", "R3", "R4"]
+    assert lines[0]["matchability_status"] == "calculated" and lines[0]["recip_hla_used"] == ["B7"]
+    assert lines[1]["specs"] == ["A1", "B7"] and lines[1]["matchability"] is None
+    assert lines[2]["error"]["invalid"] == ["A9999"]
+    assert lines[3]["error"]["field"] == "bg"
+    assert "4 recipients" in capsys.readouterr().err
+
+    assert batch_main([*args[:-1], str(tmp_path / "results.tsv")]) == 0
+    header, *rows = (tmp_path / "results.tsv").read_text().splitlines()
+    assert header.split("\t") == list(BATCH_HEADERS) and len(rows) == 4
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_command_streams_the_donor_table_in_chunks(tmp_path, capsys, workers):
+    database = make_database(tmp_path / "donors.db")
+    waiting_list = tmp_path / "waiting-list.csv"
+    waiting_list.write_text("id,bg,specs,recip_hla,donor_set\nR1,O,A2,B7,0\nR2,A,A1 B07,,1\nR3,O,A9999,,0\n")
+    args = [str(waiting_list), "--db", str(database), "--table", "donors", "--format", "jsonl"]
+
+    def lines(output):
+        return [{**json.loads(line), "calculated_at": None} for line in output.read_text().splitlines()]
+
+    assert batch_main([*args, "--output", str(tmp_path / "loaded.jsonl")]) == 0
+    capsys.readouterr()
+    chunked = [*args, "--chunk-size", "7", "--workers", str(workers), "--output", str(tmp_path / "chunked.jsonl")]
+    assert batch_main(chunked) == 0
+    assert "100 donors in" in capsys.readouterr().err
+    assert lines(tmp_path / "chunked.jsonl") == lines(tmp_path / "loaded.jsonl")
+    assert batch_main([*args, "--chunk-size", "0"]) == 1
+
+
+def test_every_batch_mode_writes_the_same_rows_in_input_order(tmp_path):
+    database = make_database(tmp_path / "donors.db")
+    waiting_list = tmp_path / "waiting-list.csv"
+    recipients = ["R1,O,A2,B7,0", "R2,A,A1,,1", "R3,X,,,0", "R4,O,A1 B8,,1", "R5,B,,,0", "R6,A,A9999,,0", "R7,O,A3,,0"]
+    waiting_list.write_text("\n".join(["id,bg,specs,recip_hla,donor_set", *recipients]) + "\n")
+    args = [str(waiting_list), "--db", str(database), "--table", "donors"]
+    modes = {"loaded": [], "sharded": ["--workers", "2"], "chunked": ["--chunk-size", "7"]}
+    calculated_at = BATCH_HEADERS.index("Calculated At (UTC)")
+
+    def output(mode):
+        """the TSV a mode writes, without its calculation times, which differ between runs"""
+        assert batch_main([*args, *modes[mode], "--output", str(tmp_path / f"{mode}.tsv")]) == 0
+        lines = [line.split(b"\t") for line in (tmp_path / f"{mode}.tsv").read_bytes().split(b"\n")]
+        return b"\n".join(b"\t".join(cells[:calculated_at] + cells[calculated_at + 1 :]) for cells in lines)
+
+    loaded = output("loaded")
+    assert output("sharded") == loaded
+    assert output("chunked") == loaded
+    rows = [line.split("\t") for line in (tmp_path / "sharded.tsv").read_text().splitlines()[1:]]
+    assert [cells[BATCH_HEADERS.index("Recipient ID")] for cells in rows] == ["R1", "R2", "R3", "R4", "R5", "R6", "R7"]
+
+
+def test_batch_command_resumes_from_checkpoints(tmp_path, capsys):
+    database = make_database(tmp_path / "donors.db")
+    waiting_list = tmp_path / "waiting-list.csv"
+    waiting_list.write_text("id,bg,specs\nR1,O,A2\nR2,A,A1\n")
+    args = [str(waiting_list), "--db", str(database), "--table", "donors", "--format", "jsonl"]
+    args += ["--checkpoint-dir", str(tmp_path / "checkpoints"), "--progress"]
+
+    assert batch_main([*args, "--output", str(tmp_path / "first.jsonl")]) == 0
+    assert "2/2 shards done (0 resumed)" in capsys.readouterr().err
+    assert batch_main([*args, "--output", str(tmp_path / "second.jsonl")]) == 0
+    assert "2/2 shards done (2 resumed)" in capsys.readouterr().err
+    assert (tmp_path / "first.jsonl").read_text() == (tmp_path / "second.jsonl").read_text()
+
+
+def test_batch_command_reports_unusable_input(tmp_path, capsys):
+    database = str(make_database(tmp_path / "donors.db"))
+    assert batch_main([str(tmp_path / "missing.csv"), "--db", database, "--table", "donors"]) == 1
+    assert "missing.csv" in capsys.readouterr().err
+
+
+def test_batch_command_does_not_import_the_web_app():
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, api.cli; print(sorted(m for m in sys.modules if m.startswith('api.')))"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert "api.route" not in imported and "api.releases" not in imported
@@ -0,0 +1,172 @@
+"""tests for the packed donor bitsets"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.batch import calculate_group
+from api.bitset import DonorBitsets, blood_group_partitions, pack_indicators
+from api.calculator import Calculator, split_by_dsa
+from api.grades import grade_classes
+from api.postings import DonorIndex
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {
+    "A": {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0},
+    "B": {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0},
+    "O": {1: 45, 2: 35, 3: 30, 4: 25, 5: 20, 6: 15, 7: 10, 8: 5, 9: 2, 10: 1},
+    "AB": {1: 10, 2: 5, 3: 3, 4: 2, 5: 1, 6: 0},
+}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+
+
+def test_pack_indicators_places_columns_in_word_order():
+    indicators = np.zeros((2, 70), dtype=bool)
+    indicators[0, 0] = indicators[0, 63] = indicators[1, 64] = indicators[1, 69] = True
+
+    packed = pack_indicators(indicators)
+
+    assert packed.dtype == np.uint64
+    assert packed.shape == (2, 2)
+    assert packed[0].tolist() == [1 | (1 << 63), 0]
+    assert packed[1].tolist() == [0, 1 | (1 << 5)]
+
+
+def test_pack_indicators_keeps_one_word_without_columns():
+    assert pack_indicators(np.zeros((3, 0), dtype=bool)).shape == (3, 1)
+
+
+def test_hits_count_each_spec_a_donor_carries():
+    hits = mock_bitsets.hits(["A1", "A2", "B7"])
+    expected = mock_donors[["A1", "A2", "B7"]].eq(1).sum(axis=1).to_numpy()
+
+    assert hits.tolist() == expected.tolist()
+
+
+def test_indicators_unpack_the_source_columns():
+    columns = ["B7", "DR4", "A1"]
+
+    assert (mock_bitsets.indicators(columns) == mock_donors[columns].to_numpy()).all()
+
+
+def test_unknown_antigen_raises_like_a_missing_column():
+    with pytest.raises(KeyError):
+        mock_bitsets.mask(["A9999"])
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["A1", "B7", "B12", "DR18"], ["DR17", "B42", "B46", "DR9"]])
+def test_split_selects_the_same_donors_as_the_frame(abo, specs):
+    frame = mock_donors[mock_donors.bg == abo]
+    compatible, incompatible = split_by_dsa(mock_bitsets.blood_group(abo), specs)
+    expected_compatible, expected_incompatible = split_by_dsa(frame, specs)
+
+    assert compatible.frame.equals(expected_compatible)
+    assert incompatible.frame.equals(expected_incompatible)
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["B7", "B8", "A24"], ["A43", "DR17"]])
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}, {"B": {"B42"}}])
+def test_bitset_results_are_identical_to_the_frame(abo, specs, recipient_bdr):
+    """packed donors are an engine swap, not a different calculation"""
+    kwargs = {
+        "specs": specs,
+        "abo": abo,
+        "recipient_bdr": recipient_bdr,
+        "hla_bdr": mock_mantigens,
+        "ag_defaults": mock_ag_defaults,
+        "matchability_bands": mock_mbands,
+    }
+    packed = Calculator(donors=mock_bitsets, **kwargs).calculate()
+    reference = Calculator(donors=mock_donors, **kwargs).calculate()
+
+    assert packed.model_dump_json() == reference.model_dump_json()
+
+
+def test_partitions_cover_every_donor_set_and_blood_group():
+    dp_donors = mock_donors.iloc[:10]
+    partitions = blood_group_partitions((mock_bitsets, DonorBitsets(dp_donors)))
+
+    assert set(partitions) == {(n, abo) for n in (0, 1) for abo in ("A", "B", "O", "AB")}
+    for (donor_set, abo), partition in partitions.items():
+        frame = (mock_donors, dp_donors)[donor_set]
+        assert partition.abo == abo
+        assert partition.frame.equals(frame[frame.bg == abo])
+    with pytest.raises(TypeError):
+        partitions[(0, "A")] = mock_bitsets
+
+
+def test_partition_words_are_immutable():
+    partition = mock_bitsets.partition("O")
+
+    with pytest.raises(ValueError):
+        partition._bits[0, 0] = 0
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+def test_calculator_uses_a_partition_without_refiltering(abo):
+    partition = mock_bitsets.partition(abo)
+    kwargs = {"specs": ["A2", "B7"], "abo": abo, "recipient_bdr": {"B": {"B8"}, "DR": {"DR3"}}}
+    kwargs.update(hla_bdr=mock_mantigens, ag_defaults=mock_ag_defaults, matchability_bands=mock_mbands)
+
+    calculator = Calculator(donors=partition, **kwargs)
+
+    assert calculator.donors is partition
+    assert calculator.calculate() == Calculator(donors=mock_donors, **kwargs).calculate()
+
+
+# every donor twice, and the first 30 three times, so phenotypes repeat
+duplicated_donors = pd.concat([mock_donors, mock_donors, mock_donors.iloc[:30]], ignore_index=True)
+
+
+def test_compact_weights_each_distinct_phenotype_by_its_donors():
+    compact = DonorBitsets(duplicated_donors).compact()
+    phenotypes = duplicated_donors.drop(columns="id")
+
+    assert compact.n_rows == len(phenotypes.drop_duplicates())
+    assert len(compact) == len(duplicated_donors)
+    assert compact.frame.drop(columns="id").equals(phenotypes.drop_duplicates())
+    expected = phenotypes.value_counts(sort=False)
+    for (_, row), weight in zip(compact.frame.drop(columns="id").iterrows(), compact.row_weights):
+        assert expected[tuple(row)] == weight
+
+
+def test_compact_partitions_keep_their_donor_counts():
+    compact = DonorBitsets(duplicated_donors).compact()
+
+    for abo in ("A", "B", "O", "AB"):
+        assert len(compact.partition(abo)) == (duplicated_donors.bg == abo).sum()
+        assert len(compact.blood_group(abo)) == (duplicated_donors.bg == abo).sum()
+    with pytest.raises(ValueError):
+        compact.compact()
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["B7", "B8", "A24"], ["DR17", "B42", "B46", "DR9"]])
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}])
+def test_compact_results_are_identical_to_the_frame(abo, specs, recipient_bdr):
+    partitions = blood_group_partitions((DonorBitsets(duplicated_donors).compact(),))
+    kwargs = {
+        "specs": specs,
+        "abo": abo,
+        "recipient_bdr": recipient_bdr,
+        "hla_bdr": mock_mantigens,
+        "ag_defaults": mock_ag_defaults,
+        "matchability_bands": mock_mbands,
+    }
+    reference = Calculator(donors=duplicated_donors, **kwargs).calculate().model_dump_json()
+    index = DonorIndex(partitions[(0, abo)], mock_donors.columns[2:])
+    graded = DonorIndex(
+        partitions[(0, abo)], mock_donors.columns[2:], grade_classes(partitions, mock_mantigens)[(0, abo)]
+    )
+
+    for donors in (partitions[(0, abo)], index, graded):
+        assert Calculator(donors=donors, **kwargs).calculate().model_dump_json() == reference
+    batched = calculate_group(
+        partitions[(0, abo)], abo, [specs], [recipient_bdr or {}], mock_mantigens, mock_ag_defaults, mock_mbands
+    )
+    assert batched[0].model_dump_json() == reference
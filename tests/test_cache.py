@@ -0,0 +1,128 @@
+"""tests for the calculation result cache"""
+
+import pytest
+
+from api.cache import ResultCache
+from api.calculator import Results
+from api.data import DataProvenance
+
+
+def make_provenance(sha: str = "a", band_version: int = 7) -> DataProvenance:
+    return DataProvenance(
+        donor_database="test-donors.db",
+        donor_database_sha256=sha * 64,
+        donor_table="test_donors",
+        matchability_band_version=band_version,
+    )
+
+
+class CountingCalculation:
+    """a stand-in calculation that records how often it runs"""
+
+    def __init__(self, crf: float = 0.5):
+        self.calls = 0
+        self.crf = crf
+
+    def __call__(self) -> Results:
+        self.calls += 1
+        return Results(crf=self.crf, available=1)
+
+
+def lookup(cache: ResultCache, key, provenance: DataProvenance, calculate) -> Results:
+    """the cached Results for key, calculated and stored on a miss, as the routes do"""
+    results = cache.get(key, provenance)
+    if results is None:
+        results = calculate()
+        cache.put(key, provenance, results)
+    return results
+
+
+def test_key_ignores_spec_and_recipient_order():
+    assert ResultCache.key("O", ["B7", "A1", "A1"], ["DR3", "B7"], 0) == ResultCache.key(
+        "O", ["A1", "B7"], ["B7", "DR3"], 0
+    )
+    assert ResultCache.key("O", ["A1"], [], 0) != ResultCache.key("O", ["A1"], [], 1)
+
+
+def test_repeat_lookups_skip_the_calculation():
+    cache, provenance, calculation = ResultCache(8), make_provenance(), CountingCalculation()
+    key = cache.key("A", ["A2"], [], 0)
+
+    first = lookup(cache, key, provenance, calculation)
+    second = lookup(cache, key, provenance, calculation)
+
+    assert first is second
+    assert calculation.calls == 1
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, provenance, calculation = ResultCache(2), make_provenance(), CountingCalculation()
+    keys = [cache.key("A", [spec], [], 0) for spec in ("A1", "A2", "A3")]
+
+    lookup(cache, keys[0], provenance, calculation)
+    lookup(cache, keys[1], provenance, calculation)
+    lookup(cache, keys[0], provenance, calculation)  # A1 is now the most recent
+    lookup(cache, keys[2], provenance, calculation)  # evicts A2
+    lookup(cache, keys[0], provenance, calculation)
+
+    assert calculation.calls == 3
+    assert cache.stats().evictions == 1
+    lookup(cache, keys[1], provenance, calculation)
+    assert calculation.calls == 4
+
+
+def test_releases_are_cached_side_by_side_until_invalidated():
+    cache, calculation = ResultCache(8), CountingCalculation()
+    old, new = make_provenance("a"), make_provenance("b")
+
+    lookup(cache, cache.key("A", [], [], 0), old, calculation)
+    lookup(cache, cache.key("B", [], [], 0), new, calculation)
+    lookup(cache, cache.key("A", [], [], 0), old, calculation)
+    assert calculation.calls == 2
+    assert cache.stats().size == 2
+
+    cache.invalidate(old)
+    stats = cache.stats()
+    assert stats.invalidations == 1
+    assert stats.size == 1
+    lookup(cache, cache.key("A", [], [], 0), old, calculation)
+    assert calculation.calls == 3
+
+
+def test_a_release_does_not_see_another_releases_results():
+    cache = ResultCache(8)
+    old, new = make_provenance("a"), make_provenance("a", band_version=8)
+    cache.put("same key", old, Results(crf=0.5))
+
+    assert cache.get("same key", new) is None
+    assert cache.get("same key", old).crf == 0.5
+
+
+def test_zero_size_disables_caching():
+    cache, provenance, calculation = ResultCache(0), make_provenance(), CountingCalculation()
+    key = cache.key("A", [], [], 0)
+
+    lookup(cache, key, provenance, calculation)
+    lookup(cache, key, provenance, calculation)
+
+    assert calculation.calls == 2
+    assert cache.stats().size == 0
+
+
+def test_negative_size_is_rejected():
+    with pytest.raises(ValueError):
+        ResultCache(-1)
+
+
+def test_results_finishing_after_a_swap_do_not_disturb_the_new_release():
+    cache = ResultCache(8)
+    old, new = make_provenance("a"), make_provenance("b")
+    cache.put(cache.key("A", [], [], 0), new, Results(crf=0.25))
+
+    cache.invalidate(old)
+    cache.put(cache.key("A", [], [], 0), old, Results(crf=0.5))
+
+    assert cache.get(cache.key("A", [], [], 0), new).crf == 0.25
+    assert cache.get(cache.key("A", [], [], 0), old).crf == 0.5
@@ -1,8 +1,18 @@
 """tests for the calculator module"""
 
 import pandas as pd
+import pytest
 
-from api.calculator import Calculator, Results
+from api.bitset import DonorBitsets
+from api.calculator import (
+    GRADE_ORDER,
+    GRADE_TABLE,
+    Calculator,
+    Results,
+    grade_counts,
+    mismatch_counts,
+    mismatch_grade,
+)
 
 # load mock donors once
 mock_donors = pd.read_csv("tests/mock_donors.csv")
@@ -204,3 +214,55 @@ def test_calculator_no_specs():
         match_counts={"fav": 45, "m12a": 45, "m2b": 0, "m3a": 3, "m3b": 1, "m4a": 0, "m4b": 0},
     )
     assert results == expected_results
+
+
+@pytest.mark.parametrize(
+    "recipient_bdr",
+    [
+        {"B": {"B7", "B8"}, "DR": {"DR3"}},
+        {"B": {"B42", "B46"}, "DR": {"DR9", "DR3"}},
+        {"B": {"B12"}},
+        {},
+    ],
+)
+def test_mismatch_counts_match_the_set_difference_per_donor(recipient_bdr):
+    """the matrix product counts exactly what a per-donor set difference would"""
+    expected = {}
+    for locus in ("B", "DR"):
+        recipient = set(recipient_bdr.get(locus, set()))
+        recipient.update({mock_ag_defaults[ag] for ag in list(recipient) if ag in mock_ag_defaults})
+        columns = [c for c in mock_mantigens[locus] if c in mock_donors.columns]
+        expected[locus] = [len({c for c in columns if row[c] == 1} - recipient) for _, row in mock_donors.iterrows()]
+
+    for donors in (mock_donors, DonorBitsets(mock_donors)):
+        counts = mismatch_counts(donors, recipient_bdr, mock_mantigens, mock_ag_defaults)
+        assert list(counts.columns) == ["B", "DR"]
+        assert counts.index.equals(mock_donors.index)
+        assert counts["B"].tolist() == expected["B"]
+        assert counts["DR"].tolist() == expected["DR"]
+
+
+def test_mismatch_counts_count_a_repeated_column_once():
+    hla_bdr = {"B": ["B7", "B7", "B8"], "DR": ["DR3"]}
+    counts = mismatch_counts(mock_donors, {"B": {"B8"}}, hla_bdr, {})
+
+    assert counts["B"].tolist() == mock_donors["B7"].tolist()
+
+
+def test_grade_table_agrees_with_mismatch_grade():
+    for b_mm in range(3):
+        for dr_mm in range(3):
+            assert GRADE_ORDER[GRADE_TABLE[b_mm, dr_mm]] == mismatch_grade(b_mm, dr_mm)
+
+
+def test_grade_counts_histogram_and_favourable_total():
+    counts = grade_counts([0, 1, 0, 2, 1, 2, 0, 2], [0, 0, 1, 0, 1, 1, 2, 2])
+
+    assert counts == {"fav": 3, "m12a": 2, "m2b": 1, "m3a": 1, "m3b": 1, "m4a": 1, "m4b": 2}
+    assert grade_counts([], []) == {"fav": 0, **{grade: 0 for grade in GRADE_ORDER}}
+
+
+@pytest.mark.parametrize("b_mm,dr_mm", [([0, 3], [0, 0]), ([0, 0], [0, -1])])
+def test_grade_counts_reject_counts_outside_zero_to_two(b_mm, dr_mm):
+    with pytest.raises(ValueError, match="invalid B/DR mismatch counts"):
+        grade_counts(b_mm, dr_mm)
@@ -0,0 +1,56 @@
+"""tests for out-of-core batch runs"""
+
+import pandas as pd
+import pytest
+
+from api.batch import PreparedRecord, run_batch
+from api.calculator import GRADE_ORDER
+from api.chunked import RecipientTally, run_chunked, tally_blocks
+from api.data import DataLoader
+from tests.helpers import make_database, records
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    return str(make_database(tmp_path_factory.mktemp("chunked") / "donors.db"))
+
+
+def outcomes(rows):
+    """each record's position and outcome, comparable across runs"""
+    return [(position, repr(outcome)) for position, _, outcome in sorted(rows, key=lambda row: row[0])]
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 50, 1000])
+def test_chunked_runs_give_the_loaded_batch_results(database, block_rows):
+    data = DataLoader(db_path=database, table_name="donors", use_snapshot=False).base_data
+    loader = DataLoader(db_path=database, table_name="donors", use_snapshot=False, load_donors=False)
+    rows, throughput = run_chunked(records, loader, block_rows=block_rows)
+
+    assert loader.donors is None
+    assert outcomes(rows) == outcomes(run_batch(records, data))
+    assert [position for position, _, _ in rows] == list(range(len(records)))
+    assert throughput.donors == 100
+    assert throughput.blocks == 100 // block_rows + 1
+    assert throughput.donors_per_second > 0
+
+
+def test_block_tallies_add_up_to_the_whole_cohort():
+    donors = pd.read_csv("tests/mock_donors.csv")
+    recipient = PreparedRecord(
+        bg="O",
+        donor_set=0,
+        specs=["A2"],
+        recip_hla=None,
+        recip_hla_used=[],
+        recip_hla_conversions={},
+        recipient_bdr={"B": {"B7"}},
+    )
+    whole, blocked = RecipientTally(recipient), RecipientTally(recipient)
+    tally_blocks([donors], [whole], {"B": ["B7", "B8"], "DR": ["DR3"]}, {})
+    tally_blocks(
+        [donors.iloc[n : n + 9] for n in range(0, len(donors), 9)], [blocked], {"B": ["B7", "B8"], "DR": ["DR3"]}, {}
+    )
+
+    assert (whole.total, whole.available) == (blocked.total, blocked.available)
+    assert whole.histogram.tolist() == blocked.histogram.tolist()
+    assert len(whole.histogram) == len(GRADE_ORDER) and whole.histogram.sum() == whole.available
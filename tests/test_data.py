@@ -1,6 +1,10 @@
 """Tests for DataLoader class"""
 
+import asyncio
 import hashlib
+import os
+import threading
+import time
 from io import BytesIO
 from pathlib import Path
 from unittest.mock import MagicMock, patch
@@ -9,7 +13,9 @@ import pandas as pd
 import pytest
 from pydantic import ValidationError
 
-from api.data import DataLoader, DataLoadError, DataProvenance
+from api.data import CalculatorData, DataLoader, DataLoadError, DataNotReady, DataProvenance
+from api.fingerprint import FingerprintHealth
+from tests.helpers import make_database
 
 TEST_DATABASE_SHA256 = "c" * 64
 
@@ -34,8 +40,9 @@ def setup_mock_db(mock_df):
     mock_conn = MagicMock()
     mock_connect = MagicMock(return_value=mock_conn)
 
-    # Configure mock to simulate fetchall and column descriptions
+    # Configure mock to simulate fetchall, a chunked read and column descriptions
     mock_conn.execute.return_value.fetchall.return_value = mock_df.values.tolist()
+    mock_conn.execute.return_value.fetchmany.side_effect = [mock_df.values.tolist(), []]
     mock_conn.execute.return_value.description = [(col,) for col in mock_df.columns]
 
     return mock_connect, mock_conn
@@ -47,7 +54,7 @@ def test_antigens_method(mock_connect):
     mock_df = pd.DataFrame({"A1": [], "B44": [], "CW3": [], "DR1": [], "DPB11": [], "BW4": [], "DQ5": [], "A19_S": []})
     mock_connect, mock_conn = setup_mock_db(mock_df)
     data_loader = make_data_loader(db_path="mock_db.db")
-    data_loader.donors = (mock_df, mock_df)
+    data_loader.donors = mock_df
     antigens = data_loader.antigens()
     assert antigens == {
         "A": ["A1"],
@@ -138,7 +145,7 @@ def test_data_provenance_fingerprints_the_derived_database():
         patch.object(Path, "is_file", return_value=True),
         patch.object(Path, "open", return_value=BytesIO(database_bytes)),
         patch("sqlite3.connect"),
-        patch.object(DataLoader, "_load_donors", return_value=(pd.DataFrame(), pd.DataFrame())),
+        patch.object(DataLoader, "_load_donors", return_value=pd.DataFrame()),
     ):
         loader = DataLoader(
             db_path=str(database),
@@ -169,7 +176,7 @@ def test_declared_upstream_sha256_is_carried_into_provenance():
         patch.object(Path, "is_file", return_value=True),
         patch.object(Path, "open", return_value=BytesIO(database_bytes)),
         patch("sqlite3.connect"),
-        patch.object(DataLoader, "_load_donors", return_value=(pd.DataFrame(), pd.DataFrame())),
+        patch.object(DataLoader, "_load_donors", return_value=pd.DataFrame()),
     ):
         loader = DataLoader(
             db_path="fixtures/test-donors.db",
@@ -201,7 +208,7 @@ def test_custom_database_does_not_inherit_default_upstream_lineage():
     with (
         patch.object(DataLoader, "_file_sha256", return_value="d" * 64),
         patch("sqlite3.connect"),
-        patch.object(DataLoader, "_load_donors", return_value=(pd.DataFrame(), pd.DataFrame())),
+        patch.object(DataLoader, "_load_donors", return_value=pd.DataFrame()),
     ):
         loader = DataLoader(db_path="custom.db")
 
@@ -257,3 +264,161 @@ def test_duplicate_matchability_band_rows_are_rejected():
 
     with pytest.raises(DataLoadError, match="version: 4"):
         loader.matchability_bands()
+
+
+def test_donor_compaction_is_opt_in(monkeypatch):
+    monkeypatch.delenv("MATCHBOX_COMPACT_DONORS", raising=False)
+    with patch("sqlite3.connect"), patch.object(DataLoader, "_load_donors"):
+        assert not make_data_loader().compact_donors
+        assert make_data_loader(compact_donors=True).compact_donors
+        monkeypatch.setenv("MATCHBOX_COMPACT_DONORS", "1")
+        assert make_data_loader().compact_donors
+
+
+def test_calculator_data_loads_once_and_only_when_asked():
+    calls = []
+    data = CalculatorData(loader=lambda: calls.append(1) or "loaded")
+
+    assert calls == [] and data.readiness().status == "loading"
+    data.start()
+    assert data.load() == "loaded"
+    assert asyncio.run(data.wait()) == "loaded"
+    assert calls == [1]
+
+
+def test_calculator_data_reports_a_failed_load():
+    def fail():
+        raise DataLoadError("Invalid or missing matchability band version: 9")
+
+    data = CalculatorData(loader=fail)
+    with pytest.raises(DataLoadError):
+        data.load()
+    with pytest.raises(DataNotReady, match="failed to load"):
+        asyncio.run(data.wait())
+    assert data.readiness().status == "failed"
+
+
+def test_waiting_for_slow_data_times_out():
+    release = threading.Event()
+    data = CalculatorData(loader=lambda: release.wait(5) and "loaded")
+
+    with pytest.raises(DataNotReady, match="still loading"):
+        asyncio.run(data.wait(timeout=0.01))
+    release.set()
+    assert asyncio.run(data.wait()) == "loaded"
+
+
+def test_failed_fingerprint_verification_makes_data_unready():
+    health = FingerprintHealth()
+    data = CalculatorData(loader=lambda: MagicMock(provenance=None, health=health))
+    data.load()
+
+    assert data.readiness().status == "ready"
+    health.mark_mismatch("donors.db hashes to something else")
+    assert data.readiness().status == "unverified"
+    assert data.readiness().detail == "donors.db hashes to something else"
+
+
+def test_a_verified_reload_makes_data_ready_again():
+    stale, fresh = FingerprintHealth(), FingerprintHealth()
+    releases = iter([MagicMock(provenance=None, health=stale), MagicMock(provenance=None, health=fresh)])
+    data = CalculatorData(loader=lambda: next(releases))
+    data.load()
+    stale.mark_mismatch("donors.db hashes to something else")
+    assert data.readiness().status == "unverified"
+
+    data.reload().join(timeout=5)
+    assert data.readiness().status == "ready"
+
+
+def test_reload_swaps_in_a_new_release_once_it_loads():
+    first, second = MagicMock(provenance=None), MagicMock(provenance=None)
+    releases = iter([first, second])
+    release = threading.Event()
+    data = CalculatorData(loader=lambda **settings: next(releases) if release.wait(5) else None, db_path="a.db")
+    swapped = []
+    data.listeners.append(lambda old, new, settings: swapped.append((old, new, settings)))
+    release.set()
+    serving = data.load()
+    release.clear()
+
+    reloading = data.reload(matchability_ver=5)
+    assert data.reload() is None  # one at a time
+    assert data.load() is serving is first
+
+    release.set()
+    reloading.join(timeout=5)
+    assert data.load() is second
+    assert swapped == [(first, second, {"db_path": "a.db", "matchability_ver": 5})]
+    first.close.assert_called_once()
+    second.close.assert_not_called()
+    assert data.reload_status().reloaded_at is not None
+
+
+def test_a_reload_is_not_finished_until_its_release_is_published():
+    first, second = MagicMock(provenance=None), MagicMock(provenance=None)
+    releases = iter([first, second])
+    data = CalculatorData(loader=lambda **settings: next(releases))
+    data.load()
+
+    with data._lock:  # hold the swap
+        reloading = data.reload()
+        time.sleep(0.05)
+        assert data.reload() is None
+        assert data.reload_status().reloading
+    reloading.join(timeout=5)
+
+    status = data.reload_status()
+    assert data.load() is second
+    assert not status.reloading and status.reloaded_at is not None
+
+
+def test_failed_reload_keeps_serving_the_previous_release():
+    first = MagicMock(provenance=None)
+
+    def loader(**settings):
+        if settings.get("matchability_ver") == 9:
+            raise DataLoadError("Invalid or missing matchability band version: 9")
+        return first
+
+    data = CalculatorData(loader=loader)
+    data.load()
+    data.reload(matchability_ver=9).join(timeout=5)
+
+    assert data.load() is first
+    assert data.readiness().status == "ready"
+    status = data.reload_status()
+    assert not status.reloading and "version: 9" in status.error
+
+
+def test_watch_reloads_when_the_database_is_replaced(tmp_path):
+    database = tmp_path / "donors.db"
+    database.write_bytes(b"first release")
+    data = CalculatorData(loader=lambda **settings: database.read_bytes())
+    data.load()
+    reloaded = threading.Event()
+    data.listeners.append(lambda old, new, settings: reloaded.set())
+
+    data.watch(str(database), interval=0.02)
+    try:
+        replacement = tmp_path / "donors.db.new"
+        replacement.write_bytes(b"second release")
+        os.replace(replacement, database)
+        assert reloaded.wait(5)
+    finally:
+        data.stop_watching()
+    assert data.load() == b"second release"
+
+
+def test_donors_are_loaded_compactly_with_the_dpb_typed_set_as_a_selection(tmp_path, monkeypatch):
+    monkeypatch.setattr("api.data.DONOR_CHUNK_ROWS", 7)
+    loader = DataLoader(db_path=str(make_database(tmp_path / "donors.db")), table_name="donors", use_snapshot=False)
+    donors = loader.donors
+
+    assert (donors.drop(columns=["id", "bg"]).dtypes == "uint8").all()
+    assert donors["bg"].dtype == "category"
+    assert donors["id"].tolist() == sorted(donors["id"])
+
+    whole, dpb_typed = loader._pack_donors()
+    assert dpb_typed._bits is whole._bits and dpb_typed.source is whole.source
+    assert dpb_typed.index.tolist() == donors.index[donors["DPB1"] == 1].tolist()
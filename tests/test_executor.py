@@ -0,0 +1,99 @@
+"""tests for the calculation pool"""
+
+import asyncio
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from api.executor import CalculationPool, CalculationTimeout, PoolSaturated
+
+
+def add(data, a, b):
+    return data + a + b
+
+
+def wait_for(data, event):
+    event.wait(5)
+    return data
+
+
+def test_run_calls_fn_with_data_first():
+    pool = CalculationPool(workers=2, queue_size=1)
+    try:
+        assert asyncio.run(pool.run(add, 1, 2, 3)) == 6
+        stats = pool.stats()
+        assert (stats.kind, stats.completed, stats.in_flight) == ("thread", 1, 0)
+    finally:
+        pool.shutdown()
+
+
+def test_a_full_pool_sheds_load_at_once():
+    pool = CalculationPool(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def burst():
+        running = asyncio.ensure_future(pool.run(wait_for, "first", release))
+        queued = asyncio.ensure_future(pool.run(wait_for, "second", release))
+        await asyncio.sleep(0)
+        assert pool.stats().queued == 1
+        with pytest.raises(PoolSaturated):
+            await pool.run(wait_for, "third", release)
+        release.set()
+        return await asyncio.gather(running, queued)
+
+    try:
+        assert asyncio.run(burst()) == ["first", "second"]
+        stats = pool.stats()
+        assert (stats.rejected, stats.completed, stats.peak_queued) == (1, 2, 1)
+        assert stats.max_wait_ms > 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_a_calculation_past_its_deadline_times_out():
+    pool = CalculationPool(workers=1, queue_size=0, deadline=0.05)
+    release = threading.Event()
+    try:
+        with pytest.raises(CalculationTimeout):
+            asyncio.run(pool.run(wait_for, None, release))
+        assert pool.stats().timed_out == 1
+        # still running, so still holding its slot: no room for another
+        assert pool.stats().in_flight == 1
+        with pytest.raises(PoolSaturated):
+            asyncio.run(pool.run(add, 1, 2, 3))
+        release.set()
+        pool.executor.submit(int).result(timeout=5)
+        assert pool.stats().in_flight == 0
+        assert asyncio.run(pool.run(add, 1, 2, 3)) == 6
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+@pytest.mark.parametrize("kwargs", [{"workers": 0}, {"queue_size": -1}, {"deadline": 0}, {"kind": "fibre"}])
+def test_invalid_pool_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        CalculationPool(**kwargs)
+
+
+def test_recycle_starts_fresh_process_workers_with_the_initializer():
+    pool = CalculationPool(workers=1, kind="process")
+    pool._executor = old = MagicMock()
+
+    pool.recycle(print, ("release",))
+
+    old.shutdown.assert_called_once_with(wait=False)
+    assert pool._executor is None
+    assert (pool.initializer, pool.initargs) == (print, ("release",))
+
+
+def test_recycle_keeps_a_thread_pool():
+    pool = CalculationPool(workers=1)
+    executor = pool.executor
+
+    pool.recycle(print, ("release",))
+
+    assert pool.executor is executor
+    pool.shutdown()
@@ -0,0 +1,100 @@
+"""tests for the donor database fingerprint cache"""
+
+import hashlib
+import os
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from api.data import DataLoader, DataLoadError
+from api.fingerprint import FingerprintCache, file_identity, fingerprint_cache_path
+from tests.helpers import make_database
+
+
+@pytest.fixture
+def database(tmp_path):
+    return make_database(tmp_path / "donors.db")
+
+
+def loader(database, cache_dir, **kwargs):
+    return DataLoader(
+        db_path=str(database), table_name="donors", use_snapshot=False, fingerprint_cache_dir=str(cache_dir), **kwargs
+    )
+
+
+def test_cache_only_answers_for_the_recorded_identity(tmp_path, database):
+    cache = FingerprintCache(tmp_path / "cache" / "donors.db.sha256.json")
+    identity = file_identity(database)
+
+    assert cache.get(identity) is None
+    cache.put(identity, "a" * 64)
+    assert cache.get(identity) == "a" * 64
+    assert cache.get((*identity[:3], identity[3] + 1)) is None
+    assert cache.get(None) is None
+
+    cache.path.write_text("not json")
+    assert cache.get(identity) is None
+
+
+def test_unchanged_database_is_not_rehashed(tmp_path, database):
+    expected = hashlib.sha256(database.read_bytes()).hexdigest()
+    with patch.object(DataLoader, "_file_sha256", wraps=DataLoader._file_sha256) as rehash:
+        first = loader(database, tmp_path)
+        first.base_data
+        assert rehash.call_count == 1
+        second = loader(database, tmp_path)
+        second.base_data
+        assert rehash.call_count == 1
+
+        os.utime(database, ns=(0, 0))
+        assert loader(database, tmp_path).provenance.donor_database_sha256 == expected
+        assert rehash.call_count == 2
+
+    assert first.provenance == second.provenance
+    assert second.provenance.donor_database_sha256 == expected
+
+
+def test_database_changed_while_loading_is_still_refused(tmp_path, database):
+    loading = loader(database, tmp_path)
+    with sqlite3.connect(database) as conn:
+        conn.execute("UPDATE donors SET A1 = 1 - A1 WHERE id = 1")
+
+    with pytest.raises(DataLoadError, match="changed while calculator data was loading"):
+        loading.base_data
+
+
+def test_background_verification_flags_a_stale_fingerprint(tmp_path, database):
+    cache = FingerprintCache(fingerprint_cache_path(tmp_path, database))
+    cache.put(file_identity(database), "f" * 64)
+
+    unverified = loader(database, tmp_path)
+    assert unverified.provenance.donor_database_sha256 == "f" * 64
+    assert unverified.verification is None
+
+    verified = loader(database, tmp_path, verify_fingerprint=True)
+    verified.verification.join(timeout=5)
+    assert not verified.health.healthy
+    assert database.name in verified.health.detail
+    assert unverified.health.healthy
+    assert not cache.path.exists()
+
+
+def test_background_verification_of_a_good_fingerprint_stays_healthy(tmp_path, database):
+    loader(database, tmp_path)
+    verified = loader(database, tmp_path, verify_fingerprint=True)
+
+    verified.verification.join(timeout=5)
+    assert verified.health.healthy and verified.health.detail is None
+
+
+def test_without_a_cache_a_same_identity_rewrite_is_still_refused(database):
+    loading = DataLoader(db_path=str(database), table_name="donors", use_snapshot=False)
+    identity = file_identity(database)
+    with sqlite3.connect(database) as conn:
+        conn.execute("UPDATE donors SET A1 = 1 - A1 WHERE id = 1")
+    os.utime(database, ns=(identity[3], identity[3]))
+    assert file_identity(database) == identity
+
+    with pytest.raises(DataLoadError, match="changed while calculator data was loading"):
+        loading.base_data
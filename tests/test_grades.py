@@ -0,0 +1,88 @@
+"""tests for the B/DR grade classes"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.calculator import Calculator, grade_counts
+from api.grades import GradeClasses, grade_classes
+from api.postings import DonorIndex
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_antigens = [col for col in mock_donors.columns if col not in ("id", "bg")]
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {bg: {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0} for bg in ("A", "B", "O", "AB")}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+def test_classes_partition_donors_by_bdr_phenotype(abo):
+    partition = mock_bitsets.partition(abo)
+    classes = GradeClasses(partition, mock_mantigens)
+    frame = partition.frame[classes.columns]
+
+    assert classes.sizes.sum() == len(partition)
+    assert len(classes) == len(frame.drop_duplicates())
+    assert classes.counts(partition).tolist() == classes.sizes.tolist()
+    for code, phenotype in enumerate(classes.phenotypes):
+        assert (frame[classes.codes == code].to_numpy() == phenotype).all()
+
+
+def test_counts_tally_the_compatible_members():
+    partition = mock_bitsets.partition("O")
+    classes = GradeClasses(partition, mock_mantigens)
+    compatible, _ = partition.split(["A1", "B8"])
+
+    counts = classes.counts(compatible)
+
+    assert counts.sum() == len(compatible)
+    assert (counts <= classes.sizes).all()
+    members = compatible.frame[classes.columns].to_numpy()
+    for code, phenotype in enumerate(classes.phenotypes):
+        assert counts[code] == (members == phenotype).all(axis=1).sum()
+
+
+def test_weighted_grade_counts_match_repeated_rows():
+    b_mm, dr_mm, weights = np.array([0, 1, 2, 2]), np.array([0, 1, 2, 0]), np.array([3, 0, 2, 1])
+
+    assert grade_counts(b_mm, dr_mm, weights=weights) == grade_counts(
+        np.repeat(b_mm, weights), np.repeat(dr_mm, weights)
+    )
+
+
+def test_weighted_grade_counts_ignore_invalid_rows_of_no_weight():
+    assert grade_counts(np.array([0, 3]), np.array([0, 0]), weights=np.array([1, 0]))["fav"] == 1
+    with pytest.raises(ValueError, match="invalid B/DR mismatch counts"):
+        grade_counts(np.array([0, 3]), np.array([0, 0]), weights=np.array([1, 1]))
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["B7", "B8", "A24"], ["DR17", "B42", "B46", "DR9"]])
+@pytest.mark.parametrize("recipient_bdr", [{"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}, {"B": {"B42"}}, {"DR": {"DR9"}}])
+def test_class_graded_results_are_identical_to_the_frame(abo, specs, recipient_bdr):
+    partitions = blood_group_partitions((mock_bitsets,))
+    index = DonorIndex(partitions[(0, abo)], mock_antigens, grade_classes(partitions, mock_mantigens)[(0, abo)])
+    kwargs = {
+        "specs": specs,
+        "abo": abo,
+        "recipient_bdr": recipient_bdr,
+        "hla_bdr": mock_mantigens,
+        "ag_defaults": mock_ag_defaults,
+        "matchability_bands": mock_mbands,
+    }
+
+    graded = Calculator(donors=index, **kwargs).calculate()
+
+    assert graded.model_dump_json() == Calculator(donors=mock_donors, **kwargs).calculate().model_dump_json()
+
+
+def test_classes_for_other_antigens_are_not_used():
+    partition = mock_bitsets.partition("O")
+    index = DonorIndex(partition, mock_antigens, GradeClasses(partition, {"B": ["B7"], "DR": []}))
+    kwargs = {"specs": ["A1"], "abo": "O", "recipient_bdr": {"B": {"B8"}}, "ag_defaults": mock_ag_defaults}
+    kwargs.update(hla_bdr=mock_mantigens, matchability_bands=mock_mbands)
+
+    assert Calculator(donors=index, **kwargs).calculate() == Calculator(donors=mock_donors, **kwargs).calculate()
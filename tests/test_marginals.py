@@ -0,0 +1,83 @@
+"""tests for the marginal cRF what-ifs"""
+
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets
+from api.calculator import Calculator
+from api.marginals import spec_marginals
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {bg: {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0} for bg in ("A", "B", "O", "AB")}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+mock_candidates = ["A1", "A2", "B7", "B8", "B12", "DR3", "DR4", "DR17"]
+
+
+def calculate(abo, specs, recipient_bdr):
+    """the Calculator's answer for one spec list"""
+    return Calculator(
+        donors=mock_donors,
+        specs=specs,
+        abo=abo,
+        recipient_bdr=recipient_bdr,
+        hla_bdr=mock_mantigens,
+        ag_defaults=mock_ag_defaults,
+        matchability_bands=mock_mbands,
+    ).calculate()
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["A1", "B7", "B12", "DR18"], ["DR17", "B42", "B46", "DR9"]])
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}])
+def test_every_marginal_matches_a_full_recalculation(abo, specs, recipient_bdr):
+    marginals = spec_marginals(
+        mock_bitsets.partition(abo),
+        abo,
+        specs,
+        mock_candidates,
+        recipient_bdr,
+        mock_mantigens,
+        mock_ag_defaults,
+        mock_mbands,
+    )
+
+    assert marginals.results == calculate(abo, specs, recipient_bdr)
+    assert [m.antigen for m in marginals.removed] == specs
+    assert [m.antigen for m in marginals.added] == [ag for ag in mock_candidates if ag not in specs]
+    for marginal in marginals.removed:
+        expected = calculate(abo, [ag for ag in specs if ag != marginal.antigen], recipient_bdr)
+        assert (marginal.crf, marginal.available) == (expected.crf, expected.available)
+        assert (marginal.favourable, marginal.matchability) == (expected.favourable, expected.matchability)
+    for marginal in marginals.added:
+        expected = calculate(abo, specs + [marginal.antigen], recipient_bdr)
+        assert (marginal.crf, marginal.available) == (expected.crf, expected.available)
+        assert (marginal.favourable, marginal.matchability) == (expected.favourable, expected.matchability)
+
+
+def test_repeated_specs_are_one_what_if():
+    marginals = spec_marginals(
+        mock_bitsets.partition("O"), "O", ["A2", "A2"], [], None, mock_mantigens, mock_ag_defaults, mock_mbands
+    )
+
+    assert [m.antigen for m in marginals.removed] == ["A2"]
+    assert marginals.removed[0].crf == 0
+
+
+def test_empty_partition_is_an_error():
+    empty = DonorBitsets(mock_donors.iloc[0:0]).partition("A")
+
+    with pytest.raises(ValueError):
+        spec_marginals(empty, "A", ["A2"], [], None, mock_mantigens, mock_ag_defaults, mock_mbands)
+
+
+def test_compacted_donors_give_the_same_marginals():
+    duplicated = pd.concat([mock_donors, mock_donors.iloc[:40]], ignore_index=True)
+    args = (["A1", "B7", "DR17"], mock_candidates, {"B": {"B8"}, "DR": {"DR3"}}, mock_mantigens, mock_ag_defaults)
+
+    compact = spec_marginals(DonorBitsets(duplicated).compact().partition("O"), "O", *args, mock_mbands)
+    expanded = spec_marginals(DonorBitsets(duplicated).partition("O"), "O", *args, mock_mbands)
+
+    assert compact == expanded
@@ -0,0 +1,119 @@
+"""tests for the antigen-avoidance planner"""
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets
+from api.calculator import Calculator
+from api.planner import allowed_incompatible, relaxation_plans
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {bg: {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0} for bg in ("A", "B", "O", "AB")}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+mock_specs = ["A1", "A2", "A3", "A9", "A24", "B7", "B8", "B12", "B44", "DR3", "DR4", "DR17"]
+mock_recipient = {"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}
+
+
+def calculate(abo, specs, recipient_bdr=mock_recipient):
+    """the Calculator's answer for one spec list"""
+    return Calculator(
+        donors=mock_donors,
+        specs=specs,
+        abo=abo,
+        recipient_bdr=recipient_bdr,
+        hla_bdr=mock_mantigens,
+        ag_defaults=mock_ag_defaults,
+        matchability_bands=mock_mbands,
+    ).calculate()
+
+
+def plan(abo, target, **kwargs):
+    """plans against one mock blood group"""
+    return relaxation_plans(
+        mock_bitsets.partition(abo),
+        abo,
+        mock_specs,
+        target,
+        mock_recipient,
+        mock_mantigens,
+        mock_ag_defaults,
+        mock_mbands,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("total", [1, 7, 39, 10_000])
+@pytest.mark.parametrize("target", [0.0, 0.01, 0.5, 0.85, 1.0])
+def test_allowed_incompatible_is_the_largest_count_below_target(total, target):
+    allowed = allowed_incompatible(total, target)
+
+    assert allowed == max([n for n in range(total + 1) if n / total < target], default=-1)
+
+
+@pytest.mark.parametrize("abo", ["A", "O"])
+@pytest.mark.parametrize("target", [0.2, 0.5, 0.8])
+def test_plans_are_minimal_and_match_the_calculator(abo, target):
+    relaxation = plan(abo, target, limit=50)
+    hits = mock_donors[mock_donors.bg == abo][mock_specs].eq(1).to_numpy()
+    smallest = next(
+        size
+        for size in range(len(mock_specs) + 1)
+        for drop in combinations(range(len(mock_specs)), size)
+        if (np.delete(hits, drop, axis=1).any(axis=1).mean() < target)
+    )
+
+    assert relaxation.complete
+    assert relaxation.results == calculate(abo, mock_specs)
+    assert len(relaxation.plans[0].removed) == smallest
+    for relaxed in relaxation.plans:
+        expected = calculate(abo, relaxed.specs)
+        assert relaxed.crf < target
+        assert (relaxed.crf, relaxed.available) == (expected.crf, expected.available)
+        assert (relaxed.favourable, relaxed.matchability) == (expected.favourable, expected.matchability)
+        assert sorted(relaxed.removed + relaxed.specs) == sorted(mock_specs)
+    keys = [frozenset(p.removed) for p in relaxation.plans]
+    assert not any(a < b for a in keys for b in keys)
+    assert [len(k) for k in keys] == sorted(len(k) for k in keys)
+
+
+def test_target_already_met_needs_no_relaxation():
+    relaxation = relaxation_plans(
+        mock_bitsets.partition("O"), "O", ["A43"], 0.85, None, mock_mantigens, mock_ag_defaults, mock_mbands
+    )
+
+    assert [p.removed for p in relaxation.plans] == [[]]
+
+
+def test_unreachable_target_has_no_plans():
+    assert plan("O", 0.0).plans == []
+
+
+def test_exhausted_budget_still_returns_the_greedy_plan():
+    ticks = iter(range(1_000_000))
+    relaxation = plan("O", 0.2, time_budget=0, clock=lambda: next(ticks))
+
+    assert not relaxation.complete
+    assert len(relaxation.plans) == 1
+    assert relaxation.plans[0].crf < 0.2
+
+
+def test_max_removals_bounds_plan_size():
+    relaxation = plan("O", 0.2, max_removals=1)
+
+    assert all(len(p.removed) <= 1 for p in relaxation.plans)
+
+
+def test_compacted_donors_give_the_same_plans():
+    duplicated = pd.concat([mock_donors, mock_donors.iloc[:40]], ignore_index=True)
+    args = (mock_specs, 0.5, mock_recipient, mock_mantigens, mock_ag_defaults, mock_mbands)
+
+    compact = relaxation_plans(DonorBitsets(duplicated).compact().partition("O"), "O", *args, limit=50)
+    expanded = relaxation_plans(DonorBitsets(duplicated).partition("O"), "O", *args, limit=50)
+
+    assert compact == expanded
@@ -0,0 +1,83 @@
+"""tests for the inverted antigen -> donor index"""
+
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.calculator import Calculator
+from api.postings import DonorIndex, antigen_indexes
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_antigens = [col for col in mock_donors.columns if col not in ("id", "bg")]
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {bg: {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0} for bg in ("A", "B", "O", "AB")}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+def test_postings_list_the_donors_carrying_each_antigen(abo):
+    index = DonorIndex(mock_bitsets.partition(abo), mock_antigens)
+    frame = mock_donors[mock_donors.bg == abo].reset_index(drop=True)
+
+    for antigen in mock_antigens:
+        assert index.postings[antigen].tolist() == frame.index[frame[antigen] == 1].tolist()
+
+
+def test_union_cardinality_gives_the_incompatible_count():
+    index = DonorIndex(mock_bitsets.partition("O"), mock_antigens)
+    frame = mock_donors[mock_donors.bg == "O"]
+
+    for specs in ([], ["A1"], ["A1", "B7", "B12", "DR18"], ["A1", "A1"]):
+        assert index.incompatible_count(specs) == int(frame[specs].eq(1).any(axis=1).sum())
+
+
+def test_crf_without_matchability_never_splits_the_partition():
+    index = DonorIndex(mock_bitsets.partition("O"), mock_antigens)
+    index.split = None  # any split would fail
+    frame = mock_donors[mock_donors.bg == "O"]
+    specs = ["A1", "B7", "DR17"]
+
+    results = Calculator(index, specs, "O", matchability_bands=mock_mbands).calculate()
+
+    incompatible = int(frame[specs].eq(1).any(axis=1).sum())
+    assert (results.crf, results.available) == (incompatible / len(frame), len(frame) - incompatible)
+
+
+def test_unindexed_antigen_is_read_from_the_packed_words():
+    index = DonorIndex(mock_bitsets.partition("A"), ["A1"])
+
+    assert index.union(["A2"]).tolist() == index.donors.hits(["A2"]).nonzero()[0].tolist()
+    with pytest.raises(KeyError):
+        index.union(["A9999"])
+
+
+def test_indexes_cover_every_partition():
+    partitions = blood_group_partitions((mock_bitsets, mock_bitsets))
+    indexes = antigen_indexes(partitions, mock_antigens)
+
+    assert set(indexes) == set(partitions)
+    assert all(indexes[key].donors is partitions[key] for key in partitions)
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["B7", "B8", "A24"], ["DR17", "B42", "B46", "DR9"]])
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}])
+def test_indexed_results_are_identical_to_the_frame(abo, specs, recipient_bdr):
+    index = DonorIndex(mock_bitsets.partition(abo), mock_antigens)
+    kwargs = {
+        "specs": specs,
+        "abo": abo,
+        "recipient_bdr": recipient_bdr,
+        "hla_bdr": mock_mantigens,
+        "ag_defaults": mock_ag_defaults,
+        "matchability_bands": mock_mbands,
+    }
+
+    indexed = Calculator(donors=index, **kwargs)
+
+    assert indexed.donors is index
+    assert (
+        indexed.calculate().model_dump_json() == Calculator(donors=mock_donors, **kwargs).calculate().model_dump_json()
+    )
@@ -0,0 +1,163 @@
+"""tests for the SQLite pushdown donors"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from api.bitset import DonorBitsets, DonorEngine
+from api.calculator import Calculator, mismatch_weights
+from api.data import DataLoader, DataLoadError
+from api.marginals import spec_marginals
+from api.pushdown import DonorSQL, PushdownStore, pushdown_path, write_pushdown
+from tests.helpers import make_database, mock_donors
+
+
+@pytest.fixture(scope="module")
+def loaded(tmp_path_factory):
+    """the same database loaded into memory and pushed down"""
+    tmp_path = tmp_path_factory.mktemp("pushdown")
+    database = str(make_database(tmp_path / "donors.db"))
+    pushdown = DataLoader(db_path=database, table_name="donors", pushdown_dir=str(tmp_path / "pushdown")).base_data
+    memory = DataLoader(db_path=database, table_name="donors", use_snapshot=False).base_data
+    return pushdown, memory
+
+
+def outcome(calculate):
+    """a result as JSON, or the error raised for it"""
+    try:
+        return calculate().model_dump_json()
+    except ValueError as exc:
+        return repr(exc)
+
+
+@pytest.mark.parametrize("key", [(0, "A"), (0, "O"), (1, "B"), (1, "AB")])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["A1", "B7", "DR9"], ["B8", "DR3"]])
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7"}, "DR": {"DR3"}}, {"B": {"B42"}}])
+def test_pushdown_results_are_identical_to_the_in_memory_engine(loaded, key, specs, recipient_bdr):
+    pushdown, memory = loaded
+    kwargs = {
+        "specs": specs,
+        "abo": key[1],
+        "recipient_bdr": recipient_bdr,
+        "hla_bdr": memory.mantigens,
+        "ag_defaults": memory.antigen_defaults,
+        "matchability_bands": memory.mbands,
+    }
+    expected = outcome(Calculator(donors=memory.indexes[key], **kwargs).calculate)
+
+    assert outcome(Calculator(donors=pushdown.indexes[key], **kwargs).calculate) == expected
+    assert outcome(Calculator(donors=pushdown.donors[key[0]], **kwargs).calculate) == expected
+
+    args = (key[1], specs, ["A1", "B7"], recipient_bdr, memory.mantigens, memory.antigen_defaults, memory.mbands)
+    assert outcome(lambda: spec_marginals(pushdown.partitions[key], *args)) == outcome(
+        lambda: spec_marginals(memory.partitions[key], *args)
+    )
+
+
+def test_splits_are_conditions_answered_by_sqlite(loaded):
+    pushdown, memory = loaded
+    compatible, incompatible = pushdown.partitions[(0, "O")].split(["A2", "B7"])
+    expected_compatible, expected_incompatible = memory.partitions[(0, "O")].split(["A2", "B7"])
+
+    assert isinstance(compatible, DonorSQL) and compatible.row_ids is None
+    assert (len(compatible), len(incompatible)) == (len(expected_compatible), len(expected_incompatible))
+    assert compatible.frame.to_numpy().tolist() == expected_compatible.frame.to_numpy().tolist()
+    assert compatible.index.equals(expected_compatible.index)
+    assert [len(donors) for donors in pushdown.donors] == [len(donors) for donors in memory.donors]
+
+
+def carriers(counts):
+    """carrier_counts as {(antigen, group): donors}, without the empty groups"""
+    groups, matrix = counts
+    return {(n, tuple(groups[g])): int(matrix[n, g]) for n, g in zip(*matrix.nonzero())}
+
+
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7"}, "DR": {"DR3"}}])
+def test_candidates_are_counted_by_sqlite(loaded, recipient_bdr):
+    pushdown, memory = loaded
+    candidates = ["A1", "B7", "DR3", "A1"]
+    columns, weights = ([], np.zeros((0, 2), dtype=np.int64))
+    if recipient_bdr:
+        columns, weights = mismatch_weights(memory.partitions[(0, "O")].columns, recipient_bdr, memory.mantigens, {})
+    compatible, _ = pushdown.partitions[(0, "O")].split(["A2"])
+    expected, _ = memory.partitions[(0, "O")].split(["A2"])
+
+    with patch.object(DonorSQL, "indicators", side_effect=AssertionError("read into memory")):
+        assert carriers(compatible.carrier_counts(candidates, columns, weights)) == carriers(
+            expected.carrier_counts(candidates, columns, weights)
+        )
+        assert compatible.incompatible_count(["B8", "DR3"]) == expected.incompatible_count(["B8", "DR3"])
+
+
+def test_pushdown_donors_are_a_donor_engine_of_their_own(loaded):
+    pushdown, memory = loaded
+    partition = pushdown.partitions[(1, "A")]
+
+    assert isinstance(partition, DonorEngine) and not isinstance(partition, DonorBitsets)
+    assert partition.compact() is partition and partition.row_weights is None
+    assert len(partition) == len(memory.partitions[(1, "A")])
+    assert pushdown_path(Path("pushdown"), "f" * 64, "donors").name == f"{'f' * 64}-donors.pushdown.db"
+
+
+def test_artifact_is_built_once_and_checked_against_the_database(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    pushdown_dir = tmp_path / "pushdown"
+    first = DataLoader(db_path=database, table_name="donors", pushdown_dir=str(pushdown_dir))
+    with patch.object(DataLoader, "donor_chunks", side_effect=AssertionError("rebuilt")):
+        second = DataLoader(db_path=database, table_name="donors", pushdown_dir=str(pushdown_dir))
+
+    assert first.donors is None and second.pushdown.path == first.pushdown.path
+    assert second.pushdown.key["donor_table"] == "donors"
+    assert not list(pushdown_dir.glob("*.tmp"))
+
+    with sqlite3.connect(first.pushdown.path) as conn:
+        conn.execute("UPDATE meta SET key = '{}'")
+    conn.close()
+    with pytest.raises(DataLoadError, match="could not be used"):
+        DataLoader(db_path=database, table_name="donors", pushdown_dir=str(pushdown_dir))
+
+
+def test_connections_cap_their_page_cache(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    path = DataLoader(db_path=database, table_name="donors", pushdown_dir=str(tmp_path)).pushdown.path
+
+    assert PushdownStore(path, cache_kb=512).query("PRAGMA cache_size") == [(-512,)]
+
+
+def test_closing_a_release_closes_its_connections(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    data = DataLoader(db_path=database, table_name="donors", pushdown_dir=str(tmp_path)).base_data
+    store = data.donors[0].store
+    conn = store.connection()
+    elsewhere = threading.Thread(target=store.connection)
+    elsewhere.start()
+    elsewhere.join()
+    assert len(store._connections) == 2
+
+    data.close()
+    assert not store._connections
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert len(data.donors[0]) == len(mock_donors)  # a request still finishing on it reconnects
+
+
+def test_donors_without_ids_read_back_by_row(tmp_path):
+    path = tmp_path / "donors.pushdown.db"
+    write_pushdown(path, [mock_donors.drop(columns="id")], {"donor_table": "donors"})
+    frame = DonorSQL(PushdownStore(path)).frame
+
+    assert "id" not in frame and list(frame.index) == list(range(len(mock_donors)))
+    assert frame.drop(columns="bg").equals(mock_donors.drop(columns=["id", "bg"]).set_axis(frame.index))
+
+
+def test_pushdown_excludes_in_memory_layouts(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    with pytest.raises(DataLoadError, match="Pushdown"):
+        DataLoader(db_path=database, table_name="donors", pushdown_dir=str(tmp_path), compact_donors=True)
+    loader = DataLoader(db_path=database, table_name="donors", pushdown_dir=str(tmp_path))
+    with pytest.raises(DataLoadError, match="snapshot"):
+        loader.write_snapshot(tmp_path / "donors.snapshot")
@@ -0,0 +1,104 @@
+"""tests for data releases served side by side"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.data import CalculatorData
+from api.postings import antigen_indexes
+from api.releases import DEFAULT_RELEASE, ReleaseCache, UnknownRelease, load_release, loaded_nbytes
+from api.store import DonorStore, write_store
+
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+
+
+def release(nbytes: int = 0, release: str = None, **settings):
+    """a stand-in release holding one array of nbytes, loaded with DataLoader settings"""
+    bits = np.zeros(nbytes, dtype=np.uint8)
+    return MagicMock(donors=(), partitions={"bits": bits}, indexes={}, provenance=None, release=release)
+
+
+def test_loaded_nbytes_counts_shared_arrays_once():
+    donors = (DonorBitsets(mock_donors),)
+    partitions = blood_group_partitions(donors)
+    data = SimpleNamespace(donors=donors, partitions=partitions, indexes=antigen_indexes(partitions, donors[0].columns))
+    alone = loaded_nbytes(SimpleNamespace(donors=donors, partitions={}, indexes={}))
+
+    assert loaded_nbytes(data) > alone >= donors[0]._bits.nbytes
+    assert loaded_nbytes(SimpleNamespace(donors=donors * 2, partitions={}, indexes={})) == alone
+
+
+def test_loaded_nbytes_counts_source_frames_but_not_mapped_pages(tmp_path):
+    donors = DonorBitsets(mock_donors)
+    path = tmp_path / "donors.store"
+    write_store(path, (donors,), {"donor_database_sha256": "c" * 64, "donor_table": "donors", "compact": False})
+    store = DonorStore(path)
+
+    assert donors.nbytes >= donors._bits.nbytes + mock_donors.memory_usage(deep=True).sum()
+    assert loaded_nbytes(SimpleNamespace(donors=store.donor_sets(), partitions=store.partitions(), indexes={})) == 0
+
+
+def test_named_releases_load_once_and_unknown_ones_are_rejected():
+    loads, default = [], release()
+    cache = ReleaseCache(
+        {"v3": {"matchability_ver": 3}},
+        default=CalculatorData(loader=lambda: default),
+        loader=lambda **settings: loads.append(settings) or release(**settings),
+    )
+
+    assert cache.load() is cache.load(DEFAULT_RELEASE) is default
+    v3 = cache.load("v3")
+    assert asyncio.run(cache.get("v3")) is cache.load("v3") is v3
+    assert v3.release == "v3"
+    assert loads == [{"matchability_ver": 3, "release": "v3"}]
+    with pytest.raises(UnknownRelease):
+        cache.load("v9")
+    with pytest.raises(ValueError):
+        ReleaseCache({DEFAULT_RELEASE: {}})
+
+
+def test_least_recently_used_release_is_unloaded_over_budget():
+    cache = ReleaseCache(
+        {"a": {}, "b": {}, "c": {}},
+        memory_budget=2500,
+        default=CalculatorData(loader=lambda: release(500)),
+        loader=lambda **settings: release(1000, **settings),
+    )
+    unloaded = []
+    cache.listeners.append(unloaded.append)
+    cache.load()
+
+    a, b = cache.load("a"), cache.load("b")
+    cache.load("a")
+    cache.load("c")
+
+    assert unloaded == [b]
+    b.close.assert_called_once()
+    a.close.assert_not_called()
+    assert [info.loaded for info in cache.stats().releases] == [True, True, False, True]
+    assert cache.stats().resident_bytes == 2500
+    assert cache.load("a") is a
+    assert cache.load("b") is not b
+    assert cache.evictions == 2
+
+
+def test_a_release_larger_than_the_budget_is_still_served():
+    cache = ReleaseCache({"big": {}}, memory_budget=10, loader=lambda **settings: release(1000, **settings))
+
+    assert cache.load("big").release == "big"
+    assert cache.evictions == 0
+
+
+def test_pool_workers_load_releases_by_name(monkeypatch):
+    default = release()
+    cache = ReleaseCache({"v3": {}}, default=CalculatorData(loader=lambda: default), loader=lambda **s: release(**s))
+    monkeypatch.setattr("api.releases.release_cache", cache)
+
+    assert load_release(None) is default
+    assert load_release("v3").release == "v3"
+    assert load_release(default) is default
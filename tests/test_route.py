@@ -1,16 +1,25 @@
 """Calculator API endpoint tests"""
 
+import json
+import threading
 import warnings
 from datetime import datetime
 from unittest.mock import MagicMock
 
 import pandas as pd
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
-from api import api
-from api.data import DataProvenance
-from api.route import load_data
+from api import api, route
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.cache import result_cache
+from api.data import CalculatorData, DataLoadError, DataProvenance
+from api.executor import CalculationPool, CalculationTimeout
+from api.grades import grade_classes
+from api.postings import antigen_indexes
+from api.releases import ReleaseCache
+from api.route import load_data, release_swapped
 
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
@@ -26,6 +35,10 @@ mock_mbands = {
 mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
 mock_data = MagicMock()
 mock_data.donors = (mock_donors, mock_donors)
+mock_data.partitions = blood_group_partitions((DonorBitsets(mock_donors), DonorBitsets(mock_donors)))
+mock_data.indexes = antigen_indexes(
+    mock_data.partitions, mock_donors.columns[2:], grade_classes(mock_data.partitions, mock_mantigens)
+)
 mock_data.antigens = {
     "A": ["A1", "A43"],
     "B": ["B7", "B8", "B12", "B42", "B46"],
@@ -184,3 +197,380 @@ def test_calc_rejects_unsupported_recipient_hla(recip_hla):
         assert detail["invalid"]
     finally:
         api.dependency_overrides.clear()
+
+
+def test_calc_batch_matches_calc_and_reports_errors_per_record():
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        queries = [
+            {"bg": "A"},
+            {"bg": "B", "specs": "A43,B7,B8,DR17,DR3"},
+            {"bg": "O", "specs": "DR17,B42,B46,DR9", "recip_hla": "B7"},
+            {"bg": "A", "recip_hla": "B44,DR17", "donor_set": 1},
+        ]
+        records = [{"id": f"r{n}", **query} for n, query in enumerate(queries)]
+        records.insert(2, {"id": "bad-spec", "bg": "A", "specs": "A9999"})
+        records.append({"id": 99, "bg": "C"})
+
+        response = client.post("/calc/batch", json={"records": records})
+
+        assert response.status_code == 200
+        items = response.json()["results"]
+        assert [item["id"] for item in items] == [record["id"] for record in records]
+        assert items[2]["result"] is None
+        assert items[2]["error"]["field"] == "specs"
+        assert items[-1]["error"]["field"] == "bg"
+
+        batch_results = [item["result"] for item in items if item["result"] is not None]
+        for query, batch_result in zip(queries, batch_results):
+            single = client.get("/calc/", params=query).json()
+            single.pop("calculated_at")
+            batch_result.pop("calculated_at")
+            assert batch_result == single
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_batch_streams_the_same_items_as_ndjson():
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        records = [
+            {"id": "r0", "bg": "A", "specs": "A1,B7"},
+            {"id": "bad-spec", "bg": "A", "specs": "A9999"},
+            {"id": "r2", "bg": "O", "recip_hla": "B7"},
+            {"id": "r3", "bg": "A", "recip_hla": "B44,DR17", "donor_set": 1},
+            {"id": 99, "bg": "C"},
+        ]
+        expected = client.post("/calc/batch", json={"records": records}).json()["results"]
+        response = client.post("/calc/batch", json={"records": records}, headers={"Accept": "application/x-ndjson"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["position"] for line in lines[:2]] == [1, 4]
+        assert sorted(line["position"] for line in lines) == list(range(len(records)))
+        for line in lines:
+            item = expected[line.pop("position")]
+            for result in (line["result"], item["result"]):
+                if result is not None:
+                    result.pop("calculated_at")
+            assert line == item
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_batch_stream_ends_with_an_abort_line(monkeypatch):
+    def overrun(data, members):
+        raise CalculationTimeout("calculation exceeded its deadline")
+
+    monkeypatch.setattr("api.route.calculate_block", overrun)
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        records = [{"id": "bad-spec", "bg": "A", "specs": "A9999"}, {"id": "r1", "bg": "A"}]
+        response = client.post("/calc/batch", json={"records": records}, headers={"Accept": "application/x-ndjson"})
+
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[0]["id"] == "bad-spec"
+        assert lines[1]["status_code"] == 504 and "deadline" in lines[1]["detail"]
+        assert len(lines) == 2
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_batch_keeps_the_blocks_calculated_before_one_overruns(monkeypatch):
+    calculate_block = route.calculate_block
+
+    def overrun_group_o(data, members):
+        if members[0][1].bg == "O":
+            raise CalculationTimeout("calculation exceeded its 10s deadline")
+        return calculate_block(data, members)
+
+    monkeypatch.setattr("api.route.calculate_block", overrun_group_o)
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        records = [{"id": "a", "bg": "A", "specs": "A1"}, {"id": "o", "bg": "O"}, {"id": "bad", "bg": "C"}]
+        response = client.post("/calc/batch", json={"records": records})
+
+        assert response.status_code == 200
+        a, o, bad = response.json()["results"]
+        assert a["id"] == "a" and a["result"]["results"]["crf"] is not None
+        assert o["id"] == "o" and o["result"] is None and "deadline" in o["error"]["message"]
+        assert bad["error"]["field"] == "bg"
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_batch_rejects_a_malformed_body():
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        assert client.post("/calc/batch", json={"records": [{"bg": "A"}]}).status_code == 422
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_repeats_are_served_from_the_result_cache(monkeypatch):
+    monkeypatch.delenv("MATCHBOX_ADMIN_TOKEN", raising=False)
+    assert client.get("/calc/cache").status_code == 404
+    monkeypatch.setenv("MATCHBOX_ADMIN_TOKEN", "secret")
+    admin = {"Authorization": "Bearer secret"}
+    assert client.get("/calc/cache").status_code == 401
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        first = client.get("/calc/", params={"bg": "O", "specs": "B7,A1", "recip_hla": "B12,DR3"})
+        before = client.get("/calc/cache", headers=admin).json()
+        second = client.get("/calc/", params={"bg": "O", "specs": "A1,B7", "recip_hla": "DR17,B44"})
+        after = client.get("/calc/cache", headers=admin).json()
+
+        assert second.json()["results"] == first.json()["results"]
+        assert second.json()["specs"] == ["A1", "B7"]
+        assert after["hits"] == before["hits"] + 1
+        assert after["misses"] == before["misses"]
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_marginals_match_calc_for_each_what_if():
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        params = {"bg": "O", "specs": "A1,B7", "recip_hla": "B12,DR3"}
+        response = client.get("/calc/marginals", params={**params, "candidates": "B8,DR3"})
+        body = response.json()
+        without_b7 = client.get("/calc/", params={**params, "specs": "A1"}).json()["results"]
+        with_b8 = client.get("/calc/", params={**params, "specs": "A1,B7,B8"}).json()["results"]
+
+        assert response.status_code == 200
+        assert body["results"] == client.get("/calc/", params=params).json()["results"]
+        assert [m["antigen"] for m in body["removed"]] == ["A1", "B7"]
+        assert [m["antigen"] for m in body["added"]] == ["B8", "DR3"]
+        assert body["removed"][1]["crf"] == without_b7["crf"]
+        assert body["removed"][1]["favourable"] == without_b7["favourable"]
+        assert body["added"][0]["crf"] == with_b8["crf"]
+        assert body["added"][0]["favourable"] == with_b8["favourable"]
+
+        default = client.get("/calc/marginals", params={"bg": "O", "specs": "A1"}).json()
+        assert [m["antigen"] for m in default["added"]] == [
+            "A43",
+            "B7",
+            "B8",
+            "B12",
+            "B42",
+            "B46",
+            "DR3",
+            "DR9",
+            "DR17",
+        ]
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_marginals_rejects_candidates_outside_exposed_vocabulary():
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        response = client.get("/calc/marginals", params={"bg": "O", "specs": "A1", "candidates": "A1,A999"})
+
+        assert response.status_code == 422
+        assert response.json()["detail"]["field"] == "candidates"
+        assert response.json()["detail"]["invalid"] == ["A999"]
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_plan_returns_ranked_relaxations_below_target():
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        params = {"bg": "O", "specs": "A1,B7,B8,B12,DR3,DR17", "recip_hla": "B12,DR3", "target": 0.5}
+        response = client.get("/calc/plan", params=params)
+        body = response.json()
+        first = body["plans"][0]
+        relaxed = client.get("/calc/", params={**params, "specs": ",".join(first["specs"])}).json()["results"]
+
+        assert response.status_code == 200
+        assert body["results"]["crf"] >= 0.5
+        assert all(plan["crf"] < 0.5 for plan in body["plans"])
+        assert (first["crf"], first["favourable"]) == (relaxed["crf"], relaxed["favourable"])
+        assert client.get("/calc/plan", params={**params, "target": 0}).status_code == 422
+    finally:
+        api.dependency_overrides.clear()
+
+
+def test_calc_is_shed_with_503_when_the_pool_is_full(monkeypatch):
+    monkeypatch.setenv("MATCHBOX_ADMIN_TOKEN", "secret")
+    full = CalculationPool(workers=1, queue_size=0)
+    full.in_flight = 1  # one calculation running, and no room to queue another
+    monkeypatch.setattr("api.route.calculation_pool", full)
+    api.dependency_overrides[load_data] = lambda: mock_data
+    try:
+        response = client.get("/calc/", params={"bg": "O", "specs": "A1,DR17", "recip_hla": "B8"})
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert client.get("/calc/pool").status_code == 401
+        assert client.get("/calc/pool", headers={"Authorization": "Bearer secret"}).json()["rejected"] == 1
+    finally:
+        api.dependency_overrides.clear()
+        full.shutdown()
+
+
+def test_healthz_answers_while_data_is_loading(monkeypatch):
+    loading = threading.Event()
+    data = CalculatorData(loader=lambda: loading.wait(5) and mock_data)
+    monkeypatch.setattr("api.route.calculator_data", data)
+    data.start()
+
+    assert client.get("/healthz").json() == {"status": "ok"}
+    assert client.get("/readyz").status_code == 503
+    assert client.get("/readyz").json()["status"] == "loading"
+
+    loading.set()
+    data._thread.join(timeout=5)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert response.json()["provenance"]["donor_database_sha256"] == "a" * 64
+
+
+def test_requests_get_503_when_data_failed_to_load(monkeypatch):
+    def fail():
+        raise DataLoadError("Donor database not found: donors.db")
+
+    failed = CalculatorData(loader=fail)
+    monkeypatch.setattr("api.route.calculator_data", failed)
+    monkeypatch.setattr(route.release_cache, "default", failed)
+    monkeypatch.delitem(api.dependency_overrides, load_data, raising=False)
+
+    response = client.get("/broad-split/")
+    assert response.status_code == 503
+    assert "donors.db" in response.json()["detail"]
+    assert client.get("/readyz").json()["status"] == "failed"
+
+
+def test_admin_reload_needs_the_admin_token(monkeypatch):
+    data = CalculatorData(loader=lambda **settings: mock_data)
+    data.load()
+    monkeypatch.setattr("api.route.calculator_data", data)
+
+    monkeypatch.delenv("MATCHBOX_ADMIN_TOKEN", raising=False)
+    assert client.post("/admin/reload").status_code == 404
+    monkeypatch.setenv("MATCHBOX_ADMIN_TOKEN", "secret")
+    assert client.post("/admin/reload").status_code == 401
+    assert client.post("/admin/reload", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.post("/admin/reload", headers={"Authorization": "Bearer secret"}, json={"matchability_ver": 5})
+    assert response.status_code == 202
+    assert response.json()["provenance"]["donor_database_sha256"] == "a" * 64
+    assert (
+        client.post(
+            "/admin/reload", headers={"Authorization": "Bearer secret"}, json={"matchability_ver": 0}
+        ).status_code
+        == 422
+    )
+
+
+@pytest.mark.parametrize("table_name", ["", "donors; DROP TABLE donors", "donors--", "1donors", 'donors"'])
+def test_admin_reload_rejects_a_malformed_table_name(monkeypatch, table_name):
+    data = CalculatorData(loader=lambda **settings: mock_data)
+    data.load()
+    monkeypatch.setattr("api.route.calculator_data", data)
+    monkeypatch.setenv("MATCHBOX_ADMIN_TOKEN", "secret")
+
+    headers = {"Authorization": "Bearer secret"}
+    response = client.post("/admin/reload", headers=headers, json={"table_name": table_name})
+    assert response.status_code == 422
+    assert not data.reloading
+
+
+def test_hot_swap_drops_the_old_releases_cached_results(monkeypatch):
+    new_release = MagicMock()
+    new_release.provenance = mock_data.provenance.model_copy(update={"donor_database_sha256": "b" * 64})
+    monkeypatch.setattr("api.route.calculation_pool", CalculationPool(workers=1))
+    api.dependency_overrides[load_data] = lambda: mock_data
+    client.get("/calc/", params={"bg": "O", "specs": "A1"})
+    assert result_cache.stats().size > 0
+
+    release_swapped(mock_data, new_release, {})
+
+    assert result_cache.stats().size == 0
+    assert route.calculation_pool.initargs == ({},)
+
+
+@pytest.fixture
+def releases(monkeypatch):
+    """the mock data as the default release, and a "v3" with halved matchability bands"""
+    v3 = MagicMock(**{name: getattr(mock_data, name) for name in ("donors", "partitions", "indexes", "antigens")})
+    v3.configure_mock(
+        release="v3",
+        mantigens=mock_mantigens,
+        mbands={bg: {band: count // 2 for band, count in bands.items()} for bg, bands in mock_mbands.items()},
+        antigen_defaults=mock_ag_defaults,
+        broad_split=mock_data.broad_split,
+        provenance=mock_data.provenance.model_copy(update={"matchability_band_version": 3}),
+    )
+    default = CalculatorData(loader=lambda: mock_data)
+    cache = ReleaseCache({"v3": {"matchability_ver": 3}}, default=default, loader=lambda **settings: v3)
+    monkeypatch.setattr("api.route.release_cache", cache)
+    monkeypatch.delitem(api.dependency_overrides, load_data, raising=False)
+    default.load()
+    return cache
+
+
+def test_calc_selects_a_release_by_name(releases):
+    params = {"bg": "O", "specs": "A1", "recip_hla": "B7,DR9"}
+    default = client.get("/calc/", params=params).json()
+    v3 = client.get("/calc/", params={**params, "release": "v3"}).json()
+
+    assert default["provenance"]["matchability_band_version"] == 7
+    assert v3["provenance"]["matchability_band_version"] == 3
+    assert v3["results"]["matchability"] != default["results"]["matchability"]
+
+    response = client.get("/calc/", params={**params, "release": "v9"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["invalid"] == ["v9"]
+
+
+def test_calc_compare_lists_each_release_side_by_side(releases):
+    params = {"bg": "O", "specs": "A1", "recip_hla": "B7,DR9"}
+    response = client.get("/calc/compare", params=params)
+    assert response.status_code == 200
+    compared = response.json()["releases"]
+
+    assert [entry["release"] for entry in compared] == ["default", "v3"]
+    for entry in compared:
+        single = client.get("/calc/", params={**params, "release": entry["release"]}).json()
+        assert entry["results"] == single["results"]
+        assert entry["provenance"] == single["provenance"]
+
+    assert client.get("/calc/compare", params={**params, "releases": "v3,v9"}).status_code == 422
+    only = client.get("/calc/compare", params={**params, "releases": "v3"}).json()["releases"]
+    assert [entry["release"] for entry in only] == ["v3"]
+
+
+def test_calc_compare_reports_a_release_that_overruns_without_failing_the_rest(releases, monkeypatch):
+    offload = route.offload
+
+    async def overrunning(fn, data, *args):
+        if data.release == "v3":
+            raise HTTPException(status_code=504, detail="calculation exceeded its 10s deadline")
+        return await offload(fn, data, *args)
+
+    monkeypatch.setattr("api.route.offload", overrunning)
+    result_cache.clear()  # so v3 is calculated, not served from an earlier test
+    response = client.get("/calc/compare", params={"bg": "O", "specs": "A1", "recip_hla": "B7,DR9"})
+
+    assert response.status_code == 200
+    default, v3 = response.json()["releases"]
+    assert default["results"] is not None and default["error"] is None
+    assert v3["results"] is None
+    assert v3["error"] == {"status_code": 504, "message": "calculation exceeded its 10s deadline"}
+
+
+def test_calc_releases_reports_which_releases_are_loaded(releases, monkeypatch):
+    monkeypatch.delenv("MATCHBOX_ADMIN_TOKEN", raising=False)
+    assert client.get("/calc/releases").status_code == 404
+    monkeypatch.setenv("MATCHBOX_ADMIN_TOKEN", "secret")
+    admin = {"Authorization": "Bearer secret"}
+    assert [info["loaded"] for info in client.get("/calc/releases", headers=admin).json()["releases"]] == [True, False]
+    client.get("/calc/", params={"bg": "O", "release": "v3"})
+    stats = client.get("/calc/releases", headers=admin).json()
+    assert [info["name"] for info in stats["releases"]] == ["default", "v3"]
+    assert [info["loaded"] for info in stats["releases"]] == [True, True]
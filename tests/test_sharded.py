@@ -0,0 +1,83 @@
+"""tests for sharded batch runs"""
+
+import pytest
+
+from api.batch import BatchRecord, calculate_batch
+from api.chunked import run_chunked
+from api.data import DataLoader
+from api.schemas import BatchCalculationItem
+from api.sharded import Checkpoints, run_sharded, run_sharded_donors
+from tests.helpers import make_database, records
+
+
+@pytest.fixture(scope="module")
+def settings(tmp_path_factory):
+    database = make_database(tmp_path_factory.mktemp("sharded") / "donors.db")
+    return {"db_path": str(database), "table_name": "donors", "use_snapshot": False}
+
+
+def results(items):
+    """the items without the time each was calculated at"""
+    return [{**item, "result": item["result"] and {**item["result"], "calculated_at": None}} for item in items]
+
+
+def test_sharded_runs_give_the_batch_items_and_resume_from_checkpoints(settings, tmp_path):
+    data = DataLoader(**settings).base_data
+    expected = [
+        BatchCalculationItem.model_validate(item).model_dump(mode="json") for item in calculate_batch(data, records)
+    ]
+    progress = []
+
+    items = run_sharded(
+        records, settings, workers=2, shard_size=1, checkpoint_dir=str(tmp_path), progress=progress.append
+    )
+    assert results(items) == results(expected)
+    assert [status.done for status in progress] == list(range(len(records) + 1))
+
+    progress.clear()
+    assert (
+        run_sharded(records, settings, workers=2, shard_size=1, checkpoint_dir=str(tmp_path), progress=progress.append)
+        == items
+    )
+    assert [(status.done, status.resumed) for status in progress] == [(len(records), len(records))]
+
+
+def test_donor_shards_add_up_to_a_chunked_run(settings):
+    loader = DataLoader(**settings, load_donors=False)
+    expected, _ = run_chunked(records, loader, block_rows=9)
+
+    outcomes, throughput = run_sharded_donors(records, settings, workers=2, shard_donors=30, block_rows=9)
+    assert [(position, repr(outcome)) for position, _, outcome in outcomes] == [
+        (position, repr(outcome)) for position, _, outcome in expected
+    ]
+    assert (throughput.donors, throughput.blocks) == (100, 3 * 4 + 2)
+
+
+def test_resumed_donor_shards_do_not_count_towards_throughput(settings, tmp_path):
+    run = {"workers": 2, "shard_donors": 30, "block_rows": 9, "checkpoint_dir": str(tmp_path)}
+    first, _ = run_sharded_donors(records, settings, **run)
+    checkpoints = sorted(tmp_path.rglob("shard-*.json"))
+    checkpoints[-1].unlink()  # the last shard, rows 90 to 99, is calculated again
+
+    resumed, throughput = run_sharded_donors(records, settings, **run)
+    assert [repr(outcome) for _, _, outcome in resumed] == [repr(outcome) for _, _, outcome in first]
+    assert (throughput.donors, throughput.blocks) == (10, 2)
+    assert throughput.donors_per_second == pytest.approx(10 / throughput.seconds)
+
+
+def test_checkpoints_belong_to_one_job(tmp_path):
+    job = {"records": [BatchRecord(id=1, bg="O").model_dump()]}
+    checkpoints = Checkpoints(str(tmp_path), job)
+    checkpoints.save(0, [{"id": 1}])
+
+    assert Checkpoints(str(tmp_path), job).load(0) == [{"id": 1}]
+    assert Checkpoints(str(tmp_path), {**job, "shard_size": 2}).load(0) is None
+    assert Checkpoints(None, job).load(0) is None
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_sharded_runs_reject_empty_pools(settings):
+    with pytest.raises(ValueError):
+        run_sharded(records, settings, workers=0)
+    with pytest.raises(ValueError):
+        run_sharded_donors(records, settings, shard_donors=0)
@@ -0,0 +1,106 @@
+"""tests for precompiled cohort snapshots"""
+
+import os
+import sqlite3
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from api.calculator import Calculator
+from api.cli import main
+from api.data import DataLoader
+from tests.helpers import make_database
+
+SHARED_FIELDS = ("antigens", "mbands", "mantigens", "antigen_defaults", "broad_split", "provenance")
+
+
+@pytest.fixture
+def database(tmp_path):
+    return make_database(tmp_path / "donors.db")
+
+
+def loader(database, **kwargs):
+    return DataLoader(db_path=str(database), table_name="donors", **kwargs)
+
+
+def test_snapshot_loads_the_same_data_without_the_database(database):
+    reference = loader(database, use_snapshot=False).base_data
+    loader(database, use_snapshot=False).write_snapshot()
+
+    with patch.object(DataLoader, "_load_table", side_effect=AssertionError("read the database")):
+        mapped = loader(database)
+        data = mapped.base_data
+
+    assert mapped.snapshot is not None and mapped.conn is None
+    for field in SHARED_FIELDS:
+        assert getattr(data, field) == getattr(reference, field)
+    kwargs = {
+        "recipient_bdr": {"B": {"B7"}, "DR": {"DR3"}},
+        "hla_bdr": reference.mantigens,
+        "ag_defaults": reference.antigen_defaults,
+        "matchability_bands": reference.mbands,
+    }
+    for key, index in reference.indexes.items():
+        for specs in ([], ["A2", "B8"]):
+            expected = Calculator(donors=index, specs=specs, abo=key[1], **kwargs).calculate()
+            assert Calculator(donors=data.indexes[key], specs=specs, abo=key[1], **kwargs).calculate() == expected
+
+
+def test_snapshot_of_another_database_or_layout_is_ignored(database):
+    loader(database, use_snapshot=False).write_snapshot()
+
+    assert loader(database, compact_donors=True).snapshot is None
+    with sqlite3.connect(database) as conn:
+        conn.execute("UPDATE donors SET A1 = 1 - A1 WHERE id = 1")
+    assert loader(database).snapshot is None
+
+
+def test_corrupt_snapshot_falls_back_to_the_database(database):
+    snapshot = loader(database, use_snapshot=False).write_snapshot()
+    snapshot.write_bytes(snapshot.read_bytes()[:-100])
+
+    fallback = loader(database)
+    assert fallback.snapshot is None
+    assert fallback.base_data.provenance == loader(database, use_snapshot=False).base_data.provenance
+
+
+def test_snapshot_start_trusts_an_unchanged_database_without_hashing_it(database):
+    loader(database, use_snapshot=False).write_snapshot()
+    expected = loader(database, use_snapshot=False).provenance
+
+    hashed, framed = AssertionError("hashed the database"), AssertionError("built a pandas frame")
+    with (
+        patch.object(DataLoader, "_file_sha256", side_effect=hashed),
+        patch.object(pd.DataFrame, "__init__", side_effect=framed),
+    ):
+        mapped = loader(database)
+        assert mapped.base_data.provenance == expected
+    mapped.snapshot_verification.join(timeout=5)
+    assert mapped.health.healthy
+
+    os.utime(database, ns=(1, 1))  # same contents, so it is hashed and still matches
+    with patch.object(DataLoader, "_file_sha256", wraps=DataLoader._file_sha256) as rehash:
+        assert loader(database).snapshot is not None
+    rehash.assert_called_once()
+
+
+def test_snapshot_with_an_altered_payload_is_unverified(database):
+    snapshot = loader(database, use_snapshot=False).write_snapshot()
+    payload = bytearray(snapshot.read_bytes())
+    payload[-1] ^= 1  # a flipped bit in the last packed word, with the header intact
+    snapshot.write_bytes(bytes(payload))
+
+    mapped = loader(database)
+    mapped.snapshot_verification.join(timeout=5)
+    assert not mapped.health.healthy
+    assert snapshot.name in mapped.health.detail
+
+
+def test_snapshot_build_command(database, tmp_path, capsys):
+    output = tmp_path / "release" / "donors.snapshot"
+    assert main(["snapshot", "build", "--db", str(database), "--table", "donors", "--output", str(output)]) == 0
+    assert str(output) in capsys.readouterr().out
+    assert loader(database, snapshot_path=str(output)).snapshot is not None
+
+    assert main(["snapshot", "build", "--db", str(tmp_path / "missing.db"), "--output", str(output)]) == 1
@@ -0,0 +1,157 @@
+"""tests for the sparse donor cohort"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.calculator import Calculator, mismatch_counts, split_by_dsa
+from api.data import DataLoader, DataLoadError
+from api.grades import grade_classes
+from api.postings import antigen_indexes
+from api.sparse import DonorCSR
+from tests.helpers import make_database
+
+# load mock donors once
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_bitsets = DonorBitsets(mock_donors)
+mock_csr = DonorCSR(mock_donors)
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {
+    "A": {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0},
+    "B": {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0},
+    "O": {1: 45, 2: 35, 3: 30, 4: 25, 5: 20, 6: 15, 7: 10, 8: 5, 9: 2, 10: 1},
+    "AB": {1: 10, 2: 5, 3: 3, 4: 2, 5: 1, 6: 0},
+}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+
+
+def test_entries_hold_only_the_antigens_donors_carry():
+    antigens = mock_donors.drop(columns=["id", "bg"])
+
+    assert mock_csr.nnz == int(antigens.eq(1).to_numpy().sum())
+    assert len(mock_csr) == len(mock_donors)
+    assert mock_csr.frame.equals(mock_donors)
+
+
+def test_chunks_build_the_same_cohort_as_the_whole_frame():
+    chunked = DonorCSR.from_chunks(mock_donors.iloc[n : n + 7] for n in range(0, len(mock_donors), 7))
+
+    assert chunked.indptr.tolist() == mock_csr.indptr.tolist()
+    assert chunked.indices.tolist() == mock_csr.indices.tolist()
+    assert chunked.frame.equals(mock_donors)
+
+
+@pytest.mark.parametrize("antigens", [[], ["A2"], ["B7", "A1", "B7"], ["DR9", "DR4", "A43"]])
+def test_hits_and_indicators_match_the_bitsets(antigens):
+    for abo in ("A", "O"):
+        assert mock_csr.hits(antigens).tolist() == mock_bitsets.hits(antigens).tolist()
+        sparse, packed = mock_csr.blood_group(abo), mock_bitsets.blood_group(abo)
+        assert (sparse.indicators(antigens) == packed.indicators(antigens)).all()
+    with pytest.raises(KeyError):
+        mock_csr.hits(["A9999"])
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["A1", "B7", "B12", "DR18"], ["DR17", "B42", "B46", "DR9"]])
+def test_split_selects_the_same_donors_as_the_frame(abo, specs):
+    frame = mock_donors[mock_donors.bg == abo]
+    compatible, incompatible = split_by_dsa(mock_csr.partition(abo), specs)
+    expected_compatible, expected_incompatible = split_by_dsa(frame, specs)
+
+    assert compatible.frame.equals(expected_compatible)
+    assert incompatible.frame.equals(expected_incompatible)
+
+
+def test_mismatch_counts_match_the_bitsets():
+    recipient = {"B": {"B7", "B42"}, "DR": {"DR3"}}
+    compatible, _ = mock_csr.split(["A2"])
+    expected, _ = mock_bitsets.split(["A2"])
+
+    sparse = mismatch_counts(compatible, recipient, mock_mantigens, mock_ag_defaults)
+    assert sparse.equals(mismatch_counts(expected, recipient, mock_mantigens, mock_ag_defaults))
+
+
+def test_phenotypes_group_donors_as_the_bitsets_do():
+    columns = ["B7", "B8", "B12", "DR3", "DR9"]
+    sparse, sparse_codes = mock_csr.phenotypes(columns)
+    packed, packed_codes = mock_bitsets.phenotypes(columns)
+
+    assert sorted(map(tuple, sparse)) == sorted(map(tuple, packed))
+    assert (sparse[sparse_codes] == packed[packed_codes]).all()
+
+
+def test_postings_are_the_transposed_entries():
+    partition = mock_csr.partition("O")
+    postings = partition.postings(["A2", "DR9", "A2"])
+
+    assert postings["A2"].dtype == np.int32
+    assert postings["A2"].tolist() == np.flatnonzero(partition.indicators(["A2"])[:, 0]).tolist()
+    assert postings["DR9"].tolist() == np.flatnonzero(partition.indicators(["DR9"])[:, 0]).tolist()
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["B7", "B8", "A24"], ["A43", "DR17"]])
+@pytest.mark.parametrize("recipient_bdr", [None, {"B": {"B7", "B46"}, "DR": {"DR4", "DR3"}}, {"B": {"B42"}}])
+def test_sparse_results_are_identical_to_the_frame(abo, specs, recipient_bdr):
+    """sparse donors are an engine swap, not a different calculation"""
+    partitions = blood_group_partitions((mock_csr,))
+    indexes = antigen_indexes(partitions, mock_csr.columns, grade_classes(partitions, mock_mantigens))
+    kwargs = {
+        "specs": specs,
+        "abo": abo,
+        "recipient_bdr": recipient_bdr,
+        "hla_bdr": mock_mantigens,
+        "ag_defaults": mock_ag_defaults,
+        "matchability_bands": mock_mbands,
+    }
+    reference = Calculator(donors=mock_donors, **kwargs).calculate().model_dump_json()
+
+    assert Calculator(donors=mock_csr, **kwargs).calculate().model_dump_json() == reference
+    assert Calculator(donors=partitions[(0, abo)], **kwargs).calculate().model_dump_json() == reference
+    assert Calculator(donors=indexes[(0, abo)], **kwargs).calculate().model_dump_json() == reference
+
+
+def test_loader_serves_sparse_donors_with_the_same_results(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    sparse = DataLoader(db_path=database, table_name="donors", sparse_donors=True).base_data
+    packed = DataLoader(db_path=database, table_name="donors", use_snapshot=False).base_data
+
+    assert all(isinstance(donors, DonorCSR) for donors in sparse.donors)
+    assert [len(donors) for donors in sparse.donors] == [len(donors) for donors in packed.donors]
+    for key, index in packed.indexes.items():
+        kwargs = {"specs": ["A2", "DR9"], "abo": key[1], "recipient_bdr": {"B": {"B7"}, "DR": {"DR3"}}}
+        kwargs.update(hla_bdr=packed.mantigens, ag_defaults=packed.antigen_defaults, matchability_bands=packed.mbands)
+        expected = Calculator(donors=index, **kwargs).calculate()
+        assert Calculator(donors=sparse.indexes[key], **kwargs).calculate() == expected
+
+
+def test_compacted_sparse_donors_give_the_compacted_bitsets_results():
+    sparse, packed = mock_csr.compact(), mock_bitsets.compact()
+
+    assert sparse.n_rows == packed.n_rows < len(mock_donors) == len(sparse)
+    assert sparse.row_weights.tolist() == packed.row_weights.tolist()
+    assert sparse.index.tolist() == packed.index.tolist()
+    for abo in ("A", "B", "O", "AB"):
+        kwargs = {"specs": ["A2", "B7"], "abo": abo, "recipient_bdr": {"B": {"B8"}, "DR": {"DR3"}}}
+        kwargs.update(hla_bdr=mock_mantigens, ag_defaults=mock_ag_defaults, matchability_bands=mock_mbands)
+        expected = Calculator(donors=mock_donors, **kwargs).calculate()
+        assert Calculator(donors=sparse.partition(abo), **kwargs).calculate() == expected
+    with pytest.raises(ValueError, match="uncompacted"):
+        sparse.compact()
+
+
+def test_loader_compacts_sparse_donors(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    packed = DataLoader(db_path=database, table_name="donors", use_snapshot=False, compact_donors=True).base_data
+    sparse = DataLoader(db_path=database, table_name="donors", sparse_donors=True, compact_donors=True).base_data
+
+    assert all(isinstance(donors, DonorCSR) for donors in sparse.donors)
+    assert [donors.n_rows for donors in sparse.donors] == [donors.n_rows for donors in packed.donors]
+    assert [len(donors) for donors in sparse.donors] == [len(donors) for donors in packed.donors]
+
+
+def test_sparse_donors_are_not_snapshotted(tmp_path):
+    database = str(make_database(tmp_path / "donors.db"))
+    with pytest.raises(DataLoadError, match="snapshot"):
+        DataLoader(db_path=database, table_name="donors", sparse_donors=True).write_snapshot(tmp_path / "s")
@@ -0,0 +1,115 @@
+"""tests for the memory-mapped donor store"""
+
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.bitset import DonorBitsets, blood_group_partitions
+from api.calculator import Calculator
+from api.data import DataLoader, DataLoadError
+from api.store import DonorStore, open_donor_store, store_path, write_store
+
+mock_donors = pd.read_csv("tests/mock_donors.csv")
+mock_ag_defaults = {"B42": "B7", "DR9": "DR4"}
+mock_mbands = {
+    "A": {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0},
+    "B": {1: 35, 2: 30, 3: 25, 4: 20, 5: 15, 6: 10, 7: 5, 8: 2, 9: 1, 10: 0},
+    "O": {1: 45, 2: 35, 3: 30, 4: 25, 5: 20, 6: 15, 7: 10, 8: 5, 9: 2, 10: 1},
+    "AB": {1: 10, 2: 5, 3: 3, 4: 2, 5: 1, 6: 0},
+}
+mock_mantigens = {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}
+duplicated_donors = pd.concat([mock_donors, mock_donors, mock_donors.iloc[:30]], ignore_index=True)
+KEY = {"donor_database_sha256": "c" * 64, "donor_table": "donors", "compact": False}
+
+
+def stored(tmp_path, donor_sets, key=KEY):
+    path = tmp_path / "donors.store"
+    write_store(path, donor_sets, key)
+    return DonorStore(path)
+
+
+def test_stored_partitions_hold_the_same_donors(tmp_path):
+    donor_sets = (DonorBitsets(mock_donors), DonorBitsets(mock_donors[mock_donors.id % 2 == 0]))
+    store = stored(tmp_path, donor_sets)
+    expected = blood_group_partitions(donor_sets)
+
+    assert store.columns == donor_sets[0].columns
+    for key, partition in store.partitions().items():
+        assert len(partition) == len(expected[key])
+        assert partition.frame.reset_index(drop=True).equals(expected[key].frame.reset_index(drop=True))
+        # labels are source row numbers, as the store keeps no source frame
+        source = donor_sets[key[0]].source
+        assert list(partition.index) == list(source.index.get_indexer(expected[key].index))
+
+
+def test_stored_arrays_are_read_only_views_of_the_mapping(tmp_path):
+    store = stored(tmp_path, (DonorBitsets(mock_donors),))
+    partition = store.partitions()[(0, "O")]
+
+    assert isinstance(partition._bits.base, np.memmap) or isinstance(partition._bits.base.base, np.memmap)
+    with pytest.raises(ValueError):
+        partition._bits[0, 0] = 0
+
+
+@pytest.mark.parametrize("abo", ["A", "B", "O", "AB"])
+@pytest.mark.parametrize("specs", [[], ["A2"], ["B7", "B8", "A24"]])
+@pytest.mark.parametrize("compact", [False, True])
+def test_store_results_are_identical_to_the_frame(tmp_path, abo, specs, compact):
+    donors = DonorBitsets(duplicated_donors)
+    store = stored(tmp_path, (donors.compact() if compact else donors,))
+    kwargs = {
+        "specs": specs,
+        "abo": abo,
+        "recipient_bdr": {"B": {"B7"}, "DR": {"DR3"}},
+        "hla_bdr": mock_mantigens,
+        "ag_defaults": mock_ag_defaults,
+        "matchability_bands": mock_mbands,
+    }
+    reference = Calculator(donors=duplicated_donors, **kwargs).calculate().model_dump_json()
+
+    for donor_set in (store.partitions()[(0, abo)], store.donor_sets()[0]):
+        assert Calculator(donors=donor_set, **kwargs).calculate().model_dump_json() == reference
+
+
+def test_open_donor_store_builds_once_and_checks_its_key(tmp_path):
+    path = tmp_path / "stores" / "donors.store"
+    builds = []
+
+    def build():
+        builds.append(1)
+        return (DonorBitsets(mock_donors),)
+
+    open_donor_store(path, KEY, build)
+    store = open_donor_store(path, KEY, build)
+
+    assert len(builds) == 1
+    assert len(store.donor_sets()[0]) == len(mock_donors)
+    assert not list(path.parent.glob("*.tmp"))
+    with pytest.raises(ValueError, match="different data"):
+        open_donor_store(path, {**KEY, "donor_database_sha256": "d" * 64}, build)
+
+
+def test_data_loader_maps_the_store_instead_of_loading_donors(tmp_path):
+    dpb_typed = mock_donors.filter(like="DPB").eq(1).any(axis=1)
+    with (
+        patch("sqlite3.connect"),
+        patch.object(DataLoader, "_file_sha256", return_value="c" * 64),
+        patch.object(DataLoader, "_load_donors", return_value=mock_donors) as load_donors,
+    ):
+        first = DataLoader(store_dir=str(tmp_path))
+        second = DataLoader(store_dir=str(tmp_path))
+
+    assert load_donors.call_count == 1
+    assert first.donors is None and second.donors is None
+    assert store_path(tmp_path, "c" * 64, first.table_name, False).exists()
+    assert [len(donors) for donors in second.store.donor_sets()] == [len(mock_donors), dpb_typed.sum()]
+
+
+def test_unusable_store_is_a_data_load_error(tmp_path):
+    path = store_path(tmp_path, "c" * 64, "donors", False)
+    path.write_bytes(b"not a store")
+    with patch("sqlite3.connect"), patch.object(DataLoader, "_file_sha256", return_value="c" * 64):
+        with pytest.raises(DataLoadError, match="could not be used"):
+            DataLoader(store_dir=str(tmp_path), table_name="donors")
@@ -26,13 +26,22 @@ from fastapi.testclient import TestClient
 
 from api import api
 from api.assets import asset_version
+from api.bitset import DonorBitsets, blood_group_partitions
 from api.data import DataProvenance
+from api.grades import grade_classes
+from api.postings import antigen_indexes
 from api.route import load_data
 
 mock_donors = pd.read_csv("tests/mock_donors.csv")
 mock_donors_dp = mock_donors.iloc[:10].copy()
 mock_data = MagicMock()
 mock_data.donors = (mock_donors, mock_donors_dp)
+mock_data.partitions = blood_group_partitions((DonorBitsets(mock_donors), DonorBitsets(mock_donors_dp)))
+mock_data.indexes = antigen_indexes(
+    mock_data.partitions,
+    mock_donors.columns[2:],
+    grade_classes(mock_data.partitions, {"B": ["B7", "B8", "B12", "B42", "B46"], "DR": ["DR3", "DR9"]}),
+)
 mock_data.antigens = {
     "A": ["A1", "A43"],
     "B": ["B7", "B8", "B12", "B42", "B46"],